@@ -0,0 +1,523 @@
+'''Benchmark memory importer
+
+    python bench.py fix_up_directory
+    python bench.py suite [--count N] [--depth N] [--member-size N]
+                          [--compression stored|deflated] [--ext-share F]
+                          [--repeat N] [--json FILE]
+    python bench.py threads [--count N] [--threads N [N ...]] [--repeat N]
+    python bench.py read_member [--sizes MB [MB ...]] [--repeat N]
+
+The suite builds a synthetic archive, uses a stub `_memimporter` if the real
+one is unavailable, and writes the results as JSON, so they can be compared
+between releases. The threads benchmark shows how concurrent imports scale
+across cores, run it on a free-threaded build to see the speedups.
+'''
+
+import sys
+import time
+from os import sep
+
+
+def make_directory(count, depth=3, width=20, explicit_dirs=False):
+    '''Return a synthetic zip directory, likes `zipimport._read_directory`.'''
+    archive = 'bench.zip'
+    files = {}
+    i = 0
+    while len(files) < count:
+        parts = []
+        n = i
+        for _ in range(depth):
+            n, r = divmod(n, width)
+            parts.append(f'pkg{r}')
+        dirpath = sep.join(reversed(parts))
+        if explicit_dirs:
+            for j in range(1, depth + 1):
+                files.setdefault(sep.join(reversed(parts[-j:])) + sep, None)
+        path = f'{dirpath}{sep}mod{i}.py'
+        files[path] = (f'{archive}{sep}{path}', 8, 100, 200, i * 300, 0, 0, i)
+        i += 1
+    return files
+
+
+# The previous implementation of `zipextimporter._fix_up_directory`, for comparison.
+def _fix_up_directory_old(files, archive=None):
+    def ensure_archive(path):
+        nonlocal archive, filter
+        archive = files[path][0][:-len(path)].rstrip(sep)
+        filter = fix_up_1
+        fix_up_1(path)
+    def fix_up_0(path):
+        nonlocal count
+        while True:
+            i = path.rfind(sep)
+            if i < 0:
+                return
+            dirpath = path[:i+1]
+            if dirpath in files:
+                return
+            path = path[:i]
+            files[dirpath] = None
+            count += 1
+    def fix_up_1(path):
+        nonlocal filter
+        fix_up_0(path)
+        if sep in path:
+            if count == 0:
+                return 1  # quick finish
+            filter = fix_up_0
+    count = 0
+    filter = archive is None and ensure_archive or fix_up_1
+    for path in tuple(files):
+        if filter(path):
+            break
+    return files
+
+
+def timeit(func, make_args=tuple, repeat=3):
+    '''Return the best time of the repeats, in seconds.
+    The arguments are made by `make_args()` for each repeat, out of timing.
+    '''
+    best = None
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_fix_up_directory(counts=(10_000, 100_000, 1_000_000), repeat=3):
+    import zipextimporter
+    verbose = zipextimporter.verbose
+    zipextimporter.set_verbose(0)
+    print(f'{"entries":>10} {"old (s)":>10} {"new (s)":>10} {"speedup":>8}')
+    try:
+        for count in counts:
+            files = make_directory(count)
+            make_args = lambda: (dict(files), 'bench.zip')
+            old = timeit(_fix_up_directory_old, make_args, repeat)
+            new = timeit(zipextimporter._fix_up_directory, make_args, repeat)
+            fixed_old = _fix_up_directory_old(dict(files), 'bench.zip')
+            fixed_new = zipextimporter._fix_up_directory(dict(files), 'bench.zip')
+            assert fixed_old.keys() == fixed_new.keys()
+            print(f'{count:>10} {old:>10.4f} {new:>10.4f} {old / new:>7.2f}x')
+    finally:
+        zipextimporter.set_verbose(verbose)
+
+
+_STUB_BACKEND = 'stub'
+
+def install_stub_backend():
+    '''Use a stub `_memimporter` which only reads the images, if the real one
+    is unavailable, e.g. on Linux, the synthetic extensions can not be loaded.
+    Return the backend name.
+    '''
+    try:
+        import _memimporter
+    except ImportError:
+        pass
+    else:
+        return getattr(_memimporter, '__file__', '_memimporter')
+    import types
+    def import_module(fullname, path, initname, findproc, spec, tracer=None):
+        findproc(path)
+        if tracer:
+            tracer('map')
+        mod = sys.modules[fullname] = types.ModuleType(fullname)
+        if tracer:
+            tracer('init')
+        return mod
+    stub = types.ModuleType('_memimporter')
+    stub.import_module = import_module
+    sys.modules['_memimporter'] = stub
+    return _STUB_BACKEND
+
+
+def make_archive(path, count=1000, depth=2, width=10, member_size=1024,
+                 compression='deflated', ext_share=0.1, seed=0):
+    '''Write a synthetic archive, return the names of the modules in it.
+    The modules are put in packages of `depth` levels and `width` packages
+    per level, `ext_share` of them are extensions.
+    '''
+    import _imp
+    import random
+    import zipfile
+    from pefixture import make_pe
+    rand = random.Random(seed)
+    compression = {'stored': zipfile.ZIP_STORED,
+                   'deflated': zipfile.ZIP_DEFLATED}[compression]
+    ext_suffix = _imp.extension_suffixes()[-1]  # '.pyd' or '.so'
+    ext_every = ext_share and max(round(1 / ext_share), 1) or 0
+    names = []
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        packages = set()
+        for i in range(count):
+            parts = []
+            n = i
+            for _ in range(depth):
+                n, r = divmod(n, width)
+                parts.append(f'pkg{r}')
+            for j in range(1, depth + 1):
+                package = '/'.join(parts[:j])
+                if package not in packages:
+                    packages.add(package)
+                    zf.writestr(f'{package}/__init__.py', b'')
+                    names.append(package.replace('/', '.'))
+            if ext_every and i % ext_every == 0:
+                name = f'ext{i}'
+                data = make_pe([f'PyInit_{name}'], padding=member_size)
+                member = f'{name}{ext_suffix}'
+            else:
+                name = f'mod{i}'
+                # half compressible, half random
+                text = 'x' * (member_size // 2)
+                text += ''.join(rand.choice('abcdefghij')
+                                for _ in range(member_size // 2))
+                data = f'# {text}\nloaded = True\n'.encode()
+                member = f'{name}.py'
+            zf.writestr('/'.join(parts + [member]), data)
+            names.append('.'.join(parts + [name]))
+    return names
+
+
+def _get_importers(zipextimporter, archive, names):
+    importers = {}
+    calls = []
+    for fullname in names:
+        parent = fullname.rpartition('.')[0]
+        try:
+            importer = importers[parent]
+        except KeyError:
+            path = zipextimporter.path_sep.join([archive, *parent.split('.')])
+            importer = importers[parent] = \
+                    zipextimporter.ZipExtensionImporter(path)
+        calls.append((importer.find_spec, fullname))
+    return calls
+
+def bench_find_spec(zipextimporter, archive, names, repeat=3):
+    '''Return the average latency of `find_spec`, in microseconds.'''
+    hits = _get_importers(zipextimporter, archive, names)
+    misses = [(find_spec, f'{fullname}_missing') for find_spec, fullname in hits]
+    def run(calls):
+        for find_spec, fullname in calls:
+            find_spec(fullname)
+    def run_cold(calls):
+        for find_spec, fullname in calls:
+            zipextimporter.clear_lookup_cache()
+            find_spec(fullname)
+    run(hits)  # build the indexes
+    result = {}
+    for key, func, calls in (('hit_us', run, hits),
+                             ('miss_us', run, misses),
+                             ('hit_cold_us', run_cold, hits),
+                             ('miss_cold_us', run_cold, misses)):
+        result[key] = timeit(func, lambda: (calls,), repeat) / len(calls) * 1e6
+    return result
+
+def bench_get_data(zipextimporter, archive, repeat=3):
+    '''Return the throughput of `get_data`, in MB/s.'''
+    importer = zipextimporter.ZipExtensionImporter(archive)
+    paths = [f'{archive}{sep}{path}' for path, toc_entry in
+             zipextimporter._get_files(importer).items() if toc_entry]
+    size = 0
+    def run():
+        nonlocal size
+        size = 0
+        for path in paths:
+            size += len(importer.get_data(path))
+    elapsed = timeit(run, repeat=repeat)
+    return {'members': len(paths), 'bytes': size,
+            'mb_per_s': size / elapsed / 1e6}
+
+def bench_install_import(archive, repeat=3):
+    '''Return the best time of `install()` and importing all modules of the
+    archive, each in a fresh interpreter.
+    '''
+    return _run_best('total_s', repeat, '_install_import', archive)
+
+# Run a command of this file in fresh interpreters, return the best result.
+def _run_best(key, repeat, *args):
+    import json
+    import subprocess
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+                [sys.executable, __file__, *args],
+                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        if best is None or result[key] < best[key]:
+            best = result
+    return best
+
+# Return the names of all modules in the archive, packages first.
+def _module_names(archive):
+    import zipfile
+    with zipfile.ZipFile(archive) as zf:
+        members = zf.namelist()
+    names = []
+    for member in members:
+        name, _, suffix = member.rpartition('.')
+        if suffix == 'py':
+            name = name.replace('/', '.')
+            if name.endswith('.__init__'):
+                name = name[:-9]
+        elif suffix in ('pyd', 'so'):
+            name = name.partition('.')[0].replace('/', '.')
+        else:
+            continue
+        names.append(name)
+    return names
+
+def _install_import(archive):
+    import json
+    install_stub_backend()
+    names = _module_names(archive)
+    start = time.perf_counter()
+    import zipextimporter
+    zipextimporter.install(hook=False)
+    sys.path.insert(0, archive)
+    installed = time.perf_counter()
+    for name in names:
+        __import__(name)
+    end = time.perf_counter()
+    print(json.dumps({'modules': len(names), 'install_s': installed - start,
+                      'import_s': end - installed, 'total_s': end - start}))
+
+def bench_threads(archive, threads=(1, 2, 4, 8), repeat=3):
+    '''Return the best time of importing all modules of the archive by each
+    number of threads, in fresh interpreters, and the speedups over the first.
+    The "maps" is how many times an extension was mapped while all threads
+    were creating it at once, it should be 1.
+    '''
+    results = []
+    for n in threads:
+        result = _run_best('import_s', repeat, '_threaded_import', archive, str(n))
+        result['speedup'] = results and \
+                results[0]['import_s'] / result['import_s'] or 1.0
+        results.append(result)
+    return results
+
+def _threaded_import(archive, nthreads):
+    import json
+    import threading
+    backend = install_stub_backend()
+    names = _module_names(archive)
+    import memimport
+    import zipextimporter
+    zipextimporter.set_verbose(0)
+    zipextimporter.install(hook=False)
+    sys.path.insert(0, archive)
+    barrier = threading.Barrier(nthreads + 1)
+    def run_threads(target, *args):
+        threads = [threading.Thread(target=target, args=(i, *args))
+                   for i in range(nthreads)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    # all threads create a same extension
+    maps = 0
+    exts = [name for name in names if name.rpartition('.')[2].startswith('ext')]
+    if exts:
+        parent, _, name = exts[0].rpartition('.')
+        __import__(parent)
+        importer = zipextimporter.ZipExtensionImporter(
+                zipextimporter.path_sep.join([archive, *parent.split('.')]))
+        spec = importer.find_spec(exts[0])
+        def count_maps(event):
+            nonlocal maps
+            maps += event['phase'] == 'map'
+        def create(i):
+            barrier.wait()
+            importer.create_module(spec)
+        if backend == _STUB_BACKEND:
+            # the stub maps nothing, take a while like a real mapping does,
+            # or the threads will hardly overlap
+            import_module = memimport.import_module
+            def slow_import_module(*args, **kwargs):
+                time.sleep(0.05)
+                return import_module(*args, **kwargs)
+            memimport.import_module = slow_import_module
+        memimport.add_trace_hook(count_maps)
+        run_threads(create)
+        memimport.remove_trace_hook(count_maps)
+        if backend == _STUB_BACKEND:
+            memimport.import_module = import_module
+        barrier.reset()
+
+    # import the disjoint slices of all modules concurrently
+    def import_slice(i):
+        barrier.wait()
+        for name in names[i::nthreads]:
+            __import__(name)
+    elapsed = run_threads(import_slice)
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)
+    print(json.dumps({'threads': nthreads, 'modules': len(names),
+                      'import_s': elapsed, 'maps': maps,
+                      'gil': is_gil_enabled()}))
+
+def make_large_member(path, size, compression='deflated', seed=0):
+    '''Write a zip file with a member "large.bin" of size bytes, half of each
+    MiB is random, half is zeros. It is written in blocks, not in memory.
+    '''
+    import random
+    import zipfile
+    rand = random.Random(seed)
+    compression = {'stored': zipfile.ZIP_STORED,
+                   'deflated': zipfile.ZIP_DEFLATED}[compression]
+    block = 1 << 20
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        with zf.open('large.bin', 'w', force_zip64=True) as f:
+            left = size
+            while left > 0:
+                n = min(block, left)
+                f.write(rand.randbytes(n // 2) + bytes(n - n // 2))
+                left -= n
+
+def bench_read_member(sizes=(50, 200, 500), repeat=3):
+    '''Return the throughput and the peak traced memory of reading a large
+    member by `zipimport` and by `zipextimporter._read_member`, for each
+    size in MiB and each compression.
+    '''
+    import os
+    import tempfile
+    import tracemalloc
+    import zipimport
+    import zipextimporter
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compression in ('deflated', 'stored'):
+            for size in sizes:
+                archive = os.path.join(tmpdir, f'large_{compression}_{size}.zip')
+                make_large_member(archive, size << 20, compression)
+                importer = zipimport.zipimporter(archive)
+                toc_entry = zipextimporter._get_files(importer)['large.bin']
+                for name, read in (
+                        ('zipimport', lambda: importer.get_data('large.bin')),
+                        ('read_member', lambda: zipextimporter._read_member(
+                                archive, toc_entry))):
+                    elapsed = timeit(read, repeat=repeat)
+                    tracemalloc.start()
+                    read()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results.append({
+                        'reader': name, 'compression': compression,
+                        'size_mb': size, 'mb_per_s': size / elapsed,
+                        'peak_mb': peak / (1 << 20)})
+                os.unlink(archive)
+    return results
+
+
+def bench_suite(count=1000, depth=2, member_size=1024, compression='deflated',
+                ext_share=0.1, repeat=5):
+    '''Run all benchmarks on a synthetic archive, return the results.'''
+    import os
+    import platform
+    import tempfile
+    backend = install_stub_backend()
+    import zipextimporter
+    zipextimporter.set_verbose(0)
+    params = {'count': count, 'depth': depth, 'member_size': member_size,
+              'compression': compression, 'ext_share': ext_share,
+              'repeat': repeat}
+    results = {'params': params,
+               'version': zipextimporter.__version__,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'backend': backend}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # relative archive path, it is platform independent
+        os.chdir(tmpdir)
+        try:
+            archive = 'bench.zip'
+            names = make_archive(archive, count, depth,
+                                 member_size=member_size,
+                                 compression=compression, ext_share=ext_share)
+            results['archive_bytes'] = os.path.getsize(archive)
+            results['find_spec'] = bench_find_spec(
+                    zipextimporter, archive, names, repeat)
+            files = make_directory(count, depth)
+            results['fix_up_directory_s'] = timeit(
+                    zipextimporter._fix_up_directory,
+                    lambda: (dict(files), 'bench.zip'), repeat)
+            results['get_data'] = bench_get_data(zipextimporter, archive, repeat)
+            results['install_import'] = bench_install_import(archive, repeat)
+            results['threads'] = bench_threads(archive, repeat=repeat)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Benchmark memory importer')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True  # the keyword argument is py >= 37
+    commands.add_parser('fix_up_directory')
+    suite = commands.add_parser('suite')
+    suite.add_argument('--count', type=int, default=1000)
+    suite.add_argument('--depth', type=int, default=2)
+    suite.add_argument('--member-size', type=int, default=1024)
+    suite.add_argument('--compression', choices=('stored', 'deflated'),
+                       default='deflated')
+    suite.add_argument('--ext-share', type=float, default=0.1)
+    suite.add_argument('--repeat', type=int, default=5)
+    suite.add_argument('--json', metavar='FILE',
+                       help='write the results to FILE, default to stdout')
+    threads = commands.add_parser('threads')
+    threads.add_argument('--count', type=int, default=1000)
+    threads.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    threads.add_argument('--repeat', type=int, default=3)
+    read_member = commands.add_parser('read_member')
+    read_member.add_argument('--sizes', type=int, nargs='+', metavar='MB',
+                             default=[50, 200, 500])
+    read_member.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    if args.command == 'fix_up_directory':
+        install_stub_backend()
+        bench_fix_up_directory()
+    elif args.command == 'suite':
+        results = bench_suite(args.count, args.depth, args.member_size,
+                              args.compression, args.ext_share, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+    elif args.command == 'threads':
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.join(tmpdir, 'bench.zip')
+            make_archive(archive, args.count)
+            results = bench_threads(archive, args.threads, args.repeat)
+        print(f'{"threads":>8} {"import (s)":>11} {"speedup":>8} {"maps":>5}')
+        for result in results:
+            print(f'{result["threads"]:>8} {result["import_s"]:>11.4f} '
+                  f'{result["speedup"]:>7.2f}x {result["maps"]:>5}')
+    elif args.command == 'read_member':
+        print(f'{"reader":>12} {"compression":>12} {"size (MB)":>10} '
+              f'{"MB/s":>8} {"peak (MB)":>10}')
+        for result in bench_read_member(args.sizes, args.repeat):
+            print(f'{result["reader"]:>12} {result["compression"]:>12} '
+                  f'{result["size_mb"]:>10} {result["mb_per_s"]:>8.1f} '
+                  f'{result["peak_mb"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['_install_import']:
+        _install_import(sys.argv[2])
+    elif sys.argv[1:2] == ['_threaded_import']:
+        _threaded_import(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,430 @@
+r"""httpimporter - an importer which can import modules, include extension
+modules, from HTTP(S) servers without write them to the file system.
+
+This file is part of the memimport package.
+
+Overview
+========
+
+Call the `httpimporter.install()` to install the import hook, add an URL of
+a site to sys.path, and import modules from it.
+
+A site is a directory on a HTTP server, which has an index file
+"index.json" in it. The index lists the files of the site with "/" as
+separator, as a list of paths, or a dict of paths -> {"etag": "..."}:
+
+    {"files": {"plugin/__init__.py": {"etag": "\"1f-5a\""},
+               "plugin/_speedups.pyd": {"etag": "\"4000-5b\""},
+               "libcrypto-3.dll": {}}}
+
+The index is fetched once per site, the modules are resolved by it without
+round trips. Files are fetched with keep-alive connections from a pool,
+and saved in a local cache with their ETags. A cached file is used without
+request if its ETag is same as the one in the index, or else it is
+revalidated by a conditional request. The fetched files are kept in memory
+up to 32 MiB, the least recently used ones are dropped. The DLLs which an
+extension imports are served to the findproc from the site root, their names
+are matched case insensitively, likes zipextimporter does.
+
+Sample usage
+============
+
+>>> import httpimporter
+>>> httpimporter.install()
+>>> import sys
+>>> sys.path.insert(0, "https://artifacts.example.com/plugins")
+>>> import plugin
+>>> plugin.__file__
+'https://artifacts.example.com/plugins/plugin/__init__.py'
+
+"""
+
+import sys
+import marshal
+from _thread import allocate_lock
+from _frozen_importlib import ModuleSpec
+from _frozen_importlib_external import decode_source, MAGIC_NUMBER
+
+from memimport import (
+        memimport, export_hook_name, _path_join, _path_exists, _makedirs,
+        _write_atomic, _verbose_msg
+)
+import zipextimporter
+
+
+__all__ = [
+    'HttpImporter', 'HttpImportError', 'install', 'set_cache_dir',
+    'clear_cache', 'INDEX_NAME'
+]
+
+INDEX_NAME = 'index.json'
+
+
+class HttpImportError(ImportError):
+    pass
+
+
+################################################################################
+# Connections
+################################################################################
+
+class _ConnectionPool:
+    '''Keep-alive connections, reused by (scheme, host, port).'''
+    max_idle = 4  # per host
+    timeout = 30
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = allocate_lock()
+        self.connects = self.requests = 0
+
+    def _get(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+        scheme, host, port = key
+        import http.client
+        if scheme == 'https':
+            import ssl
+            conn = http.client.HTTPSConnection(
+                    host, port, timeout=self.timeout,
+                    context=ssl.create_default_context())
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    def _put(self, key, conn):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(conn)
+                return
+        conn.close()
+
+    # Return (status, headers, body) of a GET request.
+    def get(self, url, headers=None):
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        key = parts.scheme, parts.hostname, parts.port
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        for retry in (True, False):
+            conn = self._get(key)
+            try:
+                conn.request('GET', target, headers=headers or {})
+                response = conn.getresponse()
+                body = response.read()
+            except OSError as e:
+                conn.close()
+                # a kept-alive connection may be closed by the server
+                if retry and not isinstance(e, TimeoutError):
+                    continue
+                raise
+            self.requests += 1
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+            return response.status, response, body
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+_pool = _ConnectionPool()
+
+
+################################################################################
+# Cache
+################################################################################
+
+_cache_dir = None
+# url -> etag, files have been fetched or revalidated in this process
+_fetched = {}
+# url -> data, the bodies which were fetched lately, bounded by a byte budget,
+# they are fetched again from the local cache when evicted
+_bodies = zipextimporter._DataCache(32 << 20)
+
+def _get_cache_path(url):
+    from hashlib import sha256
+    return _path_join(_cache_dir, sha256(url.encode()).hexdigest())
+
+def _load_cached(url):
+    if _cache_dir is None:
+        return None, None
+    path = _get_cache_path(url)
+    try:
+        with open(path + '.etag', 'rb') as f:
+            etag = f.read().decode()
+        with open(path, 'rb') as f:
+            return etag, f.read()
+    except OSError:
+        return None, None
+
+def _save_cached(url, etag, data):
+    if _cache_dir is None:
+        return
+    path = _get_cache_path(url)
+    try:
+        if not _path_exists(_cache_dir):
+            _makedirs(_cache_dir)
+        _write_atomic(path, data)
+        _write_atomic(path + '.etag', etag.encode())
+    except OSError as e:
+        _verbose_msg('# httpimporter: can not cache {!r}: {}', url, e)
+
+# Return the body of the URL, revalidate the cached one by the ETag.
+# The known ETag is from the index, the cached one is used without request
+# if they are same.
+def _fetch(url, known_etag=None):
+    if url in _fetched and known_etag in (None, _fetched[url]):
+        data = _bodies.get(url)
+        if data is not None:
+            return data
+    etag, data = _load_cached(url)
+    if data is not None and known_etag is not None and known_etag == etag:
+        _verbose_msg('# httpimporter: {!r} is fresh in cache', url, verbosity=2)
+        _fetched[url] = etag
+        _bodies.put(url, data)
+        return data
+    headers = {}
+    if data is not None:
+        headers['If-None-Match'] = etag
+    status, response, body = _pool.get(url, headers)
+    if status == 304 and data is not None:
+        _verbose_msg('# httpimporter: {!r} is not modified', url, verbosity=2)
+    elif status == 200:
+        data = body
+        etag = response.getheader('ETag')
+        if etag:
+            _save_cached(url, etag, data)
+        _verbose_msg('# httpimporter: fetched {!r}, {} bytes',
+                     url, len(data), verbosity=2)
+    else:
+        raise OSError(f'HTTP {status} {response.reason}: {url}')
+    _fetched[url] = etag
+    _bodies.put(url, data)
+    return data
+
+
+################################################################################
+# Sites
+################################################################################
+
+class _Site:
+    '''A site root and its index.'''
+    def __init__(self, root):
+        import json
+        self.root = root
+        index = json.loads(_fetch(f'{root}/{INDEX_NAME}'))
+        if isinstance(index, dict):
+            index = index.get('files', {})
+        if not isinstance(index, dict):
+            index = dict.fromkeys(index)
+        self.etags = {path: info and info.get('etag') or None
+                      for path, info in index.items()}
+        # the DLL names which the images import are case insensitive
+        self.lower_paths = {path.lower(): path for path in self.etags}
+        # likes the zip directory, include the implicit directories
+        self.files = dict.fromkeys(self.etags, ())
+        for path in list(self.files):
+            parts = path.split('/')
+            for i in range(1, len(parts)):
+                self.files.setdefault('/'.join(parts[:i]) + '/', None)
+        self._module_indexes = {}
+        self._lock = allocate_lock()
+
+    def get_module_index(self, prefix):
+        try:
+            return self._module_indexes[prefix]
+        except KeyError:
+            pass
+        index = zipextimporter._build_module_index(
+                self.root, prefix, self.files, sep='/')
+        with self._lock:
+            return self._module_indexes.setdefault(prefix, index)
+
+    def read(self, path):
+        if path not in self.etags:
+            raise OSError(0, '', f'{self.root}/{path}')
+        return _fetch(f'{self.root}/{path}', self.etags[path])
+
+# root URL -> _Site
+_sites = {}
+_sites_lock = allocate_lock()
+
+# Return the site and the prefix of the URL, the URL of a sys.path entry is
+# a site root, the others are the directories of packages.
+def _get_site(url):
+    url = url.rstrip('/')
+    with _sites_lock:
+        for root, site in _sites.items():
+            if url == root:
+                return site, ''
+            if url.startswith(root + '/'):
+                return site, url[len(root)+1:] + '/'
+    site = _Site(url)
+    with _sites_lock:
+        return _sites.setdefault(url, site), ''
+
+
+class HttpImporter:
+    '''Import modules from a HTTP(S) site, likes built-in zipimporter.'''
+    def __init__(self, path):
+        if not isinstance(path, str) or \
+                not path.startswith(('http://', 'https://')):
+            raise HttpImportError('not a HTTP(S) URL', path=path)
+        try:
+            self._site, self.prefix = _get_site(path)
+        except (OSError, ValueError) as e:
+            raise HttpImportError(f'can not get the index of {path!r}: {e}',
+                                  path=path) from e
+        self.archive = self._site.root
+
+    def _get_module_info(self, fullname):
+        name = fullname.rpartition('.')[2]
+        entry = self._site.get_module_index(self.prefix).get(name)
+        if entry is None:
+            return
+        pyver = name in zipextimporter._names_pyver
+        for is_ext, is_package, probe, pyver_only, path in entry[0]:
+            if pyver_only and not pyver:
+                continue
+            if probe and is_ext:
+                read = zipextimporter._make_reader(self._site.read(path))
+                if not zipextimporter._pe_has_export(read,
+                                                     export_hook_name(name)):
+                    continue
+            return path, is_ext, is_package
+        return None, None, entry[1]  # directory
+
+    def _get_module_info_raise(self, fullname):
+        mi = self._get_module_info(fullname)
+        if mi is None or mi[0] is None:
+            raise HttpImportError(f"can't find module {fullname!r}",
+                                  name=fullname)
+        return mi
+
+    def find_spec(self, fullname, target=None):
+        mi = self._get_module_info(fullname)
+        if mi is None:
+            return
+        path, is_ext, is_package = mi
+        if path is None:
+            if is_package is None:
+                return
+            spec = ModuleSpec(fullname, None)
+            spec.submodule_search_locations = [is_package]  # dirpath
+            return spec
+        origin = f'{self.archive}/{path}'
+        spec = ModuleSpec(fullname, self, origin=origin, is_package=is_package)
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = [origin.rpartition('/')[0]]
+        return spec
+
+    def create_module(self, spec):
+        path, is_ext, is_package = self._get_module_info_raise(spec.name)
+        if not is_ext:
+            return
+        return memimport(spec=spec)
+
+    def exec_module(self, module):
+        code = self.get_code(module.__spec__.name)
+        if code is not None:
+            exec(code, module.__dict__)
+
+    def get_code(self, fullname):
+        path, is_ext, is_package = self._get_module_info_raise(fullname)
+        if is_ext:
+            return
+        data = self._site.read(path)
+        origin = f'{self.archive}/{path}'
+        if path.endswith('.pyc'):
+            if data[:4] != MAGIC_NUMBER:
+                raise HttpImportError(f'bad magic number in {origin!r}',
+                                      name=fullname, path=origin)
+            return marshal.loads(memoryview(data)[16:])
+        return compile(data, origin, 'exec', dont_inherit=True)
+
+    def get_source(self, fullname):
+        path, is_ext, is_package = self._get_module_info_raise(fullname)
+        if path.endswith('.py'):
+            return decode_source(self._site.read(path))
+
+    def get_filename(self, fullname):
+        return f'{self.archive}/{self._get_module_info_raise(fullname)[0]}'
+
+    def is_package(self, fullname):
+        return self._get_module_info_raise(fullname)[2]
+
+    # The pathname is an URL in the site, or a name of DLL from the findproc,
+    # the DLL is searched in the site root.
+    def get_data(self, pathname):
+        path = pathname
+        if path.startswith(self.archive + '/'):
+            path = path[len(self.archive)+1:]
+        elif path not in self._site.etags:
+            path = self._site.lower_paths.get(path.lower(), path)
+        return self._site.read(path)
+
+    # The image has been copied while loading, it will be fetched again from
+    # the local cache if needed.
+    def release_data(self, fullname):
+        _bodies.pop(self.get_filename(fullname))
+
+    def get_retained_bytes(self, fullname):
+        return _bodies.get_size(self.get_filename(fullname))
+
+    def invalidate_caches(self):
+        pass
+
+    def __repr__(self):
+        return f'<HttpImporter object "{self.archive}/{self.prefix}">'
+
+
+def install(cache_dir=None):
+    '''Install the HttpImporter to `sys.path_hooks`.
+
+    Argument "cache_dir":
+        The directory to cache the fetched files, default to "http" in the
+        Eggs-Cache directory, False to disable the local cache.
+    '''
+    set_cache_dir(cache_dir)
+    if HttpImporter in sys.path_hooks:
+        return
+    # they may be not built-in, import them before the hook works
+    import http.client, urllib.parse, json, hashlib, encodings.idna
+    try:
+        import ssl
+    except ImportError:
+        pass
+    sys.path_hooks.insert(0, HttpImporter)
+    sys.path_importer_cache.clear()
+
+def set_cache_dir(cache_dir=None):
+    '''Set the directory to cache the fetched files, see `install()`.'''
+    global _cache_dir
+    if cache_dir is None:
+        cache_dir = _path_join(zipextimporter._get_eggs_cache(), 'http')
+    _cache_dir = cache_dir or None
+
+def clear_cache():
+    '''Forget the fetched files and the sites, close the idle connections.
+    The local cache is kept, it will be revalidated at next fetch.
+    '''
+    _fetched.clear()
+    _bodies.clear()
+    with _sites_lock:
+        _sites.clear()
+    _pool.clear()
+    for path in list(sys.path_importer_cache):
+        if isinstance(sys.path_importer_cache[path], HttpImporter):
+            del sys.path_importer_cache[path]
@@ -0,0 +1,513 @@
+r"""memarchive - an archive format optimized for import, and its importer.
+
+This file is part of the memimport package.
+
+Overview
+========
+
+Zip files force to parse the central directory at start, and to inflate
+every extension module at import time. A memarchive is built from a zip
+file ahead of time, it has:
+
+  - a hash table index, module name or member path -> record
+  - precomputed module metadata, is_ext, is_package, init name
+  - page-aligned members, stored raw or compressed, chosen per member
+
+The archive is mapped with mmap, resolving a module is one hash lookup in
+the mapping. The raw extension images are passed to `memimport()` as
+memoryviews of the mapping, without copies.
+
+Format
+======
+
+All integers are little-endian.
+
+    header    magic, nslots, nmembers, nmodules, page size,
+              offsets of slots, members, modules and strings
+    slots     (crc32 of key, ref) * nslots, ref is 0 for an empty slot,
+              index + 1 of a member, or index + 1 | 0x80000000 of a module
+    members   (name offset, name size, codec, offset, size, raw size)
+    modules   (name offset, name size, init name offset, init name size,
+               member index, flags)
+    strings   UTF-8 names
+    data      members, each starts at a page boundary
+
+The key of a module is its full name, the key of a member is "/" and its
+path in the archive, with "/" as separator.
+
+Sample usage
+============
+
+>>> import memarchive
+>>> memarchive.build('lib.zip', 'lib.mar')
+>>> memarchive.install()
+>>> import sys
+>>> sys.path.insert(0, 'lib.mar')
+>>> import _socket
+>>> _socket.__file__
+'lib.mar\\_socket.pyd'
+
+"""
+
+import sys
+import _io
+import marshal
+from _struct import pack, unpack_from, calcsize
+from _frozen_importlib import ModuleSpec
+from _frozen_importlib_external import _path_stat, decode_source, MAGIC_NUMBER
+# they may be not built-in, import them before the importer is used, or it
+# would import them by itself
+from mmap import mmap, ACCESS_READ
+from zlib import crc32, decompress
+
+from memimport import (
+        memimport, export_hook_name, path_sep, _path_split, _write_atomic,
+        _verbose_msg
+)
+
+
+__all__ = ['MemArchiveImporter', 'MemArchiveError', 'build', 'install']
+
+
+class MemArchiveError(ImportError):
+    pass
+
+
+_MAGIC = b'MEMARC\x00\x01'  # magic and format version
+_HEADER = '<8sIIIIQQQQ'
+_SLOT = '<II'
+_MEMBER = '<IIB3xQQQ'
+_MODULE = '<IIIIII'
+_HEADER_SIZE = calcsize(_HEADER)
+_SLOT_SIZE = calcsize(_SLOT)
+_MEMBER_SIZE = calcsize(_MEMBER)
+_MODULE_SIZE = calcsize(_MODULE)
+_REF_MODULE = 0x80000000
+_NO_MEMBER = 0xFFFFFFFF
+
+# member codecs
+CODEC_RAW = 0
+CODEC_DEFLATE = 1
+
+# module flags
+FLAG_EXT = 1
+FLAG_PACKAGE = 2
+FLAG_BYTECODE = 4
+FLAG_NAMESPACE = 8
+
+
+class _Archive:
+    '''A mapped memarchive file.'''
+    def __init__(self, path):
+        self.path = path
+        with _io.open_code(path) as fp:
+            header = fp.read(_HEADER_SIZE)
+            if len(header) != _HEADER_SIZE or header[:8] != _MAGIC:
+                raise MemArchiveError(f'not a memarchive file: {path!r}',
+                                      path=path)
+            self._mmap = mmap(fp.fileno(), 0, access=ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        (_, self.nslots, self.nmembers, self.nmodules, self.page_size,
+         self._slots, self._members, self._modules, self._strings
+        ) = unpack_from(_HEADER, header)
+        self._mask = self.nslots - 1
+
+    # Return the ref of the key, or 0 if it is not found.
+    def _lookup(self, key, is_module):
+        key = key.encode()
+        h = crc32(key)
+        name = key if is_module else key[1:]  # skip the "/" of member keys
+        view = self._view
+        i = h & self._mask
+        while True:
+            slot_h, ref = unpack_from(_SLOT, view, self._slots + i * _SLOT_SIZE)
+            if ref == 0:
+                return 0
+            if slot_h == h and bool(ref & _REF_MODULE) == is_module:
+                index = (ref & ~_REF_MODULE) - 1
+                if is_module:
+                    name_offset, name_size, *_ = unpack_from(
+                            _MODULE, view, self._modules + index * _MODULE_SIZE)
+                else:
+                    name_offset, name_size, *_ = unpack_from(
+                            _MEMBER, view, self._members + index * _MEMBER_SIZE)
+                start = self._strings + name_offset
+                if view[start:start+name_size] == name:
+                    return index + 1
+            i = (i + 1) & self._mask
+
+    def _string(self, offset, size):
+        start = self._strings + offset
+        return str(self._view[start:start+size], 'utf-8')
+
+    # Return (name, initname, member path or None, flags) of a module.
+    def get_module(self, fullname):
+        ref = self._lookup(fullname, True)
+        if not ref:
+            return
+        name_offset, name_size, init_offset, init_size, member, flags = \
+                unpack_from(_MODULE, self._view,
+                            self._modules + (ref - 1) * _MODULE_SIZE)
+        path = None
+        if member != _NO_MEMBER:
+            path = self.get_member(member)[0]
+        return (self._string(name_offset, name_size),
+                self._string(init_offset, init_size), path, flags)
+
+    # Return (path, codec, offset, size, raw_size) of a member.
+    def get_member(self, index):
+        name_offset, name_size, codec, offset, size, raw_size = unpack_from(
+                _MEMBER, self._view, self._members + index * _MEMBER_SIZE)
+        return self._string(name_offset, name_size), codec, offset, size, raw_size
+
+    # Return the data of a member, a memoryview of the mapping if it is raw,
+    # or None if it is not found.
+    def read(self, path):
+        ref = self._lookup('/' + path, False)
+        if not ref:
+            return
+        _, codec, offset, size, raw_size = self.get_member(ref - 1)
+        view = self._view[offset:offset+size]
+        if codec == CODEC_RAW:
+            return view
+        if codec == CODEC_DEFLATE:
+            return decompress(view, -15, raw_size)
+        raise MemArchiveError(f'unknown codec {codec} of {path!r} in '
+                              f'memarchive {self.path!r}', path=self.path)
+
+
+# archive path -> _Archive
+_archives = {}
+
+def _get_archive(path):
+    try:
+        return _archives[path]
+    except KeyError:
+        archive = _archives[path] = _Archive(path)
+        _verbose_msg('# memarchive: mapped {!r}, {} modules, {} members',
+                     path, archive.nmodules, archive.nmembers, verbosity=2)
+        return archive
+
+
+class MemArchiveImporter:
+    '''Import modules from memarchive files, likes built-in zipimporter.
+    The path is the archive file, or a package directory in it.
+    '''
+    def __init__(self, path):
+        if not isinstance(path, str):
+            raise MemArchiveError('path must be a str', path=path)
+        archive = path
+        prefix = []
+        while True:
+            try:
+                st = _path_stat(archive)
+            except (OSError, ValueError):
+                head, tail = _path_split(archive)
+                if not head or head == archive:
+                    raise MemArchiveError('not a memarchive file', path=path)
+                archive = head
+                prefix.append(tail)
+            else:
+                if st.st_mode & 0o170000 != 0o100000:  # not a regular file
+                    raise MemArchiveError('not a memarchive file', path=path)
+                break
+        self._archive = _get_archive(archive)
+        self.archive = archive
+        self.package = '.'.join(reversed(prefix))
+        self.prefix = prefix and path_sep.join(reversed(prefix)) + path_sep or ''
+        self._images = {}  # path -> data, passed to memimport without copies
+
+    def _get_module(self, fullname):
+        if fullname.rpartition('.')[0] != self.package:
+            return
+        return self._archive.get_module(fullname)
+
+    def _get_module_raise(self, fullname):
+        module = self._get_module(fullname)
+        if module is None:
+            raise MemArchiveError(f"can't find module {fullname!r}",
+                                  name=fullname)
+        return module
+
+    def find_spec(self, fullname, target=None):
+        module = self._get_module(fullname)
+        if module is None:
+            return
+        name, initname, path, flags = module
+        if flags & FLAG_NAMESPACE:
+            spec = ModuleSpec(fullname, None)
+            spec.submodule_search_locations = [
+                    path_sep.join([self.archive, *fullname.split('.')])]
+            return spec
+        origin = path_sep.join([self.archive, *path.split('/')])
+        spec = ModuleSpec(fullname, self, origin=origin,
+                          is_package=bool(flags & FLAG_PACKAGE))
+        spec.has_location = True
+        if flags & FLAG_PACKAGE:
+            spec.submodule_search_locations = [origin.rpartition(path_sep)[0]]
+        return spec
+
+    def create_module(self, spec):
+        name, initname, path, flags = self._get_module_raise(spec.name)
+        if not flags & FLAG_EXT:
+            return
+        self._images[spec.origin] = self._archive.read(path)
+        try:
+            mod = memimport(spec=spec)
+        finally:
+            self._images.pop(spec.origin, None)
+        _verbose_msg('import {} # loaded from memarchive {}',
+                     spec.name, spec.origin)
+        return mod
+
+    def exec_module(self, module):
+        code = self.get_code(module.__spec__.name)
+        if code is not None:
+            exec(code, module.__dict__)
+
+    def get_code(self, fullname):
+        name, initname, path, flags = self._get_module_raise(fullname)
+        if flags & (FLAG_EXT | FLAG_NAMESPACE):
+            return
+        data = self._archive.read(path)
+        origin = path_sep.join([self.archive, *path.split('/')])
+        if flags & FLAG_BYTECODE:
+            if data[:4] != MAGIC_NUMBER:
+                raise MemArchiveError(f'bad magic number in {origin!r}',
+                                      name=fullname, path=origin)
+            return marshal.loads(data[16:])
+        return compile(bytes(data), origin, 'exec', dont_inherit=True)
+
+    def get_source(self, fullname):
+        name, initname, path, flags = self._get_module_raise(fullname)
+        if flags & (FLAG_EXT | FLAG_NAMESPACE):
+            return
+        if flags & FLAG_BYTECODE:
+            path = path[:-1]  # .py
+        data = self._archive.read(path)
+        if data is not None:
+            return decode_source(bytes(data))
+
+    def get_filename(self, fullname):
+        name, initname, path, flags = self._get_module_raise(fullname)
+        if path is None:
+            raise MemArchiveError(f"{fullname!r} is a namespace package",
+                                  name=fullname)
+        return path_sep.join([self.archive, *path.split('/')])
+
+    def is_package(self, fullname):
+        return bool(self._get_module_raise(fullname)[3] & FLAG_PACKAGE)
+
+    def get_data(self, pathname):
+        try:
+            return self._images.pop(pathname)
+        except KeyError:
+            pass
+        key = pathname
+        if key.startswith(self.archive + path_sep):
+            key = key[len(self.archive)+1:]
+        data = self._archive.read(key.replace(path_sep, '/'))
+        if data is None:
+            raise OSError(0, '', pathname)
+        return bytes(data)
+
+    def invalidate_caches(self):
+        pass
+
+    def __repr__(self):
+        return f'<MemArchiveImporter object "{self.archive}{path_sep}{self.prefix}">'
+
+
+def install():
+    '''Install the MemArchiveImporter to `sys.path_hooks`.'''
+    if MemArchiveImporter in sys.path_hooks:
+        return
+    sys.path_hooks.insert(0, MemArchiveImporter)
+    sys.path_importer_cache.clear()
+
+
+################################################################################
+# Builder
+################################################################################
+
+# Return {fullname: (member path, flags)} of the modules in the zip file,
+# choose the candidate in the search order of zipextimporter.
+def _scan_modules(zf):
+    import zipextimporter
+    searchsuffixes = zipextimporter._searchsuffixes
+    searchstems = zipextimporter._searchstems
+    found = {}
+    dirs = set()
+    for info in zf.infolist():
+        path = info.filename
+        if info.is_dir():
+            dirs.add(path.rstrip('/'))
+            continue
+        head, _, tail = path.rpartition('/')
+        if '.' in head:
+            continue
+        parts = head.split('/') if head else []
+        for j in range(1, len(parts) + 1):
+            dirs.add('/'.join(parts[:j]))
+        candidates = []
+        if head and f'{path_sep}{tail}' in searchsuffixes:
+            candidates.append(('.'.join(parts), f'{path_sep}{tail}'))
+        name, dot, ext = tail.partition('.')
+        suffix = dot + ext
+        if suffix in searchsuffixes:
+            candidates.append(('.'.join(parts + [name]), suffix))
+        for stem in searchstems:
+            if (name.endswith(stem) and name != stem and
+                    stem + suffix in searchsuffixes):
+                candidates.append(('.'.join(parts + [name[:-len(stem)]]),
+                                   stem + suffix))
+        for fullname, suffix in candidates:
+            rank, is_ext, is_package, probe, pyver_only = searchsuffixes[suffix]
+            if pyver_only and fullname.rpartition('.')[2] not in \
+                    zipextimporter._names_pyver:
+                continue
+            if suffix.endswith('.pyc'):
+                with zf.open(info) as f:
+                    if f.read(4) != MAGIC_NUMBER:
+                        continue  # for other Python versions
+            if probe:
+                data = zf.read(info)
+                if not zipextimporter._pe_has_export(
+                        zipextimporter._make_reader(data),
+                        export_hook_name(fullname)):
+                    continue
+            old = found.get(fullname)
+            if old is None or rank < old[0]:
+                found[fullname] = rank, path, is_ext, is_package
+    modules = {}
+    for fullname, (rank, path, is_ext, is_package) in found.items():
+        flags = is_ext and FLAG_EXT or 0
+        if is_package:
+            flags |= FLAG_PACKAGE
+        if path.endswith('.pyc'):
+            flags |= FLAG_BYTECODE
+        modules[fullname] = path, flags
+    for path in dirs:
+        fullname = path.replace('/', '.')
+        if fullname not in modules and '.' not in path:
+            modules[fullname] = None, FLAG_NAMESPACE
+    return modules
+
+def build(zip_path, out_path, compress=True, bytecode=False, page_size=4096):
+    '''Build a memarchive from a zip file, the modules are resolved in the
+    search order of zipextimporter on the current platform.
+
+    Argument "compress":
+        Compress the members by deflate, except the extensions and the members
+        which will not be smaller than 7/8.
+    Argument "bytecode":
+        Compile the Python sources to bytecode of the current Python.
+    '''
+    import zipfile
+    import zlib
+    from _frozen_importlib_external import _code_to_timestamp_pyc
+    with zipfile.ZipFile(zip_path) as zf:
+        modules = _scan_modules(zf)
+        ext_paths = {path for path, flags in modules.values()
+                     if flags & FLAG_EXT}
+        members = {}  # path -> data
+        for info in zf.infolist():
+            if not info.is_dir():
+                members[info.filename] = zf.read(info)
+        if bytecode:
+            for fullname, (path, flags) in list(modules.items()):
+                if path is None or flags & (FLAG_EXT | FLAG_BYTECODE):
+                    continue
+                source = members[path]
+                code = compile(source, path_sep.join(
+                        [out_path, *path.split('/')]), 'exec',
+                        dont_inherit=True)
+                pyc_path = path + 'c'
+                members[pyc_path] = bytes(_code_to_timestamp_pyc(
+                        code, 0, len(source)))
+                modules[fullname] = pyc_path, flags | FLAG_BYTECODE
+
+    strings = bytearray()
+    def add_string(s):
+        offset = len(strings)
+        b = s.encode()
+        strings.extend(b)
+        return offset, len(b)
+
+    member_index = {}
+    member_records = []
+    member_data = []
+    for path, data in members.items():
+        codec = CODEC_RAW
+        stored = data
+        if compress and path not in ext_paths and data:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            packed = compressor.compress(data) + compressor.flush()
+            if len(packed) <= len(data) * 7 // 8:
+                codec = CODEC_DEFLATE
+                stored = packed
+        member_index[path] = len(member_records)
+        member_records.append([*add_string(path), codec, 0, len(stored),
+                               len(data)])
+        member_data.append(stored)
+    module_records = []
+    for fullname, (path, flags) in modules.items():
+        module_records.append([
+            *add_string(fullname),
+            *add_string(export_hook_name(fullname) if flags & FLAG_EXT else ''),
+            _NO_MEMBER if path is None else member_index[path], flags])
+
+    keys = [('/' + path, i + 1) for path, i in member_index.items()]
+    keys += [(fullname, (i + 1) | _REF_MODULE)
+             for i, fullname in enumerate(modules)]
+    nslots = 8
+    while nslots < len(keys) * 2:
+        nslots *= 2
+    slots = [(0, 0)] * nslots
+    for key, ref in keys:
+        h = zlib.crc32(key.encode())
+        i = h & (nslots - 1)
+        while slots[i][1]:
+            i = (i + 1) & (nslots - 1)
+        slots[i] = h, ref
+
+    slots_offset = _HEADER_SIZE
+    members_offset = slots_offset + nslots * _SLOT_SIZE
+    modules_offset = members_offset + len(member_records) * _MEMBER_SIZE
+    strings_offset = modules_offset + len(module_records) * _MODULE_SIZE
+    offset = strings_offset + len(strings)
+    for record, data in zip(member_records, member_data):
+        offset = -(-offset // page_size) * page_size
+        record[3] = offset
+        offset += len(data)
+
+    out = bytearray(pack(_HEADER, _MAGIC, nslots, len(member_records),
+                         len(module_records), page_size, slots_offset,
+                         members_offset, modules_offset, strings_offset))
+    for slot in slots:
+        out += pack(_SLOT, *slot)
+    for record in member_records:
+        out += pack(_MEMBER, *record)
+    for record in module_records:
+        out += pack(_MODULE, *record)
+    out += strings
+    for record, data in zip(member_records, member_data):
+        out += bytes(record[3] - len(out))
+        out += data
+    _write_atomic(out_path, out)
+    _verbose_msg('# memarchive: built {!r} from {!r}, {} modules, {} members',
+                 out_path, zip_path, len(module_records), len(member_records))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+            prog='python -m memarchive',
+            description='Build a memarchive from a zip file.')
+    parser.add_argument('zip_path')
+    parser.add_argument('out_path')
+    parser.add_argument('--no-compress', dest='compress', action='store_false')
+    parser.add_argument('--bytecode', action='store_true',
+                        help='compile the Python sources to bytecode')
+    args = parser.parse_args()
+    build(args.zip_path, args.out_path, args.compress, args.bytecode)
@@ -10,10 +10,60 @@ It uses the _memimporter extension which uses code from Joachim
 Bauch's MemoryModule library. This library emulates the win32 api
 function LoadLibrary.
 
+On Linux, if the _memimporter is unavailable, the image is written to an
+anonymous file created by memfd_create, then loaded by dlopen with the path
+"/proc/self/fd/N", nothing will be written to the file system. The shared
+libraries which it needs are loaded by the dynamic linker as usual.
+
 memimport provides a loader MemExtensionFileLoader for basic usage.
 Users should write a custom loader for specific requirement,
 just likes zipextimporter does.
 
+The data can be bytes, or any object which supports the buffer protocol,
+e.g. bytearray, memoryview, mmap, it will not be copied to bytes. The image
+is copied while loading, the loader drops the buffer after that, so a later
+`get_data` of the loader raises OSError. The data can also be a callable which
+returns such an object, it is kept and called again by a later `get_data`.
+
+Data providers
+==============
+
+The data is adapted to a `DataProvider` once, when the spec is created, the
+findproc of an import calls its `get(name)` for the image and the DLLs which
+it needs. A provider can also give `size_hint(name)`, whether the results may
+be `cacheable`, and resolve names in batch by `get_many(names)`. Pass one as
+the data, or return one by `get_data_provider()` of a custom loader, e.g.
+zipextimporter does, else the loader is adapted by its `get_data(path)`.
+
+After a module is loaded, `release_data(fullname)` of the loader is called if
+it has one, MemExtensionFileLoader drops the data there, the image is not kept
+twice in memory. `get_memory_info` reports the bytes retained per module.
+
+In asyncio applications, `memimport_async` and `memimport_many_async` obtain
+the data of the modules and their DLLs concurrently without block the event
+loop, then import the modules on the loop thread.
+
+Tracing
+=======
+
+Callables registered by `add_trace_hook` are called with a dict for each
+phase of an import, the keys are:
+
+    phase    'lookup', 'read', 'inflate', 'map' or 'init'
+    name     the module name, or the member name for 'read' and 'inflate'
+    path     the origin of the module or the member
+    start    time.perf_counter() when the phase started
+    elapsed  seconds the phase took
+    bytes    the data size of the phase, or None
+    depth    the nesting level of imports in the current thread
+
+The 'map' phase is the loading of the image and its DLLs by MemoryModule,
+'init' is the call of the PyInit function. If the _memimporter does not
+support the phases breakdown, there will be only a 'map' event covers both.
+Events of the nested imports come before the event of the outer import.
+`print_trace` is a hook which prints them likes `-X importtime`. When no
+hook is registered, nothing will be measured.
+
 Sample usage
 ============
 
@@ -35,25 +85,212 @@ Sample usage
 """
 
 import sys
+import _io
+import _thread
+import _weakref
+from time import perf_counter as _perf_counter
 from _frozen_importlib import ModuleSpec
 from _frozen_importlib_external import ExtensionFileLoader
 
+if 'nt' in sys.builtin_module_names:
+    import nt as _os
+    path_sep = '\\'
+else:
+    import posix as _os
+    path_sep = '/'
+
 # _memimporter is a module built into the py2exe runstubs,
 # or a standalone module of memimport.
-from _memimporter import import_module
+try:
+    from _memimporter import import_module
+except ImportError:
+    if not hasattr(_os, 'memfd_create'):
+        raise
+    import_module = None  # use `_import_module_memfd`
+    _has_tracer = True
+else:
+    try:
+        from _memimporter import has_tracer as _has_tracer
+    except ImportError:
+        _has_tracer = False
 
 
 __version__ = '0.13.0.0.post8'
 
 __all__ = [
     'memimport_from_data', 'memimport_from_loader', 'memimport_from_spec',
-    'memimport', 'set_verbose'
+    'memimport', 'memimport_async', 'memimport_many_async', 'set_verbose',
+    'add_trace_hook', 'remove_trace_hook', 'print_trace', 'get_memory_info',
+    'DataProvider', 'as_provider', 'stats', 'path_sep'
 ]
 
 
+class DataProvider:
+    '''Resolve the names of an image and the DLLs which it needs to buffers,
+    see "Data providers" of the module docstring. Subclasses override `get`.
+    '''
+    # whether the results may be kept and served again by the caller
+    cacheable = False
+
+    def get(self, name):
+        '''Return the data of the name, raise OSError if not found.'''
+        raise OSError(0, '', name)
+
+    def size_hint(self, name):
+        '''Return the data size of the name, or None if unknown.'''
+        return None
+
+    def get_many(self, names):
+        '''Return {name: data} of the names which are found.'''
+        result = {}
+        for name in names:
+            try:
+                result[name] = self.get(name)
+            except OSError:
+                pass
+        return result
+
+    def release(self):
+        '''The image has been loaded, drop the data which is not needed.'''
+
+    def get_retained_bytes(self):
+        '''Return the size of the data which is still retained.'''
+        return 0
+
+
+# The data of a bytes-like object, served for the names of the module.
+class _BufferProvider(DataProvider):
+    cacheable = True
+
+    def __init__(self, data, names):
+        self.data = data
+        self.names = names
+
+    def get(self, name):
+        if name not in self.names:
+            raise OSError(0, '', name)
+        if self.data is None:
+            raise OSError(0, 'the data has been released after loaded', name)
+        return self.data
+
+    def size_hint(self, name):
+        if name in self.names and self.data is not None:
+            return _nbytes(self.data)
+
+    def release(self):
+        self.data = None
+
+    def get_retained_bytes(self):
+        return _nbytes(self.data)
+
+
+# A callable which takes the name, or no argument and returns the data of the
+# module, decided once by its code, or by the first call if it has no code.
+class _CallableProvider(DataProvider):
+
+    def __init__(self, func, names, takes_name=None):
+        if takes_name is None:
+            takes_name = _takes_argument(func)
+        self.func = func
+        self.names = names
+        self.takes_name = takes_name
+
+    def get(self, name):
+        if self.takes_name is None:
+            try:
+                data = self.func(name)
+            except TypeError as e:
+                # the messages of builtins vary, e.g. "takes no arguments"
+                if 'argument' not in str(e):
+                    raise
+                self.takes_name = False
+            else:
+                self.takes_name = True
+                return data
+        if self.takes_name:
+            return self.func(name)
+        if name not in self.names:
+            raise OSError(0, '', name)
+        return self.func()
+
+# Return whether the callable can be called with one argument, by its code
+# object, without import inspect. None if it has no code, e.g. builtins.
+def _takes_argument(func):
+    skip = 0
+    if isinstance(getattr(func, 'args', None), tuple) and \
+            callable(getattr(func, 'func', None)):  # functools.partial
+        func, skip = func.func, len(func.args)
+    if hasattr(func, '__func__'):  # bound method
+        func, skip = func.__func__, skip + 1
+    elif not hasattr(func, '__code__') and not isinstance(func, type):
+        call = getattr(type(func), '__call__', None)
+        if hasattr(call, '__code__'):  # instance of a Python class
+            func, skip = call, skip + 1
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return None
+    nargs = code.co_argcount - skip
+    required = nargs - len(getattr(func, '__defaults__', None) or ())
+    kwrequired = code.co_kwonlyargcount - len(
+            getattr(func, '__kwdefaults__', None) or ())
+    return (nargs >= 1 or bool(code.co_flags & 0x04)) and \
+           required <= 1 and not kwrequired  # 0x04 is CO_VARARGS
+
+
+# The data which has been obtained, the others are resolved by the fallback.
+class _MappingProvider(DataProvider):
+
+    def __init__(self, mapping, fallback):
+        self.mapping = mapping
+        self.fallback = fallback
+        self.cacheable = fallback.cacheable
+
+    def get(self, name):
+        try:
+            return self.mapping[name]
+        except KeyError:
+            return self.fallback.get(name)
+
+    def size_hint(self, name):
+        data = self.mapping.get(name)
+        if data is None:
+            return self.fallback.size_hint(name)
+        return _nbytes(data)
+
+
+def as_provider(data, names=()):
+    '''Adapt the data to a `DataProvider`, a provider is returned as is, a
+    callable or a bytes-like object serves the "names" of the module.
+    '''
+    if isinstance(data, DataProvider):
+        return data
+    _check_data(data)
+    if callable(data):
+        return _CallableProvider(data, names)
+    return _BufferProvider(data, names)
+
+# Return the provider of the loader.
+def _loader_provider(loader):
+    get_data_provider = getattr(loader, 'get_data_provider', None)
+    if get_data_provider is not None:
+        return get_data_provider()
+    return _CallableProvider(loader.get_data, (), takes_name=True)
+
+# Return the provider of the spec, it is adapted by `_make_spec` and saved as
+# the loader state, or by the loader.
+def _spec_provider(spec):
+    provider = spec.loader_state
+    if not isinstance(provider, DataProvider):
+        provider = _loader_provider(spec.loader)
+        if spec.loader_state is None:
+            spec.loader_state = provider
+    return provider
+
+
 class MemExtensionFileLoader(ExtensionFileLoader):
 
     def __init__(self, name, path, data):
+        self.provider = as_provider(data, (name, path))
         self.name = name
         self.path = path
         self.data = data
@@ -68,17 +305,44 @@ class MemExtensionFileLoader(ExtensionFileLoader):
         pass
 
     def get_data(self, path):
-        try:
-            if callable(self.data):
-                return self.data(path)
-        except TypeError as e:
-            if 'takes 0 positional arguments' not in str(e):
-                raise
-        if path in (self.name, self.path):
-            if callable(self.data):
-                return self.data()
-            return self.data
-        raise OSError(0, '', path)
+        return self.provider.get(path)
+
+    def get_data_provider(self):
+        return self.provider
+
+    # The image is copied while loading, drop the data. A bytes-like data can
+    # not be fetched again, `get_data` raises OSError after that, pass a
+    # callable if it is needed. A callable is kept, it fetches the data again.
+    def release_data(self, fullname):
+        self.provider.release()
+        if not callable(self.data):
+            self.data = None
+
+    def get_retained_bytes(self, fullname):
+        return self.provider.get_retained_bytes()
+
+
+# Return the size of a buffer, 0 if it is not a buffer.
+def _nbytes(data):
+    try:
+        with memoryview(data) as view:
+            return view.nbytes
+    except TypeError:
+        return 0
+
+# Check the data is a callable or a C-contiguous buffer, without copy it.
+def _check_data(data):
+    if (data is None or isinstance(data, (bytes, DataProvider)) or
+            callable(data)):
+        return
+    try:
+        with memoryview(data) as view:
+            contiguous = view.c_contiguous
+    except TypeError:
+        raise TypeError('argument "data" MUST be a bytes-like object or a '
+                        f'callable, not {type(data).__name__!r}') from None
+    if not contiguous:
+        raise BufferError('argument "data" MUST be a C-contiguous buffer')
 
 
 def memimport_from_data(fullname, data, is_package=None):
@@ -93,9 +357,14 @@ def memimport_from_spec(spec, data=None, is_package=None):
 
 def memimport(data=None, spec=None,
               fullname=None, loader=None, origin=None, is_package=None):
+    spec = _make_spec(data, spec, fullname, loader, origin, is_package)
+    return _load_spec(spec, _spec_provider(spec))
+
+# Return the spec of a memimport call, see `memimport()` for the arguments.
+def _make_spec(data=None, spec=None, fullname=None, loader=None, origin=None,
+               is_package=None):
+    _check_data(data)
     if spec:
-        if not fullname:
-            fullname = spec.name
         if is_package and spec.submodule_search_locations is None:
             spec.submodule_search_locations = []
     elif fullname:
@@ -109,7 +378,8 @@ def memimport(data=None, spec=None,
                         'so argument "data" or "origin" MUST be provided.'
                         )
                 origin = '<unknown>'
-        origin = origin.replace('/', '\\')
+        if path_sep == '\\':
+            origin = origin.replace('/', '\\')
         if loader is None:
             if data is None:
                 if not _path_isfile(origin):
@@ -123,27 +393,151 @@ def memimport(data=None, spec=None,
         spec = ModuleSpec(fullname, loader, origin=origin, is_package=is_package)
     else:
         raise ValueError('argument "spec" or "fullname" MUST be provided.')
+    _spec_provider(spec)
+    return spec
+
+# The path which the image is read with.
+def _spec_path(spec):
+    return spec.origin == '<unknown>' and spec.name or spec.origin
 
+# Import the module of the spec, the image and its DLLs are read by the
+# provider, the cacheable results are reused in this import.
+def _load_spec(spec, provider):
+    fullname = spec.name
     loader = spec.loader
     origin = spec.origin
-    path = origin == '<unknown>' and fullname or origin
+    path = _spec_path(spec)
     spec._set_fileattr = origin != '<unknown>'  # has_location, use for reload
     sub_search = spec.submodule_search_locations
     if sub_search is not None and not sub_search:
-        sub_search.append(origin.rpartition('\\')[0])
+        sub_search.append(origin.rpartition(path_sep)[0])
 
     initname = export_hook_name(fullname)
-    mod = import_module(fullname, path, initname, loader.get_data, spec)
-    # init attributes
-    mod.__spec__ = spec
-    mod.__file__ = origin
-    mod.__loader__ = loader
-    mod.__package__ = spec.parent
-    if sub_search is not None:
-        mod.__path__ = sub_search
-    _verbose_msg(f'import {fullname} # loaded from {origin}')
+    image_size = 0
+    get_data = provider.get
+    cache = provider.cacheable and {} or None
+    def findproc(name):
+        nonlocal image_size
+        if cache is None:
+            data = get_data(name)
+        else:
+            data = cache.get(name)
+            if data is None:
+                data = cache[name] = get_data(name)
+        if name == path:
+            image_size = _nbytes(data)
+        return data
+    entry = _enter_import(fullname)
+    try:
+        with entry[0]:
+            # another thread imported it while we were waiting
+            mod = entry[2]
+            if mod is not None and mod.__spec__.origin == origin:
+                return mod
+            start = _perf_counter()
+            try:
+                if _trace_hooks:
+                    mod = _import_module_traced(fullname, path, initname,
+                                                findproc, spec)
+                else:
+                    mod = import_module(fullname, path, initname, findproc,
+                                        spec)
+            except BaseException:
+                _count(failures=1, import_time=_perf_counter() - start)
+                raise
+            _count(modules=1, image_bytes=image_size,
+                   import_time=_perf_counter() - start)
+            # init attributes
+            mod.__spec__ = spec
+            mod.__file__ = origin
+            mod.__loader__ = loader
+            mod.__package__ = spec.parent
+            if sub_search is not None:
+                mod.__path__ = sub_search
+            entry[2] = mod
+            _modules_imported[fullname] = _weakref.ref(mod), image_size
+    finally:
+        _leave_import(fullname, entry)
+    # the loader is kept by the module, do not let it pin the image
+    release_data = getattr(loader, 'release_data', None)
+    if release_data is not None:
+        release_data(fullname)
+    _verbose_msg('import {} # loaded from {}', fullname, origin)
     return mod
 
+# Imports of an extension are serialized, so concurrent imports map it once,
+# the threads which waited for an import get its module. Imports after that
+# map the image again, as requested.
+# fullname -> [lock, users, module], removed when the last user leaves
+_module_imports = {}
+_module_imports_lock = _thread.allocate_lock()
+# fullname -> (weakref of the module which was imported last, image size),
+# the modules are not kept alive here, the dead ones are pruned by
+# `get_memory_info`
+_modules_imported = {}
+
+# Cumulative counters, see `stats`.
+_stats = dict(modules=0, failures=0, image_bytes=0, import_time=0.0)
+_stats_lock = _thread.allocate_lock()
+
+def _count(**counts):
+    with _stats_lock:
+        for counter, n in counts.items():
+            _stats[counter] += n
+
+def _enter_import(fullname):
+    with _module_imports_lock:
+        entry = _module_imports.get(fullname)
+        if entry is None:
+            entry = _module_imports[fullname] = [_thread.RLock(), 0, None]
+        entry[1] += 1
+    return entry
+
+def _leave_import(fullname, entry):
+    with _module_imports_lock:
+        entry[1] -= 1
+        if not entry[1]:
+            del _module_imports[fullname]
+
+
+def get_memory_info():
+    '''Return {fullname: {"image": bytes, "retained": bytes}} of the modules
+    imported from memory, the size of the image, and the size of the data
+    which is still retained by the loader, see `release_data` of the loaders.
+    '''
+    info = {}
+    for fullname, item in list(_modules_imported.items()):
+        ref, image_size = item
+        mod = ref()
+        if mod is None:
+            if _modules_imported.get(fullname) is item:
+                _modules_imported.pop(fullname, None)
+            continue
+        get_retained_bytes = getattr(mod.__spec__.loader,
+                                     'get_retained_bytes', None)
+        try:
+            retained = get_retained_bytes and get_retained_bytes(fullname) or 0
+        except ImportError:
+            continue  # the loader does not know it anymore, e.g. zip changed
+        info[fullname] = {'image': image_size, 'retained': retained}
+    return info
+
+
+def stats(reset=False):
+    '''Return a dict of the cumulative counters of the imports from memory:
+        "modules" - modules loaded, "failures" - imports which raised.
+        "image_bytes" - total size of the images of the modules.
+        "import_time" - seconds spent in `import_module`, includes loading
+                        the DLLs and calling the init functions.
+    If "reset" is True, zero the counters after read them.
+    '''
+    with _stats_lock:
+        result = dict(_stats)
+        if reset:
+            _stats.update(dict.fromkeys(_stats, 0))
+            _stats['import_time'] = 0.0
+    return result
+
 
 # PEP 489 multi-phase initialization / Export Hook Name
 def export_hook_name(fullname):
@@ -157,11 +551,193 @@ def export_hook_name(fullname):
         return 'PyInit_' + name
 
 
+################################################################################
+# asyncio API
+################################################################################
+
+async def memimport_async(data=None, spec=None, fullname=None, loader=None,
+                          origin=None, is_package=None, dependencies=None,
+                          limit=8):
+    '''Same as `memimport()`, but the data is obtained without block the
+    event loop, the import is performed on the loop thread.
+
+    The data can also be a coroutine function or an awaitable, the blocking
+    callables and `loader.get_data` are called in the default executor.
+
+    Argument "dependencies":
+        A mapping of the DLL names which the extension needs -> their data,
+        they are obtained concurrently with the module, up to "limit" at a
+        time. The DLLs not in it are read by the loader at import time.
+    '''
+    return (await memimport_many_async(
+        [dict(data=data, spec=spec, fullname=fullname, loader=loader,
+              origin=origin, is_package=is_package)],
+        dependencies, limit))[0]
+
+async def memimport_many_async(modules, dependencies=None, limit=8):
+    '''Import many extensions from memory, their data and the dependencies
+    are obtained concurrently, up to "limit" at a time, see `memimport_async()`.
+
+    Argument "modules":
+        A mapping of fullname -> data, or an iterable of dicts of the
+        `memimport()` arguments.
+
+    The modules are imported on the loop thread in the given order, except
+    the packages are imported before their submodules. Return a list of the
+    modules in the given order.
+    '''
+    import asyncio
+    if hasattr(modules, 'items'):
+        modules = [dict(fullname=fullname, data=data)
+                   for fullname, data in modules.items()]
+    else:
+        modules = [dict(kwargs) for kwargs in modules]
+    dependencies = dict(dependencies or {})
+    semaphore = asyncio.Semaphore(limit)
+
+    # Start all fetches, the data are stored back to the kwargs
+    async def fetch_module(kwargs):
+        data = kwargs.get('data')
+        if data is not None:
+            path = (kwargs.get('origin') or kwargs.get('fullname') or
+                    kwargs['spec'].name)
+            kwargs['data'] = await _fetch_async(data, path, semaphore)
+        spec = _make_spec(**kwargs)
+        if data is None:
+            kwargs['data'] = await _fetch_async(_spec_provider(spec),
+                                                _spec_path(spec), semaphore)
+        return spec
+    async def fetch_dependency(name, data):
+        dependencies[name] = await _fetch_async(data, name, semaphore)
+    loop = _get_running_loop(asyncio)
+    # the larger ones start first, if the providers know the sizes
+    def size_hint(kwargs):
+        data = kwargs.get('data')
+        if isinstance(data, DataProvider):
+            return data.size_hint(kwargs.get('origin') or
+                                  kwargs.get('fullname') or
+                                  kwargs['spec'].name) or 0
+        return 0
+    starts = sorted(modules, key=size_hint, reverse=True)
+    tasks = {id(kwargs): loop.create_task(fetch_module(kwargs))
+             for kwargs in starts}
+    specs = [tasks[id(kwargs)] for kwargs in modules]
+    fetched = asyncio.gather(*(fetch_dependency(name, data)
+                               for name, data in dependencies.items()))
+    try:
+        await fetched
+        # packages first, keep the given order in each level
+        order = sorted(range(len(modules)),
+                       key=lambda i: (modules[i].get('fullname') or
+                                      modules[i]['spec'].name).count('.'))
+        result = [None] * len(modules)
+        for i in order:
+            spec = await specs[i]
+            result[i] = _load_spec(spec, _MappingProvider(
+                    {_spec_path(spec): modules[i]['data'], **dependencies},
+                    _spec_provider(spec)))
+        return result
+    finally:
+        for task in specs:
+            task.cancel()
+        fetched.cancel()
+
+# Return the loop of the running coroutine, `get_running_loop` is py >= 37,
+# `get_event_loop` returns the same in a coroutine.
+def _get_running_loop(asyncio):
+    return getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+
+# Return the data for the path, call it without block the event loop.
+async def _fetch_async(data, path, semaphore):
+    import asyncio
+    async with semaphore:
+        if asyncio.iscoroutinefunction(data):
+            data = as_provider(data, (path,)).get(path)
+        elif callable(data) or isinstance(data, DataProvider):
+            data = await _get_running_loop(asyncio).run_in_executor(
+                    None, as_provider(data, (path,)).get, path)
+        if hasattr(data, '__await__'):
+            data = await data
+    _check_data(data)
+    return data
+
+
+_trace_hooks = []
+_trace_local = _thread._local()
+
+def add_trace_hook(hook):
+    '''Register a callable which will be called with each traced event.'''
+    if hook not in _trace_hooks:
+        _trace_hooks.append(hook)
+
+def remove_trace_hook(hook):
+    '''Unregister a callable which registered by `add_trace_hook`.'''
+    try:
+        _trace_hooks.remove(hook)
+    except ValueError:
+        pass
+
+def print_trace(event, file=None):
+    '''A trace hook which prints the events likes `-X importtime`.'''
+    nbytes = event['bytes']
+    print('import trace: {:<7} | {:>10} us | {:>10} B | {}{}'.format(
+              event['phase'], int(event['elapsed'] * 1e6),
+              '-' if nbytes is None else nbytes,
+              '  ' * event['depth'], event['name']),
+          file=file or sys.stderr)
+
+# Call the trace hooks with an event, the phase ended at now or end.
+def _trace(phase, name, path, start, nbytes=None, end=None):
+    if end is None:
+        end = _perf_counter()
+    event = {'phase': phase, 'name': name, 'path': path, 'start': start,
+             'elapsed': end - start, 'bytes': nbytes,
+             'depth': getattr(_trace_local, 'depth', 0)}
+    for hook in tuple(_trace_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            _verbose_msg('# memimport: trace hook {!r} failed: {}', hook, e)
+
+def _import_module_traced(fullname, path, initname, get_data, spec):
+    nbytes = 0
+    def findproc(path):
+        nonlocal nbytes
+        data = get_data(path)
+        try:
+            with memoryview(data) as view:
+                nbytes += view.nbytes
+        except TypeError:
+            pass
+        return data
+    marks = {}
+    def tracer(phase):
+        marks[phase] = _perf_counter()
+    depth = getattr(_trace_local, 'depth', 0)
+    _trace_local.depth = depth + 1
+    start = _perf_counter()
+    try:
+        if _has_tracer:
+            mod = import_module(fullname, path, initname, findproc, spec, tracer)
+        else:
+            mod = import_module(fullname, path, initname, findproc, spec)
+    finally:
+        end = _perf_counter()
+        _trace_local.depth = depth
+    if 'map' in marks:
+        _trace('map', fullname, path, start, nbytes, marks['map'])
+        _trace('init', fullname, path, marks['map'], None, marks.get('init', end))
+    else:
+        _trace('map', fullname, path, start, nbytes, end)
+    return mod
+
+
 verbose = sys.flags.verbose
 
-def _verbose_msg(msg, verbosity=1):
+# The message is formatted with the arguments only if it will be printed.
+def _verbose_msg(msg, *args, verbosity=1):
     if max(verbose, sys.flags.verbose) >= verbosity:
-        print(msg, file=sys.stderr)
+        print(msg.format(*args), file=sys.stderr)
 
 def set_verbose(i=1):
     '''Set verbose, the argument as same as built-in function int's.'''
@@ -178,7 +754,7 @@ from _frozen_importlib_external import \
 
 def _path_split(path):
     '''Replacement for os.path.split.'''
-    i = path.rfind('\\')
+    i = path.rfind(path_sep)
     if i < 0:
         return '', path
     return path[:i], path[i+1:]
@@ -200,7 +776,24 @@ def _path_exists(path):
     return True
 
 
-from nt import mkdir as _mkdir
+_mkdir, _replace, _unlink, _getpid = _os.mkdir, _os.replace, _os.unlink, _os.getpid
+
+if path_sep == '\\':
+    _getenv = _os.environ.get
+
+    def _setenv(key, value):
+        _os.environ[key] = value
+else:
+    # posix.environ uses bytes
+    def _getenv(key, default=None):
+        value = _os.environ.get(key.encode())
+        if value is None:
+            return default
+        return value.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+    def _setenv(key, value):
+        _os.environ[key.encode()] = \
+                value.encode(sys.getfilesystemencoding(), 'surrogateescape')
 
 def _makedirs(name, mode=0o777):
     '''Replacement for os.makedirs.'''
@@ -219,3 +812,53 @@ def _makedirs(name, mode=0o777):
     except OSError:
         if not _path_isdir(name):
             raise
+
+
+def _write_atomic(path, data):
+    '''Write data to a temporary file, then rename it to the path.'''
+    path_tmp = f'{path}.{_getpid()}.{id(data)}.tmp'
+    try:
+        with _io.open(path_tmp, 'wb') as f:
+            f.write(data)
+        _replace(path_tmp, path)
+    except:
+        try:
+            _unlink(path_tmp)
+        except OSError:
+            pass
+        raise
+
+
+################################################################################
+# Linux backend, if the _memimporter is unavailable
+################################################################################
+
+def _import_module_memfd(fullname, path, initname, findproc, spec, tracer=None):
+    '''Same as `_memimporter.import_module`, but load the image by dlopen with
+    the path of a memfd. PyInit is called while mapping, single-phase modules
+    will be initialized before the 'map' phase ended.
+    The memfd is kept open, dlopen identifies the loaded libraries by the path,
+    a reused fd number will get the previous library.
+    '''
+    import _imp
+    data = findproc(path)
+    fd = _os.memfd_create(fullname, _os.MFD_CLOEXEC)
+    try:
+        with memoryview(data) as view, view.cast('B') as view:
+            offset = 0
+            while offset < len(view):
+                offset += _os.write(fd, view[offset:])
+        spec_fd = ModuleSpec(fullname, spec.loader, origin=f'/proc/self/fd/{fd}')
+        mod = _imp.create_dynamic(spec_fd)
+    except:
+        _os.close(fd)
+        raise
+    if tracer:
+        tracer('map')
+    _imp.exec_dynamic(mod)
+    if tracer:
+        tracer('init')
+    return mod
+
+if import_module is None:
+    import_module = _import_module_memfd
@@ -0,0 +1,43 @@
+'''PE image fixtures for the tests and the benchmarks'''
+
+
+def make_pe(exports=(), imports=(), pe32plus=True, padding=0):
+    '''Build a minimal PE image fixture which exports and imports the names.'''
+    import struct
+    rva = 0x1000
+    names = sorted(name.encode() for name in exports)
+    # export directory, name pointer table, names
+    names_rva = rva + 40
+    strings_rva = names_rva + 4 * len(names)
+    strings = b''
+    pointers = b''
+    for name in names:
+        pointers += struct.pack('<I', strings_rva + len(strings))
+        strings += name + b'\0'
+    edata = struct.pack('<6I4I', 0, 0, 0, 0, 1, len(names), len(names),
+                        0, names_rva if names else 0, 0)
+    edata += pointers + strings
+    # import descriptors, DLL names
+    idata_rva = rva + len(edata)
+    strings_rva = idata_rva + 20 * (len(imports) + 1)
+    strings = b''
+    idata = b''
+    for name in imports:
+        idata += struct.pack('<5I', 0, 0, 0, strings_rva + len(strings), 0)
+        strings += name.encode() + b'\0'
+    idata += b'\0' * 20 + strings
+    section = edata + idata + b'\0' * padding
+    ndirs = 16
+    optsize = (112 if pe32plus else 96) + ndirs * 8
+    opt = bytearray(optsize)
+    struct.pack_into('<H', opt, 0, pe32plus and 0x20b or 0x10b)
+    struct.pack_into('<5I', opt, optsize - ndirs * 8 - 4, ndirs,
+                     rva if names else 0, len(edata) if names else 0,
+                     idata_rva if imports else 0, len(idata) if imports else 0)
+    header = b'MZ' + b'\0' * 58 + struct.pack('<I', 64)
+    header += b'PE\0\0' + struct.pack('<HHIIIHH', pe32plus and 0x8664 or 0x14c,
+                                      1, 0, 0, 0, optsize, 0x2022)
+    header += opt
+    header += struct.pack('<8s6I2HI', b'.rdata', len(section), rva,
+                          len(section), 0x200, 0, 0, 0, 0, 0x40000040)
+    return header.ljust(0x200, b'\0') + section
@@ -12,8 +12,8 @@ from importlib import machinery
 
 if sys.argv != ['setup.py', 'sdist']:
 
-    if platform.system() != "Windows":
-        raise RuntimeError("This package requires Windows")
+    if platform.system() not in ("Windows", "Linux"):
+        raise RuntimeError("This package requires Windows or Linux")
 
     if sys.version_info < (3, 6):
         raise RuntimeError("This package requires Python 3.6 or later")
@@ -81,7 +81,7 @@ if __name__ == "__main__":
             "MPL2-License.txt",
         ],
         setup_requires=["wheel"],
-        platforms="Windows",
+        platforms="Windows, Linux",
         python_requires=">=3.6, <3.12",
 
         classifiers=[
@@ -90,6 +90,7 @@ if __name__ == "__main__":
             "License :: OSI Approved :: MIT License",
             "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)",
             "Operating System :: Microsoft :: Windows",
+            "Operating System :: POSIX :: Linux",
             "Programming Language :: C",
             "Programming Language :: Python :: 3",
             "Programming Language :: Python :: 3.6",
@@ -106,6 +107,7 @@ if __name__ == "__main__":
             "Topic :: Utilities",
         ],
 
-        ext_modules=[_memimporter],
-        py_modules=["memimport", "zipextimporter"],
+        # Linux uses the memfd backend in memimport, no extension
+        ext_modules=[_memimporter] if platform.system() == "Windows" else [],
+        py_modules=["memimport", "zipextimporter", "memarchive", "httpimporter"],
     )
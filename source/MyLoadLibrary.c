@@ -162,12 +162,19 @@ static HCUSTOMMODULE _LoadLibrary(LPCSTR filename, void *userdata)
 		// So we implement a special CallFindproc function
 		// which encapsulates the dance we have to do.
 //		PyObject *res = PyObject_CallFunction(findproc, "s", filename);
+		//
+		// findproc may return bytes or any object which supports the
+		// buffer protocol (bytearray, memoryview, mmap...), the image
+		// is copied by MemoryLoadLibraryEx, so the buffer is released
+		// as soon as the library has been loaded.
 		PyObject *res = CallFindproc(findproc, filename);
-		if (res && PyBytes_AsString(res)) {
-			result = MemoryLoadLibraryEx(PyBytes_AsString(res), PyBytes_GET_SIZE(res),
+		Py_buffer view;
+		if (res && PyObject_GetBuffer(res, &view, PyBUF_SIMPLE) == 0) {
+			result = MemoryLoadLibraryEx(view.buf, (size_t)view.len,
 				MemoryDefaultAlloc, MemoryDefaultFree,
 				_LoadLibrary, _GetProcAddress, _FreeLibrary,
 				userdata);
+			PyBuffer_Release(&view);
 			Py_DECREF(res);
 			if (result) {
 				lib = _AddMemoryModule(filename, result);
@@ -180,6 +187,7 @@ static HCUSTOMMODULE _LoadLibrary(LPCSTR filename, void *userdata)
 					filename, userdata, GetLastError());
 			}
 		} else {
+			Py_XDECREF(res);
 			PyErr_Clear();
 		}
 	}
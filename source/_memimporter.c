@@ -141,6 +141,32 @@ int do_import(FARPROC init_func, char *modname, PyObject *spec, PyObject **mod)
 extern wchar_t dirname[]; // executable/dll directory
 #endif
 
+/* Call tracer(phase) if it is given, errors of the tracer are ignored.
+   The pending exception, e.g. of a failed init, is kept. */
+static void call_tracer(PyObject *tracer, const char *phase)
+{
+	PyObject *args, *res;
+	PyObject *type, *value, *traceback;
+	if (tracer == NULL || tracer == Py_None)
+		return;
+	PyErr_Fetch(&type, &value, &traceback);
+	// no variadic calls, same as CallFindproc in MyLoadLibrary.c
+	args = PyTuple_New(1);
+	if (args == NULL || -1 == PyTuple_SetItem(args, 0, PyUnicode_FromString(phase))) {
+		Py_XDECREF(args);
+		PyErr_Clear();
+		PyErr_Restore(type, value, traceback);
+		return;
+	}
+	res = PyObject_CallObject(tracer, args);
+	Py_DECREF(args);
+	if (res == NULL)
+		PyErr_Clear();
+	else
+		Py_DECREF(res);
+	PyErr_Restore(type, value, traceback);
+}
+
 static PyObject *
 import_module(PyObject *self, PyObject *args)
 {
@@ -153,6 +179,7 @@ import_module(PyObject *self, PyObject *args)
 	ULONG_PTR cookie = 0;
 	PyObject *findproc;
 	PyObject *spec;
+	PyObject *tracer = NULL;
 	BOOL res;
 
 	int imp_res = -1;
@@ -162,12 +189,13 @@ import_module(PyObject *self, PyObject *args)
 	//	MessageBox(NULL, "ATTACH", "NOW", MB_OK);
 	//	DebugBreak();
 
-	/* code, initfuncname, fqmodulename, path, spec */
-	if (!PyArg_ParseTuple(args, "sssOO:import_module",
+	/* code, initfuncname, fqmodulename, path, spec[, tracer] */
+	if (!PyArg_ParseTuple(args, "sssOO|O:import_module",
 			      &modname, &pathname,
 			      &initfuncname,
 			      &findproc,
-				  &spec))
+				  &spec,
+				  &tracer))
 		return NULL;
 
 	PyObject *m = PyModule_New(modname);
@@ -237,6 +265,8 @@ import_module(PyObject *self, PyObject *args)
 		return NULL;
 	}
 
+	call_tracer(tracer, "map");
+
 	init_func = MyGetProcAddress(hmem, initfuncname);
 	imp_res = do_import(init_func, modname, spec, &m);
 
@@ -246,13 +276,18 @@ import_module(PyObject *self, PyObject *args)
 	} else if (imp_res == 2) {
 		def = PyModule_GetDef(m);
 		state = PyModule_GetState(m);
-		if (state == NULL) {
-			PyModule_ExecDef(m, def);
+		if (state == NULL && PyModule_ExecDef(m, def) < 0) {
+			/* the def is in the image, which is kept while m may live */
+			Py_DECREF(m);
+			call_tracer(tracer, "init");
+			return NULL;
 		}
+		call_tracer(tracer, "init");
 		return m;
 	}
 
 	Py_DECREF(m);
+	call_tracer(tracer, "init");
 
 	/* Retrieve from sys.modules */
 	return PyImport_ImportModule(modname);
@@ -266,7 +301,7 @@ get_verbose_flag(PyObject *self, PyObject *args)
 
 static PyMethodDef methods[] = {
 	{ "import_module", import_module, METH_VARARGS,
-	  "import_module(modname, pathname, initfuncname, finder, spec) -> module" },
+	  "import_module(modname, pathname, initfuncname, finder, spec[, tracer]) -> module" },
 	{ "get_verbose_flag", get_verbose_flag, METH_NOARGS,
 	  "Return the Py_Verbose flag" },
 	{ NULL, NULL },		/* Sentinel */
@@ -287,5 +322,13 @@ static struct PyModuleDef moduledef = {
 
 PyMODINIT_FUNC PyInit__memimporter(void)
 {
-	return PyModule_Create(&moduledef);
+	PyObject *m = PyModule_Create(&moduledef);
+	if (m == NULL)
+		return NULL;
+	/* import_module() accepts a tracer, see memimport */
+	if (PyModule_AddIntConstant(m, "has_tracer", 1) < 0) {
+		Py_DECREF(m);
+		return NULL;
+	}
+	return m;
 }
@@ -1,5 +1,8 @@
 '''Test memory importer'''
 
+from pefixture import make_pe
+
+
 def prepare():
     import zipfile
     import _memimporter
@@ -69,11 +72,964 @@ def test_memimport():
         print('excepted error:', repr(err))
         assert err
 
+def test_memimport_async():
+    import asyncio
+    from memimport import memimport_many_async
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    name = ext.__name__
+
+    sys.modules['asyncpkg'] = asyncpkg = type(sys)('asyncpkg')
+    asyncpkg.__path__ = []
+    running = 0
+    async def get_data():
+        nonlocal running
+        running += 1
+        await asyncio.sleep(0.1)
+        assert running == 2, running  # fetched concurrently
+        return open(ext.__file__, 'rb').read()
+    def get_data_blocking(path):
+        return open(ext.__file__, 'rb').read()
+    # the package is imported before its submodule
+    mods = asyncio.run(memimport_many_async(
+            [dict(fullname=f'asyncpkg.{name}.{name}', data=get_data),
+             dict(fullname=f'asyncpkg.{name}', data=get_data, is_package=True)],
+            dependencies={'unused.dll': get_data_blocking}, limit=2))
+    assert [mod.__name__ for mod in mods] == [f'asyncpkg.{name}.{name}', f'asyncpkg.{name}']
+    assert mods[1].__path__ is not None
+
+def test_concurrent_imports():
+    import time
+    import threading
+    import memimport
+    import zipextimporter
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    name = f'threadpkg.{ext.__name__}'
+    sys.modules['threadpkg'] = threadpkg = type(sys)('threadpkg')
+    threadpkg.__path__ = []
+
+    def get_data():
+        time.sleep(0.1)
+        return open(ext.__file__, 'rb').read()
+    mods = []
+    def run():
+        mods.append(memimport.memimport(data=get_data, fullname=name))
+    maps = []
+    memimport.add_trace_hook(maps.append)
+    try:
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        memimport.remove_trace_hook(maps.append)
+    assert len(mods) == 4 and all(mod is mods[0] for mod in mods)
+    assert [e['phase'] for e in maps].count('map') == 1, maps
+    assert not memimport._module_imports
+    # not concurrent, import it again
+    assert memimport.memimport(data=get_data, fullname=name) is not mods[0]
+
+    # the name sets are replaced, not changed in place
+    names = zipextimporter._names_cached
+    zipextimporter.set_exclude_modules('threadpkg.cached')
+    assert 'threadpkg.cached' not in names
+    assert 'threadpkg.cached' in zipextimporter.list_exclude_modules()
+
+def test_memory_info():
+    import memimport
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    name = f'mempkg_info.{ext.__name__}'
+    sys.modules['mempkg_info'] = mempkg_info = type(sys)('mempkg_info')
+    mempkg_info.__path__ = []
+    data = open(ext.__file__, 'rb').read()
+    mod = memimport.memimport(data=data, fullname=name)
+    # the image is not pinned by the loader after loaded
+    assert mod.__loader__.data is None
+    info = memimport.get_memory_info()[name]
+    assert info == {'image': len(data), 'retained': 0}, info
+    try:
+        mod.__loader__.get_data(mod.__file__)
+    except OSError as e:
+        print('excepted error:', repr(e))
+    else:
+        raise AssertionError('the released data was returned')
+    # a callable fetches the data again
+    sys.modules['mempkg_info2'] = mempkg_info2 = type(sys)('mempkg_info2')
+    mempkg_info2.__path__ = []
+    name = f'mempkg_info2.{ext.__name__}'
+    mod = memimport.memimport(data=lambda: data, fullname=name)
+    assert mod.__loader__.get_data(mod.__file__) == data
+
+    # the modules are not kept alive, the stale ones are skipped
+    import gc
+    import zipimport
+    def get_retained_bytes(fullname):
+        raise zipimport.ZipImportError(fullname)
+    mod.__loader__.get_retained_bytes = get_retained_bytes
+    assert name in memimport._modules_imported
+    assert name not in memimport.get_memory_info()
+    sys.modules.pop(name, None)
+    del mod
+    gc.collect()
+    memimport.get_memory_info()
+    assert name not in memimport._modules_imported
+
+def test_data_provider():
+    import memimport
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    data = open(ext.__file__, 'rb').read()
+
+    # the arity of a callable is decided once, its TypeError is not hidden
+    def get_data():
+        raise TypeError('f() takes 0 positional arguments but 1 was given')
+    provider = memimport.as_provider(get_data, ('mod',))
+    try:
+        provider.get('mod')
+    except TypeError as e:
+        print('excepted error:', repr(e))
+    else:
+        assert False, 'TypeError was hidden'
+    provider = memimport.as_provider(lambda name: data, ('mod',))
+    assert provider.get('other') is data
+    # by the code objects, or by the first call of the builtins
+    import functools
+    class Getter:
+        def __call__(self, name):
+            return data
+        def get(self):
+            return data
+    for func, takes_name in ((Getter(), True), (Getter().get, False),
+                             (functools.partial(lambda a, name: data, 1), True),
+                             (lambda name, size=0: data, True),
+                             (lambda name, size: data, False)):
+        assert memimport._takes_argument(func) is takes_name, func
+    provider = memimport.as_provider(data.__len__, ('mod',))
+    assert provider.takes_name is None and provider.get('mod') == len(data)
+    assert provider.takes_name is False
+    provider = memimport.as_provider(data, ('mod',))
+    assert provider.cacheable and provider.size_hint('mod') == len(data)
+    assert provider.get_many(['mod', 'other']) == {'mod': data}
+    assert memimport.as_provider(provider) is provider
+
+    class Provider(memimport.DataProvider):
+        requested = []
+        def get(self, name):
+            self.requested.append(name)
+            return data
+    name = f'provpkg.{ext.__name__}'
+    sys.modules['provpkg'] = provpkg = type(sys)('provpkg')
+    provpkg.__path__ = []
+    mod = memimport.memimport(data=Provider(), fullname=name)
+    assert mod.__name__ == name
+    assert Provider.requested[0] == name, Provider.requested
+    assert mod.__spec__.loader_state is mod.__loader__.get_data_provider()
+
+def test_meta_path_finder():
+    import zipfile
+    import zipextimporter
+    for i in range(3):
+        with zipfile.ZipFile(f'testmeta{i}.zip', 'w') as zf:
+            zf.writestr(f'testmeta{i}.py', f'value = {i}')
+            zf.writestr('testmetashadow.py', f'value = {i}')
+    zipextimporter.install(meta_path=True)
+    finder = zipextimporter._meta_path_finder
+    assert finder in sys.meta_path
+    sys.path[:0] = ['testmeta0.zip', 'testmeta1.zip', 'testmeta2.zip']
+    try:
+        import testmeta2
+        import testmetashadow
+        assert testmeta2.value == 2 and testmetashadow.value == 0
+        assert finder.find_spec('testmeta_missing') is None
+        # follow the mutation of sys.path
+        sys.path.remove('testmeta0.zip')
+        sys.modules.pop('testmetashadow')
+        import testmetashadow
+        assert testmetashadow.value == 1
+    finally:
+        for i in range(3):
+            if f'testmeta{i}.zip' in sys.path:
+                sys.path.remove(f'testmeta{i}.zip')
+
+def test_module_index():
+    import zipfile
+    import zipimport
+    import zipextimporter
+    sep = zipextimporter.path_sep
+    def make(*extra):
+        with zipfile.ZipFile('testindex.zip', 'w') as zf:
+            for name in ('pkg/', 'pkg/__init__.py', 'pkg/a.py', 'pkg/sub/b.py',
+                         'top.py', *extra):
+                zf.writestr(name, '')
+        zipimport._zip_directory_cache.pop('testindex.zip', None)
+    make()
+    importer = zipextimporter.ZipExtensionImporter('testindex.zip')
+    index = zipextimporter._get_module_index(importer)
+    assert {'pkg', 'top'} <= set(index) and 'a' not in index, index
+    assert index['pkg'][1] == f'testindex.zip{sep}pkg'
+    assert zipextimporter._get_module_info(importer, 'pkg').is_package
+    subimporter = zipextimporter.ZipExtensionImporter(f'testindex.zip{sep}pkg')
+    subindex = zipextimporter._get_module_index(subimporter)
+    assert 'a' in subindex and 'top' not in subindex, subindex
+    assert zipextimporter._get_module_index(importer) is index  # reused
+
+    # the directory changed, the index is rebuilt, the cached misses dropped
+    assert zipextimporter._get_module_info(importer, 'top2') is None
+    make('top2.py')
+    importer = zipextimporter.ZipExtensionImporter('testindex.zip')
+    assert zipextimporter._get_module_index(importer) is not index
+    assert zipextimporter._get_module_info(importer, 'top2') is not None
+
+def test_lookup_cache():
+    import threading
+    import zipextimporter
+    cache = zipextimporter._LookupCache(2)
+    cache.put(('a', '', 'x'), 1)
+    cache.put(('a', '', 'y'), 2)
+    assert cache.get(('a', '', 'x')) == (True, 1)
+    cache.put(('b', '', 'z'), 3)  # the least recently used is dropped
+    assert cache.get(('a', '', 'y')) == (False, None)
+    assert cache.get(('a', '', 'x')) == (True, 1)
+    cache.invalidate('a')
+    assert cache.info()['size'] == 1
+    assert cache.get_lookups(reset=True) == {'a': (4, 4, 0), 'b': (1, 1, 0)}
+    assert cache.get_lookups() == {}
+
+    # concurrent lookups, run test_module_index first
+    importer = zipextimporter.ZipExtensionImporter('testindex.zip')
+    names = ['pkg', 'top', 'missing'] * 200
+    expected = [zipextimporter._get_module_info(importer, name) is not None
+                for name in names]
+    before = zipextimporter._lookup_cache.get_lookups()['testindex.zip']
+    errors = []
+    def lookup():
+        try:
+            for _ in range(5):
+                found = [zipextimporter._get_module_info(importer, name) is not None
+                         for name in names]
+                assert found == expected
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    after = zipextimporter._lookup_cache.get_lookups()['testindex.zip']
+    assert after[0] - before[0] == 8 * 5 * len(names), (before, after)
+    assert after[2] - before[2] == 8 * 5 * 200, (before, after)
+
+    # the first index of a new prefix keeps the cached lookups of the others
+    zipextimporter.clear_lookup_cache()
+    info = zipextimporter.get_lookup_cache_info()
+    for name in ('top', 'pkg', 'top', 'missing'):
+        zipextimporter._get_module_info(importer, name)
+    subimporter = zipextimporter.ZipExtensionImporter(
+            zipextimporter.path_sep.join(['testindex.zip', 'pkg']))
+    zipextimporter._module_indexes.pop(('testindex.zip', subimporter.prefix), None)
+    assert zipextimporter._get_module_info(subimporter, 'a') is not None
+    assert zipextimporter._lookup_cache.get(('testindex.zip', '', 'top'))[0]
+    after = zipextimporter.get_lookup_cache_info()
+    assert after['size'] == 4, after
+    assert after['misses'] - info['misses'] == 4, (info, after)
+    assert after['hits'] - info['hits'] == 2, (info, after)
+
+def test_preload():
+    import _imp
+    import zipfile
+    import zipextimporter
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    name = ext.__name__
+    with zipfile.ZipFile('testpre.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.write(ext.__file__, f'testpre/{name}{_imp.extension_suffixes()[-1]}')
+        zf.writestr('testpre/__init__.py', '')
+        zf.writestr('testpre/mod.py', 'x = 1')
+        zf.writestr('testpre/broken.py', 'raise RuntimeError("broken")')
+    zipextimporter.install()
+    sys.path.insert(0, 'testpre.zip')
+    zipextimporter.stats(reset=True)
+
+    # preload in background, while the main thread imports
+    task = zipextimporter.preload('testpre.zip', ['testpre.*', 'testpre.missing'],
+                                  background=True)
+    import testpre.mod
+    report = task.wait(30)
+    assert report is not None and task.error is None
+    assert set(report['failed']) == {'testpre.broken', 'testpre.missing'}, report
+    errors = {module['name']: module['error'] for module in report['modules']}
+    assert errors['testpre.missing'] == 'not found'
+    assert 'broken' in errors['testpre.broken']
+    assert sys.modules[f'testpre.{name}'].__file__.startswith('testpre.zip')
+    # the extension is read once, the import took the preloaded data
+    assert not [key for key in zipextimporter._preloaded if key[0] == 'testpre.zip']
+    assert zipextimporter.stats()['archives']['testpre.zip']['reads'] == 1
+
+    try:
+        zipextimporter.preload('testpre_nonexistent.zip', ['a'])
+    except zipextimporter.ZipImportError as e:
+        print('excepted error:', repr(e))
+    else:
+        assert False, 'bad archive was not rejected'
+
+def test_data_cache():
+    import zipfile
+    import zipimport
+    import zipextimporter
+    members = {f'data{i}.bin': os.urandom(0x1000) * 4 for i in range(3)}
+    with zipfile.ZipFile('testcache.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    zipimport._zip_directory_cache.pop('testcache.zip', None)
+    importer = zipextimporter.ZipExtensionImporter('testcache.zip')
+    try:
+        # hits
+        zipextimporter.set_data_cache(0x100000)
+        for name, data in members.items():
+            assert importer.get_data(name) == data
+        info = zipextimporter.get_data_cache_info()
+        assert info['misses'] == 3 and info['members'] == 3, info
+        assert importer.get_data('data1.bin') == members['data1.bin']
+        assert zipextimporter.get_data_cache_info()['hits'] == 1
+
+        # eviction at the size limit, least recently used first
+        zipextimporter.set_data_cache(0x4000 * 2)
+        info = zipextimporter.get_data_cache_info()
+        assert info['members'] == 2 and info['bytes'] <= 0x8000, info
+        key = zipextimporter._get_data_cache_key(importer, 'data0.bin')
+        assert zipextimporter._data_cache.get_size(key) == 0
+        key = zipextimporter._get_data_cache_key(importer, 'data1.bin')
+        assert zipextimporter._data_cache.get_size(key) == 0x4000
+
+        # the archive changed, the cached data of the old member is not used
+        with zipfile.ZipFile('testcache.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('data1.bin', b'new' * 100)
+        zipimport._zip_directory_cache.pop('testcache.zip', None)
+        importer = zipextimporter.ZipExtensionImporter('testcache.zip')
+        assert importer.get_data('data1.bin') == b'new' * 100
+    finally:
+        zipextimporter.set_data_cache(0)
+        zipimport._zip_directory_cache.pop('testcache.zip', None)
+
+def test_index_cache():
+    import zipfile
+    import zipimport
+    import zipextimporter
+    with zipfile.ZipFile('testidx.zip', 'w') as zf:
+        zf.writestr('idxpkg/__init__.py', '')
+        zf.writestr('idxpkg/sub/m.py', 'x = 1')
+    if os.path.exists('testidx.zip.idx'):
+        os.remove('testidx.zip.idx')
+    zipimport._zip_directory_cache.pop('testidx.zip', None)
+    try:
+        zipextimporter.set_index_cache('archive')
+        importer = zipextimporter.ZipExtensionImporter('testidx.zip')
+        assert zipextimporter._get_module_info(importer, 'idxpkg').is_package
+        zipextimporter.save_index_cache('testidx.zip')
+        with open('testidx.zip.idx', 'rb') as f:
+            data = f.read()
+
+        files = zipextimporter._load_index_cache('testidx.zip')
+        assert files is not None
+        assert files.keys() == zipimport._zip_directory_cache['testidx.zip'].keys()
+
+        # corrupt cache, ignored
+        with open('testidx.zip.idx', 'wb') as f:
+            f.write(data[:-10])
+        assert zipextimporter._load_index_cache('testidx.zip') is None
+
+        # stale cache, the archive changed
+        with open('testidx.zip.idx', 'wb') as f:
+            f.write(data)
+        with zipfile.ZipFile('testidx.zip', 'a') as zf:
+            zf.writestr('idxpkg/new.py', '')
+        assert zipextimporter._load_index_cache('testidx.zip') is None
+    finally:
+        zipextimporter.set_index_cache(None)
+        zipimport._zip_directory_cache.pop('testidx.zip', None)
+
+def test_eggs_cache():
+    import shutil
+    import zipfile
+    import zipextimporter
+    os.environ['EGGS_CACHE'] = eggs_cache = os.path.abspath('testeggs')
+    if os.path.exists(eggs_cache):
+        shutil.rmtree(eggs_cache)
+    for i in range(2):
+        with zipfile.ZipFile(f'testeggs{i}.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('data.bin', os.urandom(0x1000) * 2)
+    importers = [zipextimporter.ZipExtensionImporter(f'testeggs{i}.zip')
+                 for i in range(2)]
+    data = importers[0].get_data('data.bin')
+    extracted = lambda: zipextimporter.stats()['archives']['testeggs0.zip']['extractions']
+
+    # extract, then reuse
+    path_cache = zipextimporter._get_cached_path(importers[0], 'data.bin')
+    with open(path_cache, 'rb') as f:
+        assert f.read() == data
+    count = extracted()
+    assert zipextimporter._get_cached_path(importers[0], 'data.bin') == path_cache
+    assert extracted() == count
+
+    # the same size, but changed content, extract again
+    with open(path_cache, 'r+b') as f:
+        f.write(b'XX')
+    assert zipextimporter._get_cached_path(importers[0], 'data.bin') == path_cache
+    assert extracted() == count + 1
+    with open(path_cache, 'rb') as f:
+        assert f.read() == data
+
+    # the directory of the archive which is not used is evicted
+    zipextimporter._get_cached_path(importers[1], 'data.bin')
+    cache_dir = zipextimporter._cache_dirs.pop('testeggs1.zip')
+    try:
+        zipextimporter.set_eggs_cache_limit(len(data) + 100)
+    finally:
+        zipextimporter.set_eggs_cache_limit(None)
+    assert not os.path.exists(cache_dir)
+    assert os.path.exists(path_cache)
+
+    # an excluded module is extracted from the first zip file which has it
+    import _imp
+    member = 'eggsext' + _imp.extension_suffixes()[-1]
+    for i in (2, 3):
+        with zipfile.ZipFile(f'testeggs{i}.zip', 'w') as zf:
+            zf.writestr(member, make_pe(['PyInit_eggsext']))
+    names_cached = zipextimporter._names_cached
+    sys.path[:0] = ['testeggs2.zip', 'testeggs3.zip']
+    try:
+        zipextimporter.set_exclude_modules('eggsext', extract=True)
+    finally:
+        del sys.path[:2]
+        zipextimporter._names_cached = names_cached
+    archives = zipextimporter.stats()['archives']
+    assert archives['testeggs2.zip']['extractions'] == 1
+    assert 'testeggs3.zip' not in archives, archives['testeggs3.zip']
+
+def test_pe_export_scan():
+    import zipfile
+    import zipimport
+    import zipextimporter
+
+    for pe32plus in (True, False):
+        data = make_pe(['PyInit_a', 'PyInit_spam', 'zzz'], pe32plus=pe32plus)
+        read = lambda offset, size: data[offset:offset+size]
+        assert zipextimporter._pe_has_export(read, 'PyInit_spam')
+        assert zipextimporter._pe_has_export(read, 'PyInit_a')
+        assert not zipextimporter._pe_has_export(read, 'PyInit_sp')
+        assert not zipextimporter._pe_has_export(read, 'PyInit_spams')
+    # string present, but not exported
+    data = make_pe(['other']) + b'PyInit_spam'
+    read = lambda offset, size: data[offset:offset+size]
+    assert not zipextimporter._pe_has_export(read, 'PyInit_spam')
+    assert not zipextimporter._pe_has_export(lambda o, s: b'', 'PyInit_spam')
+
+    # read members from zip, only the headers are decompressed
+    data = make_pe(['PyInit_spam'], padding=0x100000)
+    with zipfile.ZipFile('testpe.zip', 'w') as zf:
+        zf.writestr('stored.dll', data, zipfile.ZIP_STORED)
+        zf.writestr('deflated.dll', data, zipfile.ZIP_DEFLATED)
+    files = zipimport._read_directory('testpe.zip')
+    for name in ('stored.dll', 'deflated.dll'):
+        with zipextimporter._MemberReader('testpe.zip', files[name]) as reader:
+            assert zipextimporter._pe_has_export(reader.read, 'PyInit_spam')
+            assert reader.read(0, 2) == b'MZ'
+            assert len(reader._buffer) < len(data) // 2
+        assert zipextimporter._read_member('testpe.zip', files[name]) == data
+        # small chunks, the output held by zlib is drained at the end
+        for offset in (len(data) - 100, len(data) - 1, len(data) - 0x10000):
+            with zipextimporter._MemberReader('testpe.zip', files[name]) as reader:
+                reader.chunk_size = 7
+                assert reader.read(offset, 200) == data[offset:offset+200]
+    # a member which inflates to more or less than its size is rejected
+    toc_entry = files['deflated.dll']
+    for file_size in (0x100, len(data) - 1, len(data) + 1):
+        try:
+            zipextimporter._read_member('testpe.zip', (*toc_entry[:3], file_size,
+                                                       *toc_entry[4:]))
+        except zipimport.ZipImportError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'bad data size was not rejected'
+
+    data = make_pe(['PyInit_spam'], ['python3.dll', 'KERNEL32.dll'])
+    read = lambda offset, size: data[offset:offset+size]
+    assert zipextimporter._pe_imports(read) == ['python3.dll', 'KERNEL32.dll']
+    assert zipextimporter._pe_has_export(read, 'PyInit_spam')
+    assert zipextimporter._pe_imports(lambda o, s: b'') == []
+
+    # the DLL names are matched case insensitively, as the loader does
+    ext = make_pe(['PyInit_ext'], ['HELPER.DLL', 'KERNEL32.dll'])
+    helper = make_pe(['helper'], ['Dep.dll'])
+    dep = make_pe(['dep'])
+    with zipfile.ZipFile('testprefetch.zip', 'w') as zf:
+        zf.writestr('ext.pyd', ext)
+        zf.writestr('helper.dll', helper)
+        zf.writestr('dep.dll', dep)
+    importer = zipextimporter.ZipExtensionImporter('testprefetch.zip')
+    origin = zipextimporter.path_sep.join(['testprefetch.zip', 'ext.pyd'])
+    prefetched = zipextimporter._prefetch_dependencies(importer, origin, 2)
+    assert list(prefetched) == [origin, 'helper.dll', 'dep.dll']
+    assert prefetched['dep.dll'] == dep
+    importer._prefetched.update(prefetched)
+    assert importer._get_image('HELPER.DLL') is prefetched['helper.dll']
+    importer._prefetched.clear()
+    assert importer._get_image('DEP.dll') == dep
+    # the DLLs loaded from other archives are not skipped
+    zipextimporter._dlls_loaded.add(('other.zip', 'helper.dll'))
+    prefetched = zipextimporter._prefetch_dependencies(importer, origin, 2)
+    assert 'helper.dll' in prefetched
+    zipextimporter._dlls_loaded.add(('testprefetch.zip', 'helper.dll'))
+    prefetched = zipextimporter._prefetch_dependencies(importer, origin, 2)
+    assert list(prefetched) == [origin], prefetched
+    zipextimporter._dlls_loaded.discard(('other.zip', 'helper.dll'))
+    zipextimporter._dlls_loaded.discard(('testprefetch.zip', 'helper.dll'))
+    # the threads are bounded across the calls, the caller reads alone
+    import threading
+    caller = threading.get_ident()
+    threads = [0, 0]
+    results = zipextimporter._map_parallel(
+            lambda i: threading.get_ident(), range(8), 4, threads)
+    assert results == [(caller, None)] * 8 and threads == [0, 0]
+    threads = [0, 2]
+    zipextimporter._map_parallel(lambda i: i, range(8), 8, threads)
+    assert threads == [0, 2]
+
+def test_manifest():
+    import _imp
+    import zipfile
+    import hashlib
+    import zipextimporter
+    member = 'signed' + _imp.extension_suffixes()[-1]
+    data = make_pe(['PyInit_signed'], padding=0x10000)
+    dll = make_pe(['helper'])
+    digest = hashlib.sha256(data).hexdigest()
+    with zipfile.ZipFile('testsigned.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(member, data)
+        zf.writestr('helper.dll', dll, zipfile.ZIP_STORED)
+        zf.writestr('plain.py', b'value = 1')  # listed as "value = 2"
+        zf.writestr(zipextimporter.MANIFEST_NAME,
+                    f'{digest}  {member}\n'
+                    f'{hashlib.sha256(dll).hexdigest()} *helper.dll\n'
+                    f'{hashlib.sha256(b"value = 2").hexdigest()}  plain.py\n')
+    importer = zipextimporter.ZipExtensionImporter('testsigned.zip')
+    try:
+        zipextimporter.set_manifest('testsigned.zip')
+        assert importer.get_data(member) == data
+        assert importer.get_data('helper.dll') == dll
+        # the pure Python modules are compiled by zipimport, not verified,
+        # the tampered member is only rejected by `get_data`
+        code = importer.get_code('plain')
+        namespace = {}
+        exec(code, namespace)
+        assert namespace['value'] == 1
+        try:
+            importer.get_data('plain.py')
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'tampered member was not rejected'
+
+        # the file of a cached module is verified before used
+        os.environ['EGGS_CACHE'] = os.path.abspath('testeggs')
+        path_cache = zipextimporter._get_cached_path(importer, 'helper.dll')
+        with open(path_cache, 'r+b') as f:
+            f.write(b'XX')
+        assert zipextimporter._get_cached_path(importer, 'helper.dll') == path_cache
+        with open(path_cache, 'rb') as f:
+            assert f.read() == dll
+
+        # the member is hashed again, after it was changed in the file
+        with open('testsigned.zip', 'r+b') as f:
+            offset = f.read().index(dll)
+            f.seek(offset + len(dll) - 2)
+            f.write(b'XX')
+        try:
+            importer.get_data('helper.dll')
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'changed member was not rejected'
+        try:
+            importer.get_data(zipextimporter.MANIFEST_NAME)
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'unlisted member was not rejected'
+
+        # the mismatch is rejected before the extension is loaded
+        zipextimporter.set_manifest('testsigned.zip',
+                                    {member: digest[::-1]}, strict=False)
+        spec = importer.find_spec('signed')
+        try:
+            importer.create_module(spec)
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'mismatch was not rejected'
+    finally:
+        zipextimporter.set_manifest('testsigned.zip', False)
+
+def test_profile():
+    import time
+    import zipfile
+    import zipextimporter
+    members = {f'data{i}.bin': os.urandom(0x1000) * 4 for i in range(4)}
+    with zipfile.ZipFile('testprofile.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    if os.path.exists('testprofile.prf'):
+        os.remove('testprofile.prf')
+    def wait():
+        for _ in range(100):
+            if zipextimporter.get_profile_info()['done']:
+                break
+            time.sleep(0.01)
+    def run():
+        importer = zipextimporter.ZipExtensionImporter('testprofile.zip')
+        for name in ['data2.bin', 'data0.bin', 'data3.bin']:
+            assert importer.get_data(name) == members[name]
+    try:
+        zipextimporter.set_profile('testprofile.prf')  # nothing to replay
+        run()
+        zipextimporter.save_profile()
+        assert os.path.exists('testprofile.prf')
+
+        zipextimporter.set_profile('testprofile.prf', 'replay')
+        wait()
+        info = zipextimporter.get_profile_info()
+        assert info['members'] == info['prefetched'] == info['unused'] == 3, info
+        run()
+        info = zipextimporter.get_profile_info()
+        assert info['hits'] == 3 and info['hit_rate'] == 1.0, info
+        assert info['unused'] == info['wasted'] == 0, info
+
+        # the data read ahead is dropped by a new manifest, and verified
+        zipextimporter.set_profile('testprofile.prf', 'replay')
+        wait()
+        assert zipextimporter.get_profile_info()['unused'] == 3
+        zipextimporter.set_manifest('testprofile.zip',
+                                    {'data2.bin': '00' * 32}, strict=False)
+        assert zipextimporter.get_profile_info()['unused'] == 0
+        zipextimporter.set_profile('testprofile.prf', 'replay')
+        wait()
+        importer = zipextimporter.ZipExtensionImporter('testprofile.zip')
+        assert importer.get_data('data0.bin') == members['data0.bin']
+        try:
+            importer.get_data('data2.bin')
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'mismatch was not rejected'
+        # the data which has been read ahead is verified when taken
+        zipextimporter._profiled[importer.archive, 'data2.bin'] = members['data2.bin']
+        try:
+            importer.get_data('data2.bin')
+        except zipextimporter.IntegrityError as e:
+            print('excepted error:', repr(e))
+        else:
+            assert False, 'mismatch was not rejected'
+        zipextimporter.set_manifest('testprofile.zip', False)
+
+        # changed archive, nothing is read ahead
+        with zipfile.ZipFile('testprofile.zip', 'a') as zf:
+            zf.writestr('new.bin', b'new')
+        zipextimporter.set_profile('testprofile.prf', 'replay')
+        wait()
+        info = zipextimporter.get_profile_info()
+        assert info['prefetched'] == 0 and len(info['stale']) == 1, info
+    finally:
+        zipextimporter.set_profile(None)
+
+def test_optimize():
+    import zipfile
+    import importlib.util
+    import zipextimporter
+    from importlib._bootstrap_external import _code_to_hash_pyc
+    source = b'x = 1\n'
+    pyc = _code_to_hash_pyc(compile(source, 'mod.py', 'exec'),
+                            importlib.util.source_hash(source))
+    with zipfile.ZipFile('testopt.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('other.py', b'y = 2\n' * 100)
+        zf.writestr('mod.py', source)
+        zf.writestr('mod.pyc', pyc)
+        zf.writestr('helper.dll', make_pe(['helper'], padding=0x1000))
+        zf.writestr('pkg/fast.cp311-win_amd64.pyd',
+                    make_pe(['PyInit_fast'], ['helper.dll'], padding=0x1000))
+        zf.writestr('probed.dll', make_pe(['PyInit_probed']))
+        zf.writestr('data.bin', os.urandom(0x1000))
+    with open('testopt.txt', 'w') as f:
+        f.write('import time: self [us] | cumulative | imported package\n'
+                'import time:       5 |          5 |   pkg.fast\n'
+                'import time:       5 |         10 | pkg\n')
+    order = zipextimporter._read_import_order('testopt.txt')
+    assert order == ['pkg.fast', 'pkg']
+    report = zipextimporter.optimize('testopt.zip', 'testopt.out.zip', order)
+    assert report['dropped_py'] == ['mod.py']
+    assert report['probes'] == [('helper.dll', 'not an extension'),
+                                ('probed.dll', 'extension')]
+    assert 'data.bin' in report['stored']
+    assert 'other.py' in report['deflated']
+    with zipfile.ZipFile('testopt.out.zip') as zf:
+        names = zf.namelist()
+        assert names[:2] == ['pkg/fast.cp311-win_amd64.pyd', 'helper.dll']
+        assert 'mod.py' not in names and 'mod.pyc' in names
+        for name in report['aligned']:
+            info = zf.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_STORED
+            zf.fp.seek(info.header_offset + 26)
+            size, extra = zipextimporter.unpack_from('<HH', zf.fp.read(4))
+            assert (info.header_offset + 30 + size + extra) % 4096 == 0
+            assert info.extra == b''  # the central directory is not padded
+            assert zf.read(name)[:2] == b'MZ'
+
+    # the members which need zip64 have a larger local header
+    zip64_limit = zipfile.ZIP64_LIMIT
+    zipfile.ZIP64_LIMIT = 0x1000
+    try:
+        report = zipextimporter.optimize('testopt.zip', 'testopt64.zip', order)
+    finally:
+        zipfile.ZIP64_LIMIT = zip64_limit
+    with zipfile.ZipFile('testopt64.zip') as zf:
+        for name in report['aligned']:
+            info = zf.getinfo(name)
+            zf.fp.seek(info.header_offset + 26)
+            size, extra = zipextimporter.unpack_from('<HH', zf.fp.read(4))
+            assert (info.header_offset + 30 + size + extra) % 4096 == 0
+            assert zf.read(name)[:2] == b'MZ'
+
+def test_trace_hooks():
+    import memimport
+    import zipextimporter
+    zipextimporter.install()
+    if 'testpkg.zip' not in sys.path:
+        sys.path.insert(0, 'testpkg.zip')
+    events = []
+    memimport.add_trace_hook(events.append)
+    memimport.add_trace_hook(memimport.print_trace)
+    try:
+        sys.modules.pop('testpkg._memimporter', None)
+        import testpkg._memimporter
+    finally:
+        memimport.remove_trace_hook(events.append)
+        memimport.remove_trace_hook(memimport.print_trace)
+    phases = [e['phase'] for e in events if e['name'] == 'testpkg._memimporter']
+    assert phases[0] == 'lookup' and 'map' in phases, phases
+    assert any(e['phase'] == 'read' and e['bytes'] for e in events)
+    assert not memimport._trace_hooks
+
+def test_memfd_backend():
+    # Linux only, import extensions of the standard library from a zip file
+    if sys.platform != 'linux':
+        return
+    import zipfile
+    import _bisect
+    import memimport
+    import zipextimporter
+    with zipfile.ZipFile('testlinux.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.write(_bisect.__file__, 'testlinux/_bisect.so')
+    zipextimporter.install()
+    sys.path.insert(0, 'testlinux.zip')
+    import testlinux._bisect
+    print(testlinux._bisect)
+    assert memimport.import_module is memimport._import_module_memfd
+    assert isinstance(testlinux._bisect.__loader__, zipextimporter.ZipExtensionImporter)
+    assert testlinux._bisect.__file__ == 'testlinux.zip/testlinux/_bisect.so'
+    assert testlinux._bisect.bisect_right([1, 2, 3], 2) == 2
+
+def test_stats():
+    import _imp
+    import zipfile
+    import memimport
+    import zipextimporter
+    if sys.platform == 'linux':
+        import _bisect as ext
+    else:
+        import _memimporter as ext
+    name = ext.__name__
+    with zipfile.ZipFile('teststats.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.write(ext.__file__, f'teststats/{name}{_imp.extension_suffixes()[-1]}')
+        zf.writestr('teststats/__init__.py', '')
+    zipextimporter.install()
+    sys.path.insert(0, 'teststats.zip')
+    zipextimporter.stats(reset=True)
+    memimport.stats(reset=True)
+    __import__(f'teststats.{name}')
+    info = zipextimporter.stats()
+    counters = info['archives']['teststats.zip']
+    assert counters['hits'] >= 2 and counters['loaded'] == 1, counters
+    assert counters['bytes_inflated'] == os.path.getsize(ext.__file__), counters
+    assert info['total'] == counters, info
+    info = memimport.stats(reset=True)
+    assert info['modules'] == 1 and info['import_time'] > 0, info
+    assert memimport.stats()['modules'] == 0
+    assert zipextimporter.stats(reset=True)['archives']
+    assert not zipextimporter.stats()['archives']
+
+def test_memarchive():
+    import zipfile
+    import memarchive
+    with zipfile.ZipFile('testarc.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('testarc/__init__.py', b'')
+        zf.writestr('testarc/submod.py', b'loaded = True')
+        zf.writestr('testarc/data.txt', b'data' * 100)
+        zf.writestr('testarcns/submod.py', b'loaded = True')
+    memarchive.build('testarc.zip', 'testarc.mar')
+    memarchive.install()
+    sys.path.insert(0, 'testarc.mar')
+    import testarc.submod
+    import testarcns.submod
+    print(testarc.submod.__loader__)
+    assert isinstance(testarc.submod.__loader__, memarchive.MemArchiveImporter)
+    assert testarc.submod.loaded and testarcns.submod.loaded
+    assert testarc.__loader__.get_data(
+            os.path.join('testarc.mar', 'testarc', 'data.txt')) == b'data' * 100
+    assert testarc.submod.__loader__.get_source('testarc.submod') == 'loaded = True'
+
+    # the raw extension images are imported from memoryviews of the mapping
+    if sys.platform == 'linux':
+        import _bisect as ext
+        suffix = '.so'
+    else:
+        import _memimporter as ext
+        suffix = '.pyd'
+    with zipfile.ZipFile('testarcext.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('testarcext/__init__.py', b'')
+        zf.write(ext.__file__, f'testarcext/{ext.__name__}{suffix}')
+    memarchive.build('testarcext.zip', 'testarcext.mar')
+    sys.path.insert(0, 'testarcext.mar')
+    mod = __import__(f'testarcext.{ext.__name__}', fromlist=['_'])
+    print(mod)
+    assert isinstance(mod.__loader__, memarchive.MemArchiveImporter)
+    if ext.__name__ == '_bisect':
+        assert mod.bisect_right([1, 2, 3], 2) == 2
+
+    # works without install(), the importer does not import by itself
+    import subprocess
+    code = ('import sys, memarchive\n'
+            'sys.path_hooks.insert(0, memarchive.MemArchiveImporter)\n'
+            'sys.path_importer_cache.clear()\n'
+            'sys.path.insert(0, "testarc.mar")\n'
+            'import testarc.submod\n'
+            'assert testarc.submod.loaded\n')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(memarchive.__file__))
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+
+def test_httpimporter():
+    import json
+    import threading
+    import http.server
+    import httpimporter
+    files = {
+        'testhttp/__init__.py': b'',
+        'testhttp/submod.py': b'loaded = True',
+        'testhttpns/submod.py': b'loaded = True',
+        'Helper.DLL': b'MZ helper',
+    }
+    index = {'files': {path: {'etag': f'"{len(data)}"'}
+                       for path, data in files.items()}}
+    files['index.json'] = json.dumps(index).encode()
+    requests = []
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def do_GET(self):
+            requests.append(self.path)
+            data = files.get(self.path.lstrip('/'))
+            if data is None:
+                self.send_error(404)
+                return
+            etag = f'"{len(data)}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                data = b''
+            else:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(data)
+        def log_message(self, *args):
+            pass
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        httpimporter.install(cache_dir='testhttp_cache')
+        sys.path.insert(0, url)
+        import testhttp.submod
+        import testhttpns.submod
+        assert testhttp.submod.loaded and testhttpns.submod.loaded
+        assert testhttp.submod.__file__ == f'{url}/testhttp/submod.py'
+        # one connection, the index and the modules fetched once
+        assert httpimporter._pool.connects == 1, httpimporter._pool.connects
+        assert len(requests) == 4, requests
+        # the etags in the index match the local cache, no request
+        httpimporter.clear_cache()
+        del requests[:]
+        index['files']['testhttp/__init__.py']['etag'] = '"stale"'
+        files['index.json'] = json.dumps(index).encode()
+        loader = httpimporter.HttpImporter(url)
+        subloader = httpimporter.HttpImporter(f'{url}/testhttp')
+        assert subloader.get_code('testhttp.submod') is not None
+        assert requests == ['/index.json'], requests
+        # a stale etag is revalidated by a conditional request
+        assert loader.get_code('testhttp') is not None
+        assert requests == ['/index.json', '/testhttp/__init__.py'], requests
+        # the DLL names are matched case insensitively
+        assert loader.get_data('HELPER.dll') == files['Helper.DLL']
+        # the bodies in memory are bounded
+        assert httpimporter._bodies.bytes > 0
+        max_bytes = httpimporter._bodies.max_bytes
+        httpimporter._bodies.resize(0)
+        assert httpimporter._bodies.bytes == 0
+        assert loader.get_data('helper.dll') == files['Helper.DLL']
+        httpimporter._bodies.resize(max_bytes)
+    finally:
+        sys.path.remove(url)
+        httpimporter.clear_cache()
+        server.shutdown()
+
 
 if __name__ == '__main__':
+    import os
     import sys
     if 'prepare' in sys.argv:
         prepare()
     if 'test' in sys.argv:
         test_zipextimporter()
         test_memimport()
+        test_memimport_async()
+        test_concurrent_imports()
+        test_memory_info()
+        test_data_provider()
+        test_module_index()
+        test_lookup_cache()
+        test_preload()
+        test_data_cache()
+        test_index_cache()
+        test_eggs_cache()
+        test_pe_export_scan()
+        test_manifest()
+        test_optimize()
+        test_profile()
+        test_meta_path_finder()
+        test_trace_hooks()
+        test_memfd_backend()
+        test_stats()
+        test_memarchive()
+        test_httpimporter()
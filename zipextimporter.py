@@ -45,50 +45,82 @@ True
 """
 
 import sys
+import _io
+import marshal
 import zipimport
+from _thread import allocate_lock, start_new_thread, RLock
+from _struct import pack, unpack_from
 from zipimport import *
 from _frozen_importlib import ModuleSpec, spec_from_loader
-from _frozen_importlib_external import ExtensionFileLoader, spec_from_file_location
+from _frozen_importlib_external import (
+        ExtensionFileLoader, PathFinder, spec_from_file_location
+)
 
 from memimport import (
-        memimport, export_hook_name, __version__,
-        _path_join, _path_dirname, _path_basename, _path_exists, _makedirs
+        memimport, export_hook_name, __version__, path_sep, _os, _getenv, _setenv,
+        _path_join, _path_dirname, _path_basename, _path_exists, _path_stat,
+        _makedirs, _write_atomic, add_trace_hook, remove_trace_hook,
+        _trace_hooks, _trace, _load_spec, _spec_provider, DataProvider
 )
+import memimport as _memimport
 
 
 __all__ = [
-    'install', 'set_verbose',
+    'install', 'preload', 'PreloadTask', 'ZipMetaPathFinder', 'set_verbose',
     'set_exclude_modules', 'set_ver_binding_modules',
-    'list_exclude_modules', 'list_ver_binding_modules'
+    'list_exclude_modules', 'list_ver_binding_modules',
+    'set_lookup_cache_size', 'get_lookup_cache_info', 'clear_lookup_cache',
+    'set_index_cache', 'save_index_cache', 'set_prefetch_workers',
+    'set_data_cache', 'get_data_cache_info', 'set_eggs_cache_limit',
+    'add_trace_hook', 'remove_trace_hook', 'set_manifest', 'IntegrityError',
+    'MANIFEST_NAME', 'optimize', 'set_profile', 'save_profile',
+    'get_profile_info', 'stats'
 ]
 
 
 # Makes order as same as import from Non-Zip.
 def _generate_searchorders():
-    global _searchorder, _searchorder_pyver
+    global _searchorder, _searchorder_pyver, _searchsuffixes, _searchstems
     import _imp
     suffixes = _imp.extension_suffixes()
-    debug = '_d.pyd' in suffixes and '_d' or ''
     pyver = '%d%d' % sys.version_info[:2]
-    suffixes += [f'{pyver}{debug}.pyd']
-    suffixes += [suffix.replace('.pyd', '.dll') for suffix in suffixes]
-    suffixes += [debug, f'{pyver}{debug}']
+    windows = path_sep == '\\'
+    if windows:
+        debug = '_d.pyd' in suffixes and '_d' or ''
+        suffixes += [f'{pyver}{debug}.pyd']
+        suffixes += [suffix.replace('.pyd', '.dll') for suffix in suffixes]
+        suffixes += [debug, f'{pyver}{debug}']
     _searchorder_pyver = (
-        *[(f'\\__init__{suffix}', True, True) for suffix in suffixes],
-        ('\\__init__.pyc', False, True),
-        ('\\__init__.py', False, True),
+        *[(f'{path_sep}__init__{suffix}', True, True) for suffix in suffixes],
+        (f'{path_sep}__init__.pyc', False, True),
+        (f'{path_sep}__init__.py', False, True),
         *[(suffix, True, False) for suffix in suffixes],
         ('.pyc', False, False),
         ('.py', False, False),
     )
     _searchorder = [i for i in _searchorder_pyver
-                    if pyver not in i[0] or 'win' in i[0]]
+                    if not windows or pyver not in i[0] or 'win' in i[0]]
+    # suffix -> (rank, is_ext, is_package, probe, pyver_only), for indexing
+    # Only Windows PE images can be probed.
+    _searchsuffixes = {}
+    for rank, (suffix, is_ext, is_package) in enumerate(_searchorder_pyver):
+        _searchsuffixes.setdefault(suffix, (
+            rank, is_ext, is_package,
+            windows and is_ext and not suffix.endswith('.pyd'),
+            (suffix, is_ext, is_package) not in _searchorder
+        ))
+    # Suffixes which do not start with a dot, e.g. "311.dll", "_d"
+    _searchstems = tuple({suffix.partition('.')[0] for suffix in suffixes} - {''})
 
 _generate_searchorders(); del _generate_searchorders
+# The module state is shared by the importing threads. Writers hold the
+# lock, readers do not: the name sets are frozen and replaced as a whole, the
+# dicts are only changed by single operations.
+_state_lock = RLock()
 # pyver suffix, only match the last name
-_names_pyver = {'pywintypes', 'pythoncom'}
+_names_pyver = frozenset({'pywintypes', 'pythoncom'})
 # Use cache file instead of import from memory, only match the full name
-_names_cached = set()
+_names_cached = frozenset()
 
 
 class _ModuleInfo:
@@ -97,6 +129,23 @@ class _ModuleInfo:
         self.path, self.is_ext, self.is_package, self.cached = args
 
 
+# Cumulative counters per archive, see `stats`.
+_STATS_KEYS = ('lookups', 'hits', 'misses', 'probes', 'get_data', 'reads',
+               'bytes_inflated', 'extractions', 'extracted_bytes', 'loaded',
+               'loaded_cached')
+# archive -> {counter: value}
+_stats = {}
+_stats_lock = allocate_lock()
+
+def _count(archive, **counts):
+    with _stats_lock:
+        counters = _stats.get(archive)
+        if counters is None:
+            counters = _stats[archive] = dict.fromkeys(_STATS_KEYS, 0)
+        for counter, n in counts.items():
+            counters[counter] += n
+
+
 def _get_files(self):
     try:
         return self._files
@@ -104,131 +153,1407 @@ def _get_files(self):
         return self._get_files()  # py >= 313
 
 
+# (archive, prefix) -> (files, len(files), index)
+_module_indexes = {}
+# archive -> (files, len(files)), the directory which was indexed last time
+_indexed_files = {}
+
+# Return the module index of an importer, rebuild it if the directory changed.
+def _get_module_index(self):
+    files = _get_files(self)
+    key = self.archive, self.prefix
+    try:
+        files_indexed, size, index = _module_indexes[key]
+    except KeyError:
+        pass
+    else:
+        if files_indexed is files and size == len(files):
+            return index
+    index = _build_module_index(self.archive, self.prefix, files)
+    with _state_lock:
+        _module_indexes[key] = files, len(files), index
+        # drop the cached lookups only if the directory changed, not for the
+        # first index of a new prefix
+        indexed = _indexed_files.get(self.archive)
+        if indexed is None or indexed[0] is not files or indexed[1] != len(files):
+            _indexed_files[self.archive] = files, len(files)
+            if indexed is not None:
+                _lookup_cache.invalidate(self.archive)
+        if _index_cache_where:
+            _index_cache_dirty.add(self.archive)
+    return index
+
+# Map every importable name below the prefix to its candidates in search order
+# and its directory path, with a single pass over the directory.
+# name -> ((is_ext, is_package, probe, pyver_only, path), ...), dirpath or None)
+# The paths are separated by sep, it is "/" for URLs.
+def _build_module_index(archive, prefix, files, sep=path_sep):
+    candidates = {}
+    dirpaths = {}
+    searchsuffixes = _searchsuffixes
+    searchstems = _searchstems
+    n = len(prefix)
+    def add(name, suffix, path):
+        try:
+            candidates[name].append((*searchsuffixes[suffix], path))
+        except KeyError:
+            candidates[name] = [(*searchsuffixes[suffix], path)]
+    for path in files:
+        if n and not path.startswith(prefix):
+            continue
+        name, found, tail = path[n:].partition(sep)
+        if not name or '.' in name and found:
+            continue
+        if found:
+            if not tail:
+                dirpaths[name] = f'{archive}{sep}{prefix}{name}'
+            elif sep not in tail and f'{path_sep}{tail}' in searchsuffixes:
+                add(name, f'{path_sep}{tail}', path)
+            continue
+        name, dot, ext = name.partition('.')
+        suffix = dot + ext
+        if suffix in searchsuffixes:
+            add(name, suffix, path)
+        for stem in searchstems:
+            if (name.endswith(stem) and name != stem and
+                    stem + suffix in searchsuffixes):
+                add(name[:-len(stem)], stem + suffix, path)
+    index = {name: ((), dirpath) for name, dirpath in dirpaths.items()}
+    for name, found in candidates.items():
+        index[name] = (tuple(candidate[1:] for candidate in sorted(found)),
+                       dirpaths.get(name))
+    _verbose_msg('# zipextimporter: '
+                 'indexed {} names in {!r} with prefix {!r}',
+                 len(index), archive, prefix, verbosity=2)
+    return index
+
+
+class _LookupCache:
+    '''A bounded LRU cache of module lookups, include the misses.'''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        # archive -> [lookups, found, not found], the counters of `stats`,
+        # counted under the same lock
+        self.lookups = {}
+        self._data = {}
+        self._lock = allocate_lock()
+
+    def _count_lookup(self, archive, mi):
+        counts = self.lookups.get(archive)
+        if counts is None:
+            counts = self.lookups[archive] = [0, 0, 0]
+        counts[0] += 1
+        counts[mi is None and 2 or 1] += 1
+
+    # Return (True, mi) if the key has been cached, mi is None for misses.
+    def get(self, key):
+        with self._lock:
+            try:
+                mi = self._data.pop(key)
+            except KeyError:
+                return False, None
+            self._data[key] = mi  # move to the end, as most recently used
+            self.hits += 1
+            self._count_lookup(key[0], mi)
+            return True, mi
+
+    # Cache the result of a lookup which was not cached, count it as a miss.
+    def put(self, key, mi):
+        with self._lock:
+            self.misses += 1
+            self._count_lookup(key[0], mi)
+            data = self._data
+            data.pop(key, None)
+            data[key] = mi
+            while len(data) > self.maxsize:
+                del data[next(iter(data))]
+
+    # Drop entries of the archive, or all entries if archive is None.
+    def invalidate(self, archive=None):
+        with self._lock:
+            if archive is None:
+                self._data.clear()
+            else:
+                for key in [key for key in self._data if key[0] == archive]:
+                    del self._data[key]
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            data = self._data
+            while len(data) > maxsize:
+                del data[next(iter(data))]
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
+
+    def get_lookups(self, reset=False):
+        with self._lock:
+            lookups = {archive: tuple(counts)
+                       for archive, counts in self.lookups.items()}
+            if reset:
+                self.lookups.clear()
+        return lookups
+
+_lookup_cache = _LookupCache(4096)
+
+
 # Return some information about a module.
-def _get_module_info(self, fullname, _raise=False, _tempcache=[None, None]):
-    key, mi = _tempcache
-    if key == (fullname, self.archive):
-        return mi
+def _get_module_info(self, fullname, _raise=False):
+    index = _get_module_index(self)
+    key = self.archive, self.prefix, fullname
+    found, mi = _lookup_cache.get(key)
+    if not found:
+        mi = _find_module_info(self, fullname, index)
+        _lookup_cache.put(key, mi)
+    if mi is None and _raise:
+        raise ZipImportError(f"can't find module {fullname!r}", name=fullname)
+    return mi
+
+def _find_module_info(self, fullname, index):
     name = fullname.rpartition('.')[2]
-    initname = export_hook_name(name).encode()
-    if name in _names_pyver:
-        searchorder = _searchorder_pyver
-    else:
-        searchorder = _searchorder
-    _path = self.prefix + name
-    files = _get_files(self)
-    for suffix, is_ext, is_package in searchorder:
-        path = _path + suffix
-        if path not in files:
+    entry = index.get(name)
+    if entry is None:
+        return
+    pyver = name in _names_pyver
+    for is_ext, is_package, probe, pyver_only, path in entry[0]:
+        if pyver_only and not pyver:
             continue
         if not is_ext:
             return _ModuleInfo(path, is_ext, is_package, None)
-        if not suffix.endswith('.pyd') and initname not in self.get_data(path):
+        if probe and not _has_export(self, path, export_hook_name(name)):
             _verbose_msg('# zipextimporter: '
-                        f'skiped {path!r} in zipfile {self.archive!r}, '
-                         'it is not a Python extension', 2)
+                         'skiped {!r} in zipfile {!r}, '
+                         'it is not a Python extension',
+                         path, self.archive, verbosity=2)
             continue
         _verbose_msg('# zipextimporter: '
-                    f'found {path!r} in zipfile {self.archive!r}', 2)
-        mi = _ModuleInfo(
-            f'{self.archive}\\{path}',
+                     'found {!r} in zipfile {!r}', path, self.archive, verbosity=2)
+        return _ModuleInfo(
+            f'{self.archive}{path_sep}{path}',
             is_ext,
             is_package,
             fullname in _names_cached and _get_cached_path(self, path) or None
         )
-        _tempcache[:] = (fullname, self.archive), mi
-        return mi
-    if _raise:
-        raise ZipImportError(f"can't find module {fullname!r}", name=fullname)
 
 
-# Return the path of cached extension file, for loading memimport excluded modules.
-def _get_cached_path(self, path):
-    from nt import environ
-    eggs_cache = environ.get('EGGS_CACHE')
+class _MemberReader:
+    '''Random read a member of zip file, only decompress the needed part.'''
+    chunk_size = 0x10000
+
+    def __init__(self, archive, toc_entry):
+        datapath, compress, data_size, file_size, file_offset, *_ = toc_entry
+        self.archive = archive
+        self.size = file_size
+        self._fp = fp = _io.open_code(archive)
+        try:
+            self._start = _get_data_offset(fp, archive, file_offset)
+            self._left = data_size  # compressed bytes not yet read
+            self._buffer = bytearray()
+            if compress == 0:
+                self._decompressor = None
+            else:
+                from zlib import decompressobj
+                self._decompressor = decompressobj(-15)
+                fp.seek(self._start)
+        except:
+            fp.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._fp.close()
+
+    # Return the data at offset, may be shorter than size at the end.
+    def read(self, offset, size):
+        if offset < 0 or size < 0:
+            raise ValueError('negative offset or size')
+        end = min(offset + size, self.size)
+        if self._decompressor is None:
+            self._fp.seek(self._start + offset)
+            return self._fp.read(max(end - offset, 0))
+        buffer = self._buffer
+        decompressor = self._decompressor
+        while len(buffer) < end:
+            if decompressor.unconsumed_tail:
+                data = decompressor.unconsumed_tail
+            elif self._left > 0:
+                data = self._fp.read(min(self.chunk_size, self._left))
+                if not data:
+                    raise EOFError('EOF read where not expected')
+                self._left -= len(data)
+            elif decompressor.eof:
+                break
+            else:
+                data = b''  # drain the output which zlib still holds
+            part = decompressor.decompress(data, end - len(buffer))
+            if not (data or part):
+                break  # truncated data
+            buffer += part
+        return bytes(buffer[offset:end])
+
+
+# Return the offset of a member's data, skip its local file header.
+def _get_data_offset(fp, archive, file_offset):
+    fp.seek(file_offset)
+    buffer = fp.read(30)
+    if len(buffer) != 30 or buffer[:4] != b'PK\x03\x04':
+        raise ZipImportError(f'bad local file header: {archive!r}',
+                             path=archive)
+    name_size, extra_size = unpack_from('<HH', buffer, 26)
+    return file_offset + 30 + name_size + extra_size
+
+
+# Return the sections and data directories of a Windows PE image, or None if it
+# is not a PE image. Read headers only, read(offset, size) returns the data.
+def _pe_read_headers(read):
+    dos = read(0, 64)
+    if len(dos) < 64 or dos[:2] != b'MZ':
+        return
+    nt_offset, = unpack_from('<I', dos, 0x3c)
+    nt = read(nt_offset, 24)
+    if len(nt) < 24 or nt[:4] != b'PE\0\0':
+        return
+    nsections, = unpack_from('<H', nt, 6)
+    optsize, = unpack_from('<H', nt, 20)
+    opt = read(nt_offset + 24, optsize)
+    if len(opt) < 2:
+        return
+    magic, = unpack_from('<H', opt)
+    if magic == 0x10b:    # PE32
+        ndirs_offset = 92
+    elif magic == 0x20b:  # PE32+
+        ndirs_offset = 108
+    else:
+        return
+    if len(opt) < ndirs_offset + 4:
+        return
+    ndirs, = unpack_from('<I', opt, ndirs_offset)
+    ndirs = min(ndirs, (len(opt) - ndirs_offset - 4) // 8)
+    dirs = [unpack_from('<2I', opt, ndirs_offset + 4 + i * 8)
+            for i in range(ndirs)]
+    sections = read(nt_offset + 24 + optsize, nsections * 40)
+    if len(sections) < nsections * 40:
+        return
+    sections = [unpack_from('<4I', sections, i * 40 + 8)
+                for i in range(nsections)]
+    return sections, dirs
+
+def _pe_rva_to_offset(sections, rva):
+    for vsize, vaddr, rawsize, rawptr in sections:
+        if vaddr <= rva < vaddr + max(vsize, rawsize):
+            return rva - vaddr + rawptr
+    raise ValueError(f'bad RVA {rva:#x}')
+
+
+# Return True if the Windows PE image exports the name, read headers only.
+def _pe_has_export(read, name):
+    headers = _pe_read_headers(read)
+    if headers is None:
+        return False
+    sections, dirs = headers
+    if not dirs or not all(dirs[0]):
+        return False
+    try:
+        export = read(_pe_rva_to_offset(sections, dirs[0][0]), 40)
+        if len(export) < 40:
+            return False
+        nnames, = unpack_from('<I', export, 24)
+        names_rva, = unpack_from('<I', export, 32)
+        if not nnames:
+            return False
+        names = read(_pe_rva_to_offset(sections, names_rva), nnames * 4)
+        if len(names) < nnames * 4:
+            return False
+        # The export names are sorted, binary search it.
+        name = name.encode() + b'\0'
+        lo, hi = 0, nnames
+        while lo < hi:
+            mid = (lo + hi) // 2
+            rva, = unpack_from('<I', names, mid * 4)
+            found = read(_pe_rva_to_offset(sections, rva), len(name))
+            if found == name:
+                return True
+            if found < name:
+                lo = mid + 1
+            else:
+                hi = mid
+    except ValueError:
+        pass
+    return False
+
+
+# Return the names of DLLs which the Windows PE image imports.
+def _pe_imports(read):
+    headers = _pe_read_headers(read)
+    if headers is None:
+        return []
+    sections, dirs = headers
+    if len(dirs) < 2 or not all(dirs[1]):
+        return []
+    names = []
+    try:
+        offset = _pe_rva_to_offset(sections, dirs[1][0])
+        while True:
+            descriptor = read(offset, 20)
+            if len(descriptor) < 20 or not any(descriptor):
+                break
+            name_rva, = unpack_from('<I', descriptor, 12)
+            name = bytes(read(_pe_rva_to_offset(sections, name_rva), 260))
+            names.append(name.partition(b'\0')[0].decode('latin1'))
+            offset += 20
+    except ValueError:
+        pass
+    return names
+
+
+# (archive, path, crc, initname) -> exported
+_export_cache = {}
+
+# Return True if the member exports the init function, memoized by member CRC.
+def _has_export(self, path, initname):
+    toc_entry = _get_files(self)[path]
+    key = self.archive, path, toc_entry[7], initname
+    try:
+        return _export_cache[key]
+    except KeyError:
+        pass
+    _count(self.archive, probes=1)
+    try:
+        with _MemberReader(self.archive, toc_entry) as reader:
+            exported = _pe_has_export(reader.read, initname)
+    except Exception as e:
+        _verbose_msg('# zipextimporter: '
+                     'bad PE image {!r} in zipfile {!r}: {}',
+                     path, self.archive, e, verbosity=2)
+        exported = False
+    _export_cache[key] = exported
+    if _index_cache_where:
+        _index_cache_dirty.add(self.archive)
+    return exported
+
+
+# Call func(item) for each item in worker threads, the caller also works.
+# If "threads" is given, a list [running, max], the threads are also bounded
+# by it, across the calls which share it.
+# Return [(result, exception), ...] in the order of the items.
+def _map_parallel(func, items, workers, threads=None):
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+    lock = allocate_lock()
+    done = allocate_lock()
+    done.acquire()
+    running = [min(workers, len(items))]
+    if threads is not None and running[0] > 1:
+        with _threads_lock:
+            extra = max(min(running[0] - 1, threads[1] - threads[0]), 0)
+            threads[0] += extra
+        running[0] = extra + 1
+    def work(started=True):
+        while True:
+            with lock:
+                try:
+                    i, item = next(pending)
+                except StopIteration:
+                    break
+            try:
+                results[i] = func(item), None
+            except Exception as e:
+                results[i] = None, e
+        if started and threads is not None:
+            with _threads_lock:
+                threads[0] -= 1
+        with lock:
+            running[0] -= 1
+            if not running[0]:
+                done.release()
+    if running[0] < 1:
+        return results
+    for _ in range(running[0] - 1):
+        start_new_thread(work, ())
+    work(False)
+    done.acquire()
+    return results
+
+_threads_lock = allocate_lock()
+
+
+_prefetch_workers = 4
+# [running, max], the threads which read DLLs for all imports, the importing
+# threads read by themselves when they are all busy
+_prefetch_threads = [0, _prefetch_workers - 1]
+# Importers which have data in `_prefetched`, while loading
+_prefetching = set()
+# (archive, path) of DLLs which have been loaded by MemoryModule, it will not
+# call findproc with them again.
+_dlls_loaded = set()
+
+# archive -> (files, len(files), {path.lower(): path})
+_lower_files = {}
+
+# Return the member paths of an importer by their lowercase, the DLL names which
+# the images import are case insensitive, rebuild it if the directory changed.
+def _get_lower_files(self):
+    files = _get_files(self)
+    try:
+        files_mapped, size, lower_files = _lower_files[self.archive]
+    except KeyError:
+        pass
+    else:
+        if files_mapped is files and size == len(files):
+            return lower_files
+    lower_files = {path.lower(): path for path in files}
+    _lower_files[self.archive] = files, len(files), lower_files
+    return lower_files
+
+# Read the extension and the DLLs in the archive which it imports transitively,
+# the DLLs are read in parallel. Return {path: data} for the findproc.
+def _prefetch_dependencies(self, origin, workers=None):
+    prefetched = {}
+    if workers is None:
+        workers = _prefetch_workers
+    if workers < 1:
+        return prefetched
+    lower_files = _get_lower_files(self)
+    provider = _ZipDataProvider(self, workers)
+    prefetched[origin] = data = _read_data(self, origin, True)
+    archive = self.archive
+    seen = set()
+    images = [data]
+    while images:
+        names = []
+        for data in images:
+            for name in _pe_imports(_make_reader(data)):
+                name = lower_files.get(name.lower())
+                if (name is not None and name not in seen and
+                        (archive, name) not in _dlls_loaded):
+                    seen.add(name)
+                    names.append(name)
+        found = provider.get_many(names)
+        prefetched.update(found)
+        images = list(found.values())
+    if len(prefetched) > 1:
+        _verbose_msg('# zipextimporter: '
+                     'prefetched {} for {!r}',
+                     list(prefetched)[1:], origin, verbosity=2)
+    return prefetched
+
+def _make_reader(data):
+    return lambda offset, size: data[offset:offset+size]
+
+
+class _ZipDataProvider(DataProvider):
+    '''The members of the zip file, the images are read into bytearrays
+    without copies, the DLLs are resolved in parallel by `get_many`.'''
+    cacheable = True
+
+    def __init__(self, importer, workers=None):
+        self.importer = importer
+        self.workers = workers
+
+    def get(self, name):
+        return self.importer._get_image(name)
+
+    def size_hint(self, name):
+        cache_key = _get_data_cache_key(self.importer, name)
+        if cache_key is not None:
+            return _get_files(self.importer)[cache_key[1]][3]
+
+    def get_many(self, names):
+        importer = self.importer
+        workers = self.workers
+        if workers is None:
+            workers = _prefetch_workers
+        found = {}
+        for name, (data, e) in zip(names, _map_parallel(
+                self.get, names, max(workers, 1), _prefetch_threads)):
+            if e is None:
+                found[name] = data
+            else:
+                _verbose_msg('# zipextimporter: '
+                             'prefetch {!r} in zipfile {!r} failed: {}',
+                             name, importer.archive, e, verbosity=2)
+        return found
+
+
+class _DataCache:
+    '''A LRU cache of decompressed member data, bounded by a byte budget.'''
+    def __init__(self, max_bytes=0, max_member_size=None):
+        self.max_bytes = max_bytes
+        self.max_member_size = max_member_size
+        self.hits = self.misses = self.bypasses = 0
+        self.bytes = 0
+        self._data = {}
+        self._lock = allocate_lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                data = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return
+            self._data[key] = data  # move to the end, as most recently used
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        size = len(data)
+        with self._lock:
+            if (size > self.max_bytes or
+                    self.max_member_size is not None and
+                    size > self.max_member_size):
+                self.bypasses += 1
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._data[key] = data
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        data = self._data
+        while self.bytes > self.max_bytes:
+            self.bytes -= len(data.pop(next(iter(data))))
+
+    def pop(self, key):
+        with self._lock:
+            data = self._data.pop(key, None)
+            if data is not None:
+                self.bytes -= len(data)
+
+    def get_size(self, key):
+        with self._lock:
+            data = self._data.get(key)
+        return data is not None and len(data) or 0
+
+    def resize(self, max_bytes, max_member_size=None):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.max_member_size = max_member_size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'bypasses': self.bypasses, 'members': len(self._data),
+                    'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'max_member_size': self.max_member_size}
+
+_data_cache = _DataCache()
+# (archive, path) -> data, read by `preload` ahead of the imports
+_preloaded = {}
+
+
+# Return the key of a member in the data cache, None if it is not a member.
+def _get_data_cache_key(self, pathname):
+    archive = self.archive
+    key = pathname
+    if key.startswith(archive + path_sep):
+        key = key[len(archive)+1:]
+    toc_entry = _get_files(self).get(key)
+    if toc_entry is not None:
+        return archive, key, toc_entry[7]
+
+# Return the decompressed data of a member, through the data cache.
+# If stream is True, the data is read by `_read_member` into a bytearray.
+def _read_data(self, pathname, stream=False):
+    archive = self.archive
+    key = pathname
+    if key.startswith(archive + path_sep):
+        key = key[len(archive)+1:]
+    _count(archive, get_data=1)
+    if _preloaded:
+        data = _preloaded.pop((archive, key), None)
+        if data is not None:
+            return data
+    if _profile_record or _profile_replay:
+        data = _take_profiled(archive, key)
+        if data is not None:
+            manifest = _manifests.get(archive)
+            if manifest is not None:
+                _check_digest(archive, key, data, manifest)
+            return data
+    return _read_data_from_zip(self, pathname, key, stream)
+
+def _read_data_from_zip(self, pathname, key, stream):
+    archive = self.archive
+    toc_entry = _get_files(self).get(key)
+    if toc_entry is None:
+        return self.zipimporter.get_data(pathname)
+    if not (stream or _data_cache.max_bytes or _trace_hooks or _manifests):
+        data = self.zipimporter.get_data(pathname)
+        _count(archive, reads=1, bytes_inflated=toc_entry[1] and len(data))
+        return data
+    cache_key = archive, key, toc_entry[7]
+    if _data_cache.max_bytes:
+        data = _data_cache.get(cache_key)
+        if data is not None:
+            return data
+    def read():
+        if stream:
+            return _read_member(archive, toc_entry)
+        return self.zipimporter.get_data(pathname)
+    manifest = _manifests.get(archive)
+    if manifest is not None:
+        data = _get_data_verified(archive, key, toc_entry, manifest, read)
+    elif _trace_hooks:
+        data = _get_data_traced(archive, key, toc_entry)
+    else:
+        data = read()
+    _count(archive, reads=1, bytes_inflated=toc_entry[1] and len(data))
+    if _data_cache.max_bytes:
+        _data_cache.put(cache_key, data)
+    return data
+
+# Read a member without the intermediate copies of `zipimport._get_data`. The
+# compressed data is read into a reused buffer and streamed through the
+# decompressor into a presized bytearray, a stored member is read as bytes.
+# hash.update() is called with each part of the data, if hash is given.
+def _read_member(archive, toc_entry, hash=None):
+    datapath, compress, data_size, file_size, file_offset, *_ = toc_entry
+    with _io.open_code(archive) as fp:
+        fp.seek(_get_data_offset(fp, archive, file_offset))
+        if compress == 0:
+            # read into a new bytes directly, faster than fill a bytearray
+            data = fp.read(data_size)
+            if len(data) != data_size:
+                raise OSError("zipimport: can't read data")
+            if hash is not None:
+                hash.update(data)
+            return data
+        data = bytearray(file_size)
+        from zlib import decompressobj
+        decompressor = decompressobj(-15)
+        chunk_size = _MemberReader.chunk_size
+        buffer = memoryview(bytearray(min(chunk_size, data_size)))
+        output = memoryview(data)
+        offset = 0
+        left = data_size
+        while True:
+            # never inflate more than one byte over the size, to detect it
+            limit = min(chunk_size, file_size - offset + 1)
+            if decompressor.unconsumed_tail:
+                part = decompressor.decompress(decompressor.unconsumed_tail,
+                                               limit)
+            elif left > 0:
+                n = fp.readinto(buffer[:min(chunk_size, left)])
+                if not n:
+                    raise OSError("zipimport: can't read data")
+                left -= n
+                part = decompressor.decompress(buffer[:n], limit)
+            else:
+                # the output which is held by zlib, bounded also
+                part = decompressor.decompress(b'', limit)
+                if not part:
+                    break
+            end = offset + len(part)
+            if end > file_size:
+                raise ZipImportError(f'bad data size of {datapath!r}',
+                                     path=archive)
+            output[offset:end] = part
+            offset = end
+            if hash is not None:
+                hash.update(part)
+        if offset != file_size or decompressor.unconsumed_tail:
+            raise ZipImportError(f'bad data size of {datapath!r}', path=archive)
+    return data
+
+# Same as `zipimport._get_data`, but trace the read and the inflate apart.
+def _get_data_traced(archive, key, toc_entry):
+    clock = _memimport._perf_counter
+    datapath, compress, data_size, file_size, file_offset, *_ = toc_entry
+    start = clock()
+    with _io.open_code(archive) as fp:
+        fp.seek(_get_data_offset(fp, archive, file_offset))
+        raw_data = fp.read(data_size)
+    if len(raw_data) != data_size:
+        raise OSError("zipimport: can't read data")
+    _trace('read', key, datapath, start, data_size)
+    if compress == 0:
+        return raw_data
+    from zlib import decompress
+    start = clock()
+    data = decompress(raw_data, -15)
+    _trace('inflate', key, datapath, start, len(data))
+    return data
+
+
+################################################################################
+# Integrity verification
+################################################################################
+
+MANIFEST_NAME = 'MANIFEST.sha256'
+
+class IntegrityError(ZipImportError):
+    pass
+
+# archive -> ({path: sha256 digest}, strict)
+_manifests = {}
+
+# Return {path: digest} of a manifest, a mapping of paths -> hex digests, or
+# the lines of `sha256sum` output. The paths are separated by "/".
+def _parse_manifest(manifest):
+    if isinstance(manifest, (bytes, bytearray, memoryview)):
+        manifest = bytes(manifest).decode('utf-8')
+    if isinstance(manifest, str):
+        items = []
+        for line in manifest.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            digest, _, path = line.partition(' ')
+            items.append((path.lstrip(' *'), digest))
+    else:
+        items = manifest.items()
+    digests = {}
+    for path, digest in items:
+        try:
+            digest = bytes.fromhex(digest)
+        except (TypeError, ValueError):
+            digest = b''
+        if len(digest) != 32:
+            raise ValueError(f'bad SHA-256 digest of {path!r} in the manifest')
+        digests[path.replace('/', path_sep)] = digest
+    return digests
+
+# Return the digest of a member in the manifest, None if it is not listed and
+# the manifest is not strict, or the archive has no manifest.
+def _get_digest(archive, key, manifest):
+    digests, strict = manifest
+    digest = digests.get(key)
+    if digest is None and strict:
+        raise IntegrityError(f'{key!r} is not in the manifest of {archive!r}',
+                             path=archive)
+    return digest
+
+# Verify the data of a member which has been read, by the manifest.
+def _check_digest(archive, key, data, manifest):
+    digest = _get_digest(archive, key, manifest)
+    if digest is None:
+        return
+    from hashlib import sha256
+    if sha256(data).digest() != digest:
+        raise IntegrityError(f'SHA-256 digest of {key!r} in {archive!r} does '
+                             'not match the manifest', path=archive)
+
+# Read a member and verify it by the manifest, the digest is computed while
+# inflating, in the same pass. Every read from the file is hashed, the file
+# may be changed after the last read.
+def _get_data_verified(archive, key, toc_entry, manifest, read):
+    digest = _get_digest(archive, key, manifest)
+    if digest is None:
+        return read()
+    from hashlib import sha256
+    if _trace_hooks:
+        start = _memimport._perf_counter()
+    hash = sha256()
+    data = _read_member(archive, toc_entry, hash)
+    if hash.digest() != digest:
+        raise IntegrityError(f'SHA-256 digest of {key!r} in {archive!r} does '
+                             'not match the manifest', path=archive)
+    if _trace_hooks:
+        _trace('inflate', key, toc_entry[0], start, len(data))
+    _verbose_msg('# zipextimporter: verified {!r} in zipfile {!r}',
+                 key, archive, verbosity=2)
+    return data
+
+
+# Return the Eggs-Cache directory, for extracted files and index caches.
+def _get_eggs_cache():
+    eggs_cache = _getenv('EGGS_CACHE')
     if eggs_cache is None:
-        home = environ.get('PYTHONHOME')
+        home = _getenv('PYTHONHOME')
         if home is None:
             home = _path_dirname(_path_dirname(zipimport.__file__))
-        environ['EGGS_CACHE'] = eggs_cache = _path_join(home, 'Eggs-Cache')
-    path_cache = _path_join(eggs_cache,
-                            _path_basename(self.archive) + '-tmp',
-                            path)
-    if _path_exists(path_cache):
-        _verbose_msg('# zipextimporter: '
-                    f'found cached {path!r} at {path_cache!r}', 2)
-    else:
-        _makedirs(_path_dirname(path_cache))
-        open(path_cache, 'wb').write(self.get_data(path))
+        eggs_cache = _path_join(home, 'Eggs-Cache')
+        _setenv('EGGS_CACHE', eggs_cache)
+    return eggs_cache
+
+
+# Lock a file across processes, and across threads of this process.
+class _FileLock:
+    _thread_lock = allocate_lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._fp = _io.open(self.path, 'wb')
+            try:
+                _lock_file(self._fp.fileno())
+            except:
+                self._fp.close()
+                raise
+        except:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            _unlock_file(self._fp.fileno())
+        finally:
+            self._fp.close()
+            self._thread_lock.release()
+
+try:
+    from msvcrt import locking as _locking, LK_LOCK, LK_UNLCK
+except ImportError:
+    from fcntl import flock as _flock, LOCK_EX, LOCK_UN
+    def _lock_file(fd):
+        _flock(fd, LOCK_EX)
+    def _unlock_file(fd):
+        _flock(fd, LOCK_UN)
+else:
+    def _lock_file(fd):
+        while True:
+            try:
+                _locking(fd, LK_LOCK, 1)  # gives up after 10 attempts
+                return
+            except OSError:
+                pass
+    def _unlock_file(fd):
+        _locking(fd, LK_UNLCK, 1)
+
+
+# archive -> the cache directory of its extracted files
+_cache_dirs = {}
+# Limit of the total size of Eggs-Cache directories, None is unlimited
+_eggs_cache_limit = None
+
+# Return the cache directory of the archive, which is keyed by the CRC of its
+# central directory, so files of different archive contents never mix.
+def _get_cache_dir(archive):
+    try:
+        return _cache_dirs[archive]
+    except KeyError:
+        pass
+    try:
+        crc = _index_cache_ids[archive][2]
+    except KeyError:
+        crc = _get_archive_id(archive)[2]
+    cache_dir = _path_join(_get_eggs_cache(),
+                           f'{_path_basename(archive)}-{crc:08x}')
+    try:
+        _os.utime(cache_dir)  # mark as recently used, for the eviction
+    except OSError:
+        pass
+    _cache_dirs[archive] = cache_dir
+    return cache_dir
+
+
+# The file is verified by the CRC32 of the member, and by the SHA-256 digest
+# if it is given.
+def _is_cached(path_cache, toc_entry, digest=None):
+    try:
+        if _path_stat(path_cache).st_size != toc_entry[3]:
+            return False
+        with _io.open(path_cache, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+    from zlib import crc32
+    if crc32(data) != toc_entry[7]:
+        return False
+    if digest is None:
+        return True
+    from hashlib import sha256
+    return sha256(data).digest() == digest
+
+
+# Return the path of cached extension file, for loading memimport excluded modules.
+# The file is written to a temporary file then renamed, under a lock.
+def _get_cached_path(self, path):
+    toc_entry = _get_files(self)[path]
+    cache_dir = _get_cache_dir(self.archive)
+    path_cache = _path_join(cache_dir, path)
+    # the file of an archive which has a manifest is verified before used,
+    # a mismatched one is extracted again
+    manifest = _manifests.get(self.archive)
+    digest = manifest and _get_digest(self.archive, path, manifest)
+    if _is_cached(path_cache, toc_entry, digest):
         _verbose_msg('# zipextimporter: '
-                    f'extracted cached {path!r} to {path_cache!r}', 2)
+                     'found cached {!r} at {!r}', path, path_cache, verbosity=2)
+        return path_cache
+    data = self.get_data(path)
+    for retry in (True, False):
+        _makedirs(cache_dir)
+        try:
+            with _FileLock(_path_join(cache_dir, '.lock')):
+                if _is_cached(path_cache, toc_entry, digest):
+                    return path_cache
+                _makedirs(_path_dirname(path_cache))
+                _write_atomic(path_cache, data)
+            break
+        except FileNotFoundError:
+            # the directory has been removed by the eviction of other process
+            if not retry:
+                raise
+    _count(self.archive, extractions=1, extracted_bytes=len(data))
+    _verbose_msg('# zipextimporter: '
+                 'extracted cached {!r} to {!r}', path, path_cache, verbosity=2)
+    if _eggs_cache_limit is not None:
+        _evict_eggs_cache(_eggs_cache_limit)
     return path_cache
 
 
+# Return the total size of the files in the directory.
+def _get_dir_size(path):
+    size = 0
+    with _os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size += _get_dir_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+# Remove the directory if only the lock file is left.
+def _remove_lock_dir(path):
+    if _os.listdir(path) == ['.lock']:
+        _os.unlink(_path_join(path, '.lock'))
+        _os.rmdir(path)
+
+def _remove_dir(path, keep=None):
+    with _os.scandir(path) as entries:
+        for entry in list(entries):
+            if entry.is_dir(follow_symlinks=False):
+                _remove_dir(entry.path)
+            elif entry.name != keep:
+                _os.unlink(entry.path)
+    if keep is None:
+        _os.rmdir(path)
+
+# Remove least recently used cache directories, until their total size is not
+# larger than the limit. Directories which are used by this process are kept.
+def _evict_eggs_cache(limit):
+    eggs_cache = _get_eggs_cache()
+    in_use = set(_cache_dirs.values())
+    dirs = []
+    total = 0
+    try:
+        with _os.scandir(eggs_cache) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size = _get_dir_size(entry.path)
+                    total += size
+                    if entry.path not in in_use:
+                        dirs.append((entry.stat().st_mtime, entry.path, size))
+    except OSError:
+        return
+    for mtime, path, size in sorted(dirs):
+        if total <= limit:
+            break
+        try:
+            with _FileLock(_path_join(path, '.lock')):
+                _remove_dir(path, keep='.lock')
+            # files extracted by others after the lock was released are kept
+            _remove_lock_dir(path)
+        except OSError as e:  # files are in use by other processes
+            _verbose_msg('# zipextimporter: '
+                         'can not remove cache {!r}: {}', path, e, verbosity=2)
+        else:
+            total -= size
+            _verbose_msg('# zipextimporter: '
+                         'removed cache {!r}, {} bytes', path, size, verbosity=2)
+
+
+# Extract the modules in zip files on `sys.path` to the cache directories.
+def _extract_cached_modules(modules, workers):
+    # the lookup extracts it, from the first zip file which has it, the one
+    # which will be imported
+    def extract(fullname):
+        subpath = fullname.rpartition('.')[0].replace('.', path_sep)
+        for entry in sys.path:
+            if not isinstance(entry, str):
+                continue
+            try:
+                importer = zipimporter(
+                        subpath and f'{entry}{path_sep}{subpath}' or entry)
+            except ZipImportError:
+                continue
+            try:
+                mi = _get_module_info(ZipExtensionImporter(importer), fullname)
+            except Exception as e:
+                _verbose_msg('# zipextimporter: '
+                             'extract {!r} from {!r} failed: {}',
+                             fullname, importer.archive, e)
+                return
+            if mi is not None:
+                return
+    _map_parallel(extract, modules, workers)
+
+
 # Return the path if it represent a directory.
 def _get_dir_path(self, fullname):
-    path = self.prefix + fullname.rpartition('.')[2]
-    if f'{path}\\' in _get_files(self):
-        return f'{self.archive}\\{path}'
+    entry = _get_module_index(self).get(fullname.rpartition('.')[2])
+    if entry is not None:
+        return entry[1]
 
 
 # Implicit directories will cause namespace import fail, add them here.
+# Each directory prefix is checked only once, linear in total path length.
 def _fix_up_directory(files, archive=None):
-    def ensure_archive(path):
-        nonlocal archive, filter
-        archive = files[path][0][:-len(path)].rstrip('\\')
-        filter = fix_up_1
-        fix_up_1(path)
-    def fix_up_0(path):
-        nonlocal count
+    sep = path_sep
+    seen = set()
+    added = []
+    for path in files:
+        # skip the trailing separator of directories
+        i = path.rfind(sep, 0, -1)
+        if i < 0:
+            continue
+        dirpath = path[:i+1]
+        if dirpath in seen:
+            continue
+        if dirpath in files and not seen:
+            break  # quick finish, directories have been in the zip file
         while True:
-            i = path.rfind('\\')
+            seen.add(dirpath)
+            if dirpath not in files:
+                added.append(dirpath)
+            i = path.rfind(sep, 0, i)
             if i < 0:
-                return
+                break
             dirpath = path[:i+1]
-            if dirpath in files:
-                return
-            path = path[:i]
-            files[dirpath] = None  # ('\\'.join([archive, path]), *[0]*7)
-            count += 1
-    def fix_up_1(path):
-        nonlocal filter
-        fix_up_0(path)
-        if '\\' in path:
-            if count == 0:
-                return 1  # quick finish
-            filter = fix_up_0
-    count = 0
-    filter = archive is None and ensure_archive or fix_up_1
-    for path in tuple(files):
-        if filter(path):
-            break
-    if count:
+            if dirpath in seen:
+                break
+    if added:
+        if archive is None:
+            for path, toc_entry in files.items():
+                if toc_entry is not None:
+                    archive = toc_entry[0][:-len(path)].rstrip(sep)
+                    break
+        files.update(dict.fromkeys(added))  # (sep.join([archive, path]), *[0]*7)
         _verbose_msg('# zipextimporter: '
-                    f'added {count} implicit directories in {archive!r}')
+                     'added {} implicit directories in {!r}', len(added), archive)
     return files
 
 def _read_directory_fixed(archive):
-    return _fix_up_directory(zipimport._read_directory_orig(archive), archive)
+    if _index_cache_where:
+        files = _load_index_cache(archive)
+        if files is not None:
+            return files
+    files = zipimport._read_directory_orig(archive)
+    if _fix_up_needed:
+        _fix_up_directory(files, archive)
+    if _index_cache_where and archive in _index_cache_ids:
+        _index_cache_dirty.add(archive)
+    return files
 
 def _fix_up_read_directory():
-    if not hasattr(zipimport, '_read_directory_orig'):
+    with _state_lock:
+        if hasattr(zipimport, '_read_directory_orig'):
+            return
         zipimport._read_directory_orig = zipimport._read_directory
         try:
-            for files in zipimport._zip_directory_cache.values():
-                _fix_up_directory(files)
+            if _fix_up_needed:
+                for files in list(zipimport._zip_directory_cache.values()):
+                    _fix_up_directory(files)
         except:
             del zipimport._read_directory_orig
         else:
             zipimport._read_directory = _read_directory_fixed
             _verbose_msg('# zipextimporter: `_fix_up_read_directory()` succeeded')
 
+_fix_up_needed = (3, 8) < sys.version_info < (3, 14)
+
+
+################################################################################
+# Index cache files, skip parsing zip files at next start
+################################################################################
+
+# Where to save the index caches: None, 'archive' or 'cache'
+_index_cache_where = None
+# archive -> (size, mtime_ns, crc), the identity when the directory was read
+_index_cache_ids = {}
+# archives which have new directory, indexes or export probes to save
+_index_cache_dirty = set()
+_INDEX_CACHE_MAGIC = b'ZXIDX\x00\x01\x00'  # magic and format version
+
+
+# Return the identity of the archive: size, mtime and CRC of central directory.
+def _get_archive_id(archive):
+    from zlib import crc32
+    st = _path_stat(archive)
+    with _io.open_code(archive) as fp:
+        size = fp.seek(0, 2)
+        tail = min(size, 0x10000 + 22)  # max comment length + EOCD size
+        fp.seek(size - tail)
+        data = fp.read(tail)
+        pos = data.rfind(b'PK\x05\x06')
+        if pos < 0 or len(data) - pos < 22:
+            raise ZipImportError(f'not a Zip file: {archive!r}', path=archive)
+        cd_size, = unpack_from('<I', data, pos + 12)
+        cd_start = size - tail + pos - cd_size
+        if cd_start < 0:
+            raise ZipImportError(f'bad central directory size: {archive!r}',
+                                 path=archive)
+        fp.seek(cd_start)
+        crc = crc32(fp.read(cd_size))
+    return st.st_size, st.st_mtime_ns, crc32(data[pos:], crc)
+
+
+def _get_index_cache_path(archive):
+    if _index_cache_where == 'archive':
+        return f'{archive}.idx'
+    from zlib import crc32
+    name = _path_basename(archive)
+    crc = crc32(archive.encode('utf-8', 'surrogatepass'))
+    return _path_join(_get_eggs_cache(), f'{name}-{crc:08x}.idx')
+
+
+def _get_index_cache_header(archive_id):
+    return _INDEX_CACHE_MAGIC + pack('<QqI', *archive_id)
+
+
+# Load the index cache, return the directory of the archive, or None if stale.
+# If files is provided, the directory has been read, only load the others.
+def _load_index_cache(archive, files=None):
+    try:
+        _index_cache_ids[archive] = archive_id = _get_archive_id(archive)
+    except Exception as e:
+        _verbose_msg('# zipextimporter: '
+                     'can not identify {!r}: {}', archive, e, verbosity=2)
+        return
+    path = _get_index_cache_path(archive)
+    header = _get_index_cache_header(archive_id)
+    try:
+        with _io.open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(header)] != header:
+            _verbose_msg('# zipextimporter: '
+                         'stale index cache {!r} of {!r}',
+                         path, archive, verbosity=2)
+            return
+        with memoryview(data) as view:
+            payload = marshal.loads(view[len(header):])
+        archive_saved, files_saved, indexes, exports = payload
+        if archive_saved != archive:
+            return
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        _verbose_msg('# zipextimporter: '
+                     'bad index cache {!r} of {!r}: {}',
+                     path, archive, e, verbosity=2)
+        return
+    if files is None:
+        files = files_saved
+    elif files.keys() != files_saved.keys():
+        return
+    for prefix, index in indexes.items():
+        _module_indexes[archive, prefix] = files, len(files), index
+    for key, exported in exports.items():
+        _export_cache[(archive, *key)] = exported
+    _verbose_msg('# zipextimporter: '
+                 'loaded index cache {!r} of {!r}', path, archive, verbosity=2)
+    return files
+
+
+# Save the directory, indexes and export probes of the archive.
+def _save_index_cache(archive):
+    files = zipimport._zip_directory_cache.get(archive)
+    archive_id = _index_cache_ids.get(archive)
+    if files is None or archive_id is None:
+        return
+    indexes = {key[1]: index
+               for key, (files_indexed, size, index) in list(_module_indexes.items())
+               if key[0] == archive and files_indexed is files and size == len(files)}
+    exports = {key[1:]: exported
+               for key, exported in list(_export_cache.items())
+               if key[0] == archive}
+    data = _get_index_cache_header(archive_id) + \
+           marshal.dumps((archive, files, indexes, exports))
+    path = _get_index_cache_path(archive)
+    try:
+        _makedirs(_path_dirname(path))
+        _write_atomic(path, data)
+    except OSError as e:
+        _verbose_msg('# zipextimporter: '
+                     'can not save index cache {!r} of {!r}: {}',
+                     path, archive, e, verbosity=2)
+    else:
+        _index_cache_dirty.discard(archive)
+        _verbose_msg('# zipextimporter: '
+                     'saved index cache {!r} of {!r}', path, archive, verbosity=2)
+
+
+def _save_index_caches():
+    if not _index_cache_where:
+        return
+    for archive in list(_index_cache_dirty):
+        _save_index_cache(archive)
+
+
+################################################################################
+# Startup profiles, record the members which are read by the imports, prefetch
+# them in a background thread at next start
+################################################################################
+
+_PROFILE_MAGIC = b'ZXPRF\x00\x01\x00'  # magic and format version
+_profile_path = None
+_profile_record = False
+_profile_replay = False
+# (archive, key) -> None, the members in the order which they were read
+_profile_sequence = {}
+# the sequence which was loaded from the profile file
+_profile_loaded = ()
+# (archive, key) -> data read ahead, or None if it is not read yet
+_profiled = {}
+_profile_lock = allocate_lock()
+_profile_stats = {}
+
+
+def _reset_profile_stats():
+    _profile_stats.update(
+            members=0, prefetched=0, prefetched_bytes=0, hits=0, hit_bytes=0,
+            late=0, unprofiled=0, wasted=0, wasted_bytes=0, stale=[],
+            done=False, elapsed=0.0)
+
+_reset_profile_stats()
+
+
+# Record the member, and return the data which has been read ahead, or None.
+def _take_profiled(archive, key):
+    key = archive, key
+    if _profile_record:
+        _profile_sequence.setdefault(key)
+    if not _profile_replay:
+        return
+    stats = _profile_stats
+    with _profile_lock:
+        try:
+            data = _profiled.pop(key)
+        except KeyError:
+            stats['unprofiled'] += 1
+            return
+        if data is None:
+            # not read yet, the worker will skip it
+            stats['late'] += 1
+            return
+        stats['hits'] += 1
+        stats['hit_bytes'] += len(data)
+        return data
+
+
+# Read the members of the profile in order, in a background thread.
+def _replay_profile(ids, sequence):
+    perf_counter = _memimport._perf_counter
+    start = perf_counter()
+    stats = _profile_stats
+    importers = {}
+    try:
+        for archive, archive_id in ids.items():
+            try:
+                if _get_archive_id(archive) == archive_id:
+                    importers[archive] = ZipExtensionImporter(archive)
+                    continue
+            except Exception:
+                pass
+            stats['stale'].append(archive)
+            _verbose_msg('# zipextimporter: '
+                         'stale profile of {!r}', archive, verbosity=2)
+        for archive, key in sequence:
+            importer = importers.get(archive)
+            with _profile_lock:
+                if importer is None or _profiled.get((archive, key), 0) is not None:
+                    _profiled.pop((archive, key), None)
+                    continue  # stale, taken or stopped
+            try:
+                data = _read_data_from_zip(importer,
+                                           f'{archive}{path_sep}{key}', key, True)
+            except Exception as e:
+                _verbose_msg('# zipextimporter: '
+                             'prefetch {!r} in zipfile {!r} failed: {}',
+                             key, archive, e, verbosity=2)
+                with _profile_lock:
+                    _profiled.pop((archive, key), None)
+                continue
+            with _profile_lock:
+                stats['prefetched'] += 1
+                stats['prefetched_bytes'] += len(data)
+                if (archive, key) in _profiled:
+                    _profiled[archive, key] = data
+                else:
+                    # it has been read by the import, while reading here
+                    stats['wasted'] += 1
+                    stats['wasted_bytes'] += len(data)
+    finally:
+        stats['elapsed'] = perf_counter() - start
+        stats['done'] = True
+        _verbose_msg('# zipextimporter: '
+                     'prefetched {} members of profile in {:.3f}s',
+                     stats['prefetched'], stats['elapsed'], verbosity=2)
+
+
+def _load_profile(path):
+    try:
+        with _io.open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(_PROFILE_MAGIC)] != _PROFILE_MAGIC:
+            raise ValueError('bad magic')
+        ids, sequence = marshal.loads(data[len(_PROFILE_MAGIC):])
+        sequence = [tuple(member) for member in sequence]
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        _verbose_msg('# zipextimporter: '
+                     'bad profile {!r}: {}', path, e, verbosity=2)
+        return
+    return ids, sequence
+
+
+def _save_profile():
+    path = _profile_path
+    if not (_profile_record and path):
+        return
+    sequence = list(_profile_sequence)
+    if sequence == _profile_loaded:
+        return
+    ids = {}
+    for archive, key in sequence:
+        if archive not in ids:
+            try:
+                ids[archive] = _get_archive_id(archive)
+            except Exception as e:
+                ids[archive] = None
+                _verbose_msg('# zipextimporter: '
+                             'can not identify {!r}: {}', archive, e, verbosity=2)
+    sequence = [member for member in sequence if ids[member[0]]]
+    ids = {archive: archive_id for archive, archive_id in ids.items() if archive_id}
+    try:
+        _makedirs(_path_dirname(path))
+        _write_atomic(path, _PROFILE_MAGIC + marshal.dumps((ids, sequence)))
+    except OSError as e:
+        _verbose_msg('# zipextimporter: '
+                     'can not save profile {!r}: {}', path, e, verbosity=2)
+    else:
+        _verbose_msg('# zipextimporter: '
+                     'saved profile {!r}', path, verbosity=2)
+
 
 class ZipExtensionImporter(zipimporter):
     '''Import Python extensions from Zip files, just likes built-in zipimporter.
     Supported file extensions: "pyd", "dll", " "(none).
     '''
     def __init__(self, path_or_importer):
+        self._prefetched = {}  # path -> data, read ahead for the findproc
+        self._provider = _ZipDataProvider(self)
         if isinstance(path_or_importer, zipimporter):
             self.zipimporter = path_or_importer
         else:
@@ -275,6 +1600,17 @@ class ZipExtensionImporter(zipimporter):
 
     if hasattr(zipimporter, 'find_spec'):
         def find_spec(self, fullname, target=None):
+            if not _trace_hooks:
+                return ZipExtensionImporter._find_spec(self, fullname)
+            start = _memimport._perf_counter()
+            spec = ZipExtensionImporter._find_spec(self, fullname)
+            if spec is not None:
+                _trace('lookup', fullname, spec.origin, start)
+            return spec
+
+        def _find_spec(self, fullname):
+            if _meta_path_finder._rejects(self, fullname):
+                return None
             mi = _get_module_info(self.zipextimporter, fullname)
             if mi is None:
                 dirpath = _get_dir_path(self, fullname)
@@ -286,10 +1622,13 @@ class ZipExtensionImporter(zipimporter):
             if mi.is_ext:
                 search = mi.is_package and [_path_dirname(mi.path)] or None
                 if mi.cached:
+                    _count(self.archive, loaded_cached=1)
                     return spec_from_file_location(
                             fullname, mi.cached,
                             submodule_search_locations=search)
-                spec = ModuleSpec(fullname, self.zipextimporter, origin=mi.path)
+                loader = self.zipextimporter
+                spec = ModuleSpec(fullname, loader, origin=mi.path,
+                                  loader_state=loader.get_data_provider())
                 spec.submodule_search_locations = search
             else:
                 try:
@@ -306,14 +1645,48 @@ class ZipExtensionImporter(zipimporter):
                                       'use create_module() instead.')
 
     def create_module(self, spec):
-        mod = memimport(spec=spec)
-        _verbose_msg(f'import {spec.name} # loaded from zipfile {mod.__file__}')
+        prefetched = _prefetch_dependencies(self, spec.origin)
+        self._prefetched.update(prefetched)
+        _prefetching.add(self)
+        try:
+            mod = _load_spec(spec, _spec_provider(spec))
+        finally:
+            # other threads may have prefetched the same DLLs
+            for path, data in prefetched.items():
+                if self._prefetched.get(path) is data:
+                    self._prefetched.pop(path, None)
+            if not self._prefetched:
+                _prefetching.discard(self)
+        prefetched.pop(spec.origin, None)
+        _dlls_loaded.update((self.archive, path) for path in prefetched)
+        _count(self.archive, loaded=1)
+        _verbose_msg('import {} # loaded from zipfile {}', spec.name, mod.__file__)
         return mod
 
     def exec_module(self, module):
         # all has been done in create_module(), also skip importlib.reload()
         pass
 
+    def get_data(self, pathname):
+        data = self._prefetched.get(pathname)
+        if data is None:
+            data = _read_data(self, pathname)
+        if isinstance(data, bytearray):
+            data = bytes(data)  # the images are shared, do not let it change
+        return data
+
+    def get_data_provider(self):
+        return self._provider
+
+    # The images are read into bytearrays without copies, see the provider.
+    def _get_image(self, pathname):
+        # the findproc is called with the DLL names as the images import them
+        pathname = _get_lower_files(self).get(pathname.lower(), pathname)
+        data = self._prefetched.get(pathname)
+        if data is None:
+            data = _read_data(self, pathname, True)
+        return data
+
     def get_code(self, fullname):
         mi = _get_module_info(self, fullname, _raise=True)
         if not mi.is_ext:
@@ -324,6 +1697,17 @@ class ZipExtensionImporter(zipimporter):
         if not mi.is_ext:
             return self.zipimporter.get_source(fullname)
 
+    # The image has been copied while loading, drop it from the data cache,
+    # the DLLs are kept for other extensions.
+    def release_data(self, fullname):
+        cache_key = _get_data_cache_key(self, self.get_filename(fullname))
+        if cache_key is not None:
+            _data_cache.pop(cache_key)
+
+    def get_retained_bytes(self, fullname):
+        cache_key = _get_data_cache_key(self, self.get_filename(fullname))
+        return cache_key and _data_cache.get_size(cache_key) or 0
+
     def get_filename(self, fullname):
         mi = _get_module_info(self, fullname, _raise=True)
         return mi.path
@@ -333,17 +1717,281 @@ class ZipExtensionImporter(zipimporter):
         return mi.is_package
 
     def __repr__(self):
-        return f'<ZipExtensionImporter object "{self.archive}\\{self.prefix}">'
+        return f'<ZipExtensionImporter object "{self.archive}{path_sep}{self.prefix}">'
 
 
-def install(hook=hasattr(zipimporter, '_files')):
-    '''Install the zipextimporter.'''
-    if hook:
-        _install_hook()
-    else:
-        _monkey_patch()
-    if (3, 8) < sys.version_info < (3, 14):
-        _fix_up_read_directory()
+class ZipMetaPathFinder:
+    '''A `sys.meta_path` finder for the top-level modules in the zip files on
+    `sys.path`, see `install`. The names of all zip files are indexed in one
+    map, name -> the first entry of `sys.path` which has it, so the importers
+    of the other zip files are not asked. The names which are not in any zip
+    file are answered at once, `PathFinder` will search the other entries.
+    The map is rebuilt when `sys.path` changed, or `invalidate_caches()`.
+    '''
+    def __init__(self):
+        # (sys.path copy, {name: index}, {all names and dirs}, {zip entries},
+        #  {archives})
+        self._state = None
+
+    def _get_state(self):
+        state = self._state
+        if state is not None and state[0] == sys.path:
+            return state
+        path = list(sys.path)
+        first = {}
+        names = set()
+        zips = set()
+        archives = set()
+        for i, entry in enumerate(path):
+            finder = PathFinder._path_importer_cache(entry)
+            if not isinstance(finder, zipimporter) or finder.prefix:
+                continue
+            zips.add(entry)
+            archives.add(finder.archive)
+            index = _get_module_index(finder.zipextimporter)
+            names.update(index)
+            for name, (candidates, dirpath) in index.items():
+                if candidates and name not in first:
+                    first[name] = i
+        self._state = state = path, first, names, zips, archives
+        _verbose_msg('# zipextimporter: '
+                     'indexed {} names in {} zip files on sys.path',
+                     len(names), len(zips), verbosity=2)
+        return state
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None:
+            return  # submodules, search in the package's __path__
+        path, first, names, zips, archives = self._get_state()
+        i = first.get(fullname)
+        if i is None:
+            return
+        # the entries before it which are not zip files may shadow it
+        for entry in path[:i]:
+            if entry in zips:
+                continue
+            finder = PathFinder._path_importer_cache(entry)
+            if finder is None:
+                continue
+            spec = finder.find_spec(fullname)
+            if spec is not None:
+                if spec.loader is None:
+                    return  # namespace portion, left to PathFinder
+                return spec
+        spec = PathFinder._path_importer_cache(path[i]).find_spec(fullname)
+        if spec is not None and spec.loader is not None:
+            return spec
+
+    # Return True if the name is not in any zip file on sys.path, the zip
+    # importer of an entry can skip the lookup.
+    def _rejects(self, importer, fullname):
+        state = self._state
+        return (state is not None and state[0] == sys.path and
+                not importer.prefix and importer.archive in state[4] and
+                fullname not in state[2])
+
+    def invalidate_caches(self):
+        self._state = None
+
+_meta_path_finder = ZipMetaPathFinder()
+
+
+# Return the names of all modules in the directory of a zip file.
+def _list_modules(files):
+    names = []
+    searchsuffixes = _searchsuffixes
+    searchstems = _searchstems
+    sep = path_sep
+    for path in files:
+        head, _, tail = path.rpartition(sep)
+        if not tail or '.' in head:
+            continue
+        package = head.replace(sep, '.')
+        if head and f'{sep}{tail}' in searchsuffixes:
+            names.append(package)  # __init__
+            continue
+        name, dot, ext = tail.partition('.')
+        suffix = dot + ext
+        found = []
+        if suffix in searchsuffixes:
+            found.append(name)
+        for stem in searchstems:
+            if (name.endswith(stem) and name != stem and
+                    stem + suffix in searchsuffixes):
+                found.append(name[:-len(stem)])
+        names.extend(package and f'{package}.{name}' or name for name in found)
+    return list(dict.fromkeys(names))
+
+
+class PreloadTask:
+    '''Preload modules from a zip file, see `preload`.'''
+    def __init__(self, archive, patterns, workers):
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        self.archive = archive
+        self.patterns = list(patterns)
+        self.workers = workers
+        self.report = None
+        self.error = None
+        self._done = allocate_lock()
+        self._done.acquire()
+
+    @property
+    def done(self):
+        return self.report is not None
+
+    def wait(self, timeout=None):
+        '''Wait for the preload, return the report, or None if timeout or
+        failed, the exception is saved as attribute "error".
+        '''
+        if self._done.acquire(True, -1 if timeout is None else timeout):
+            self._done.release()
+        return self.report
+
+    def run(self):
+        try:
+            self.report = self._run()
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self._done.release()
+
+    def _run(self):
+        perf_counter = _memimport._perf_counter
+        start = perf_counter()
+        archive = zipimporter(self.archive).archive
+        files = _get_files(zipimporter(archive))
+        names = []
+        all_names = None
+        for pattern in self.patterns:
+            if any(c in pattern for c in '*?['):
+                if all_names is None:
+                    all_names = _list_modules(files)
+                import fnmatch
+                names.extend(fnmatch.filter(all_names, pattern))
+            else:
+                names.append(pattern)
+        names = list(dict.fromkeys(names))
+        # parent packages first
+        names.sort(key=lambda name: name.count('.'))
+        modules = {name: {'name': name, 'path': None, 'bytes': 0,
+                          'read': 0.0, 'import': 0.0, 'error': None}
+                   for name in names}
+
+        # Resolve and read extensions and the DLLs they import, in parallel.
+        importers = {}
+        tasks = []
+        for name in names:
+            if name in sys.modules:
+                continue
+            subpath = name.rpartition('.')[0].replace('.', path_sep)
+            try:
+                importer = importers[subpath]
+            except KeyError:
+                importer = importers[subpath] = ZipExtensionImporter(
+                        subpath and f'{archive}{path_sep}{subpath}' or archive)
+            mi = _get_module_info(importer, name)
+            if mi is None:
+                modules[name]['error'] = 'not found'
+                continue
+            modules[name]['path'] = mi.path
+            if mi.is_ext and not mi.cached:
+                tasks.append((importer, name, mi.path))
+        def read(task):
+            importer, name, path = task
+            start = perf_counter()
+            prefetched = _prefetch_dependencies(importer, path, workers=1)
+            modules[name]['read'] = perf_counter() - start
+            modules[name]['bytes'] = len(prefetched.get(path, b''))
+            return prefetched
+        preloaded = []
+        for (importer, name, path), (prefetched, e) in zip(
+                tasks, _map_parallel(read, tasks, self.workers)):
+            if e is not None:
+                modules[name]['error'] = repr(e)
+                continue
+            for pathname in prefetched:
+                key = pathname
+                if key.startswith(archive + path_sep):
+                    key = key[len(archive)+1:]
+                _preloaded[archive, key] = prefetched[pathname]
+                preloaded.append((archive, key))
+
+        # Import them in order, the module locks of importlib make it safe
+        # while other threads are importing.
+        try:
+            for name in names:
+                module = modules[name]
+                if module['error']:
+                    continue
+                start_import = perf_counter()
+                try:
+                    __import__(name)
+                except Exception as e:
+                    module['error'] = repr(e)
+                module['import'] = perf_counter() - start_import
+        finally:
+            for key in preloaded:
+                _preloaded.pop(key, None)
+        report = {
+            'archive': archive,
+            'elapsed': perf_counter() - start,
+            'modules': list(modules.values()),
+            'failed': [name for name, module in modules.items()
+                       if module['error']],
+        }
+        _verbose_msg('# zipextimporter: '
+                     'preloaded {} modules from {!r} in {:.3f}s',
+                     len(names) - len(report['failed']), archive,
+                     report['elapsed'])
+        return report
+
+
+def preload(archive, patterns, workers=4, background=False):
+    '''Preload modules from a zip file on `sys.path`, e.g. extensions which
+    will be imported later. The modules are resolved by names or glob patterns
+    (e.g. "pkg.*"), extensions and the DLLs they import are decompressed by
+    "workers" threads, then imported in order, parent packages first.
+    Notice:
+        The order is not resolved from the imports of the modules, a module
+        which imports a later one just imports it as usual.
+        The modules are imported by `__import__`, the archive MUST be on
+        `sys.path`, and the modules of the same names in the entries before
+        it win, the data read for them will be dropped.
+    Return a report dict:
+        "archive", "elapsed" (seconds), "failed" (names), and "modules", a
+        list of {"name", "path", "bytes", "read", "import", "error"}.
+    If "background" is True, run in a new thread, return a `PreloadTask`,
+    use its `wait()` to get the report.
+    '''
+    task = PreloadTask(archive, patterns, workers)
+    if background:
+        start_new_thread(task.run, ())
+        return task
+    task.run()
+    return task.report
+
+
+def install(hook=hasattr(zipimporter, '_files'), meta_path=False):
+    '''Install the zipextimporter.
+    If "meta_path" is True, also install a `ZipMetaPathFinder` before the
+    `PathFinder`, it finds the top-level modules of all zip files on
+    `sys.path` in one lookup.
+    '''
+    with _state_lock:
+        if hook:
+            _install_hook()
+        else:
+            _monkey_patch()
+        if _fix_up_needed:
+            _fix_up_read_directory()
+        if meta_path and _meta_path_finder not in sys.meta_path:
+            try:
+                i = sys.meta_path.index(PathFinder)
+            except ValueError:
+                i = len(sys.meta_path)
+            sys.meta_path.insert(i, _meta_path_finder)
 
 def _install_hook():
     '''Install the zipextimporter to `sys.path_hooks`.'''
@@ -387,12 +2035,34 @@ def _monkey_patch():
         zipimporter.find_spec = ZipExtensionImporter.find_spec
 
 
-def set_exclude_modules(modules):
+def set_exclude_modules(modules, extract=False, workers=4):
     '''Set modules which will not be import from memory, instead use cache file.
+    If "extract" is True, extract the modules which are found in zip files on
+    `sys.path` to the Eggs-Cache now, with "workers" threads.
     Notice:
         Please ensure input fullname of modules.
     '''
-    _set_importer(modules, _names_cached.add)
+    # `_get_cache_dir` may run inside a lookup, import zlib here, see
+    # `set_index_cache`
+    import zlib
+    _set_importer(modules, '_names_cached')
+    if extract:
+        if not isinstance(modules, (list, tuple)):
+            modules = [modules]
+        _extract_cached_modules(modules, workers)
+
+
+def set_eggs_cache_limit(max_bytes=None):
+    '''Limit the total size of the extracted files in the Eggs-Cache directory,
+    least recently used archives will be removed. None is unlimited.
+    '''
+    global _eggs_cache_limit
+    if max_bytes is not None:
+        max_bytes = int(max_bytes)
+        if max_bytes < 0:
+            raise ValueError(f'the cache size MUST be >= 0, not {max_bytes}')
+        _evict_eggs_cache(max_bytes)
+    _eggs_cache_limit = max_bytes
 
 
 def set_ver_binding_modules(modules):
@@ -417,26 +2087,479 @@ def list_ver_binding_modules():
     return list(_names_pyver)
 
 
+def set_lookup_cache_size(maxsize):
+    '''Set the max number of cached module lookups, include the misses.'''
+    maxsize = int(maxsize)
+    if maxsize < 0:
+        raise ValueError(f'the cache size MUST be >= 0, not {maxsize}')
+    _lookup_cache.resize(maxsize)
+
+
+def get_lookup_cache_info():
+    '''Return a dict of the module lookup cache counters: "hits", "misses"
+    (the lookups which were done and cached), "size" and "maxsize".
+    '''
+    return _lookup_cache.info()
+
+
+def clear_lookup_cache(archive=None):
+    '''Clear the cached module lookups of the archive, or of all archives.'''
+    _lookup_cache.invalidate(archive)
+
+
+def set_index_cache(where='archive'):
+    '''Save the directory, module indexes and extension probes of zip files to
+    index cache files, load them at next start instead of parsing zip files.
+    The caches will be saved at exit, stale or bad caches will be ignored.
+    Argument "where":
+        'archive' - save to "<archive>.idx", beside the zip file.
+        'cache'   - save to the Eggs-Cache directory.
+        None      - disable the index caches.
+    '''
+    global _index_cache_where
+    if where not in (None, 'archive', 'cache'):
+        raise ValueError(f"argument \"where\" MUST be None, 'archive' or "
+                         f"'cache', not {where!r}")
+    with _state_lock:
+        enabled = _index_cache_where
+        _index_cache_where = where
+        if not where or enabled:
+            return
+        if not hasattr(zipimport, '_read_directory'):  # py <= 37, built-in
+            _index_cache_where = None
+            raise RuntimeError('index cache requires Python 3.8 or later')
+        # `_get_archive_id` runs inside `zipimport._read_directory`, before
+        # the directory is cached, import zlib here, or the import will
+        # search the same zip file and read its directory again
+        import zlib
+        _fix_up_read_directory()
+        for archive, files in list(zipimport._zip_directory_cache.items()):
+            if archive not in _index_cache_ids:
+                if _load_index_cache(archive, files) is None:
+                    _index_cache_dirty.add(archive)
+    import atexit
+    atexit.unregister(_save_index_caches)
+    atexit.register(_save_index_caches)
+
+
+def save_index_cache(archive=None):
+    '''Save the index cache of the archive, or of all changed archives now.
+    Also see `set_index_cache`.
+    '''
+    if not _index_cache_where:
+        raise RuntimeError('index cache is disabled, call `set_index_cache` first')
+    if archive is None:
+        _save_index_caches()
+    else:
+        _save_index_cache(archive)
+
+
+def set_profile(path, mode='auto'):
+    '''Profile the startup, the members which are read by `get_data` and the
+    findproc, i.e. the extensions and the DLLs which they import, are recorded
+    in order to the profile file, keyed by the identities of the zip files.
+    At next start, a background thread reads them ahead of the imports.
+    Argument "mode":
+        'record' - record the members, save the profile at exit.
+        'replay' - prefetch the members of the profile.
+        'auto'   - replay the profile if it exists, and record this start, the
+                   profile is saved at exit if the members changed.
+        None     - stop profiling, drop the data which has not been used.
+    Call it before the imports, see `get_profile_info` for the hit rate.
+    '''
+    global _profile_path, _profile_record, _profile_replay, _profile_loaded
+    if mode not in (None, 'record', 'replay', 'auto'):
+        raise ValueError(f"argument \"mode\" MUST be None, 'record', 'replay' "
+                         f"or 'auto', not {mode!r}")
+    import atexit
+    with _state_lock:
+        with _profile_lock:
+            _profile_record = _profile_replay = False
+            _profile_stats['wasted'] += sum(data is not None
+                                            for data in _profiled.values())
+            _profile_stats['wasted_bytes'] += sum(len(data or b'')
+                                                  for data in _profiled.values())
+            _profiled.clear()
+        atexit.unregister(_save_profile)
+        if mode is None:
+            _profile_path = None
+            return
+        _profile_path = path
+        _profile_sequence.clear()
+        _profile_loaded = ()
+        _reset_profile_stats()
+        profile = None
+        if mode != 'record':
+            profile = _load_profile(path)
+        if mode != 'replay':
+            _profile_record = True
+            atexit.register(_save_profile)
+        if profile is None:
+            _profile_stats['done'] = True
+            return
+        ids, _profile_loaded = profile
+        _profiled.update(dict.fromkeys(_profile_loaded))
+        _profile_stats['members'] = len(_profiled)
+        _profile_replay = True
+        start_new_thread(_replay_profile, profile)
+
+
+def save_profile():
+    '''Save the recorded profile now, also see `set_profile`.'''
+    if not _profile_record:
+        raise RuntimeError('profile is not recording, call `set_profile` first')
+    _save_profile()
+
+
+def get_profile_info():
+    '''Return a dict of the profile counters:
+        "members" - number of members in the profile.
+        "prefetched", "prefetched_bytes" - read ahead by the background thread.
+        "hits", "hit_bytes" - members which were read ahead when imported.
+        "late" - members of the profile which were imported before read ahead.
+        "unprofiled" - reads of the members which are not in the profile.
+        "unused", "unused_bytes" - read ahead but not imported yet.
+        "wasted", "wasted_bytes" - read ahead but read by the import again, or
+                  dropped by `set_profile` without use.
+        "hit_rate" - hits / all reads, "stale" - archives which have changed.
+        "done" - whether the background thread has finished, "elapsed" - its
+                 seconds.
+    '''
+    with _profile_lock:
+        info = dict(_profile_stats, stale=list(_profile_stats['stale']))
+        unused = [data for data in _profiled.values() if data is not None]
+    info['unused'] = len(unused)
+    info['unused_bytes'] = sum(map(len, unused))
+    reads = info['hits'] + info['late'] + info['unprofiled']
+    info['hit_rate'] = reads and info['hits'] / reads or 0.0
+    return info
+
+
+def stats(reset=False):
+    '''Return a dict of the cumulative counters, {"archives": {archive:
+    counters}, "total": counters}, the counters are:
+        "lookups", "hits", "misses" - module lookups, found or not.
+        "probes" - PE images scanned for the init function of extensions.
+        "get_data" - calls of `get_data` and the findproc.
+        "reads", "bytes_inflated" - members read from the zip file, and the
+                 decompressed size of the compressed ones.
+        "extractions", "extracted_bytes" - members extracted to Eggs-Cache.
+        "loaded" - extensions loaded from memory.
+        "loaded_cached" - extensions found in Eggs-Cache, loaded from files.
+    If "reset" is True, zero the counters after read them. Also see
+    `memimport.stats` for the time spent in loading.
+    '''
+    with _stats_lock:
+        archives = {archive: dict(counters)
+                    for archive, counters in _stats.items()}
+        if reset:
+            _stats.clear()
+    for archive, (lookups, hits, misses) in _lookup_cache.get_lookups(reset).items():
+        counters = archives.get(archive)
+        if counters is None:
+            counters = archives[archive] = dict.fromkeys(_STATS_KEYS, 0)
+        counters.update(lookups=lookups, hits=hits, misses=misses)
+    total = dict.fromkeys(_STATS_KEYS, 0)
+    for counters in archives.values():
+        for counter, n in counters.items():
+            total[counter] += n
+    return {'archives': archives, 'total': total}
+
+
+def set_prefetch_workers(workers=4):
+    '''Set the number of threads which read the DLLs that an extension imports
+    from the zip file, before loading the extension. 0 disables the prefetch.
+    The threads are shared by the concurrent imports, an importing thread also
+    reads, and reads alone when they are all busy.
+    '''
+    global _prefetch_workers
+    workers = int(workers)
+    if workers < 0:
+        raise ValueError(f'the number of workers MUST be >= 0, not {workers}')
+    _prefetch_workers = workers
+    with _threads_lock:
+        _prefetch_threads[1] = workers - 1
+
+
+def set_data_cache(max_bytes, max_member_size=None):
+    '''Cache the decompressed data of members which are read by `get_data`,
+    e.g. DLLs which many extensions depend on. Least recently used data will
+    be dropped when the total size exceeds "max_bytes", 0 disables the cache.
+    Members larger than "max_member_size" will not be cached.
+    '''
+    max_bytes = int(max_bytes)
+    if max_bytes < 0:
+        raise ValueError(f'the cache size MUST be >= 0, not {max_bytes}')
+    if max_member_size is not None:
+        max_member_size = int(max_member_size)
+    _data_cache.resize(max_bytes, max_member_size)
+    if not max_bytes:
+        _data_cache.clear()
+
+
+def set_manifest(archive, manifest=None, strict=True):
+    '''Verify the members of a zip file by their SHA-256 digests, the data
+    which this importer reads itself: the extensions and DLLs which are loaded
+    from memory or extracted to Eggs-Cache, and `get_data`. The digest is
+    computed while decompressing, a mismatch raises `IntegrityError` before
+    the extension is loaded.
+    The pure Python modules (.py, .pyc) are read and compiled by zipimport,
+    they are NOT verified, verify the whole zip file if they need to be.
+    Argument "manifest":
+        A mapping of member paths -> hex digests, or bytes or str of the
+        `sha256sum` output, the paths are separated by "/". None to read the
+        MANIFEST_NAME member in the zip file, False to stop the verification.
+        Verify the signature of the manifest, before pass it to here.
+    Argument "strict":
+        If True, the members above which are not in the manifest will be
+        rejected.
+    '''
+    archive = zipimporter(archive).archive
+    if manifest is False:
+        _manifests.pop(archive, None)
+        return
+    if manifest is None:
+        manifest = zipimporter(archive).get_data(MANIFEST_NAME)
+    digests = _parse_manifest(manifest)
+    with _state_lock:
+        _manifests[archive] = digests, strict
+        # drop the data which has been read before
+        _data_cache.clear()
+        for key in list(_preloaded):
+            if key[0] == archive:
+                _preloaded.pop(key, None)
+        for importer in list(_prefetching):
+            if importer.archive == archive:
+                importer._prefetched.clear()
+        with _profile_lock:
+            for key in list(_profiled):
+                if key[0] == archive:
+                    _profiled.pop(key, None)
+
+
+def get_data_cache_info():
+    '''Return a dict of the data cache counters: "hits", "misses", "bypasses",
+    "members", "bytes", "max_bytes" and "max_member_size".
+    '''
+    return _data_cache.info()
+
+
 def _set_ver_binding_modules(modules, f=lambda m:str.rpartition(m,'.')[2]):
-    _set_importer(modules, _names_pyver.add, f)
+    _set_importer(modules, '_names_pyver', f)
 
 
-def _set_importer(modules, attrfunc, argsfunc=None):
+# Add the names to the frozen set of the global name, copy-on-write.
+def _set_importer(modules, setname, argsfunc=None):
     if not isinstance(modules, (list, tuple)):
         modules = [modules]
+    names = []
     for module in modules:
         if not isinstance(module, str):
             raise ValueError(f'the module name MUST be a str, not {type(module)}')
-        attrfunc(argsfunc and argsfunc(module) or module)
+        names.append(argsfunc and argsfunc(module) or module)
+    with _state_lock:
+        globals()[setname] = globals()[setname].union(names)
+        _lookup_cache.invalidate()
+
+
+################################################################################
+# Archive optimizer, `python -m zipextimporter optimize in.zip out.zip`
+################################################################################
+
+# The bundles may be built for another platform, the members are classified by
+# the suffixes of all platforms, the paths are separated by "/".
+def _is_binary_member(path):
+    tail = path.rpartition('/')[2].lower()
+    return tail.endswith(('.pyd', '.dll', '.so')) or '.so.' in tail
+
+# Return the module name of a member, or None.
+def _member_module_name(path):
+    head, _, tail = path.rpartition('/')
+    name, dot, suffix = tail.partition('.')
+    if not (suffix in ('py', 'pyc') or suffix.endswith(('pyd', 'dll', 'so'))):
+        return
+    if '.' in head or not name.isidentifier():
+        return
+    if name == '__init__':
+        return head.replace('/', '.') or None
+    return head and f'{head.replace("/", ".")}.{name}' or name
+
+# Return True if the pyc can be used without the source, the same check as
+# zipimport does when the source is present.
+def _pyc_matches_source(pyc, source, date_time):
+    import _imp
+    from _frozen_importlib_external import MAGIC_NUMBER
+    if len(pyc) < 16 or pyc[:4] != MAGIC_NUMBER:
+        return False
+    flags, = unpack_from('<I', pyc, 4)
+    if flags & 0b1:  # hash-based
+        return pyc[8:16] == _imp.source_hash(
+                int.from_bytes(MAGIC_NUMBER, 'little'), source)
+    from time import mktime
+    mtime, size = unpack_from('<II', pyc, 8)
+    source_mtime = int(mktime(date_time + (0, 0, -1)))
+    return size == len(source) & 0xFFFFFFFF and abs(mtime - source_mtime) <= 1
+
+# Return the order of the modules from a file, the names one per line, or the
+# output of `python -X importtime`, the nested imports come first in it.
+def _read_import_order(path):
+    names = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('import time:'):
+                name = line.rpartition('|')[2].strip()
+                if name == 'imported package':
+                    continue
+            else:
+                name = line.strip()
+                if not name or name.startswith('#'):
+                    continue
+            names.append(name)
+    return list(dict.fromkeys(names))
+
+def optimize(source, target, order=(), align=4096, keep_py=False,
+             min_saving=0.1):
+    '''Rewrite a zip file for import speed, return a report dict.
+
+    The extensions and DLLs are stored uncompressed, their data are aligned to
+    "align" bytes, by padding the extra field of the local headers. The other
+    members are deflated if it saves at least "min_saving" of the size, or
+    else stored. The modules in "order" and the DLLs they import come first,
+    in that order, the others keep their order. The ".py" members which have
+    an equivalent ".pyc" are dropped, unless "keep_py" is True.
+
+    The report lists the members which would be probed by the export scan of
+    the init function on Windows, "extension" ones should be renamed to
+    ".pyd", "not an extension" ones are scanned by every import of the name.
+    '''
+    import zlib
+    import zipfile
+    report = {'members': 0, 'aligned': [], 'deflated': [], 'stored': [],
+              'dropped_py': [], 'probes': [], 'bytes_in': 0, 'bytes_out': 0}
+    with zipfile.ZipFile(source) as zin:
+        infos = [info for info in zin.infolist() if not info.is_dir()]
+        paths = {info.filename: info for info in infos}
+        lower_paths = {path.lower(): path for path in paths}
+        # the modules in order, with the DLLs which they import
+        modules = {}
+        for path in paths:
+            name = _member_module_name(path)
+            if name is not None:
+                modules.setdefault(name, []).append(path)
+        ordered = {}
+        for name in order:
+            for path in modules.get(name, ()):
+                ordered[path] = None
+                if not _is_binary_member(path):
+                    continue
+                pending = [path]
+                while pending:
+                    data = zin.read(pending.pop())
+                    for dll in _pe_imports(_make_reader(data)):
+                        dll = lower_paths.get(dll.lower())
+                        if dll is not None and dll not in ordered:
+                            ordered[dll] = None
+                            pending.append(dll)
+        ordered.update(dict.fromkeys(paths))
+
+        with zipfile.ZipFile(target, 'w') as zout:
+            for path in ordered:
+                info = paths[path]
+                data = zin.read(info)
+                report['bytes_in'] += info.compress_size
+                if path.endswith('.py') and not keep_py:
+                    pyc = paths.get(path + 'c')
+                    if pyc is not None and _pyc_matches_source(
+                            zin.read(pyc), data, info.date_time):
+                        report['dropped_py'].append(path)
+                        continue
+                out = zipfile.ZipInfo(path, info.date_time)
+                out.external_attr = info.external_attr
+                if _is_binary_member(path):
+                    out.compress_type = zipfile.ZIP_STORED
+                    if align > 1:
+                        # measure the local header which will be written, with
+                        # an empty padding field, and the zip64 field if it is
+                        # needed, decided as `ZipFile.open` does
+                        out.extra = pack('<HH', 0xD935, 0)
+                        out.file_size = out.compress_size = len(data)
+                        out.CRC = 0
+                        zip64 = len(data) * 1.05 > zipfile.ZIP64_LIMIT
+                        offset = zout.fp.tell() + len(out.FileHeader(zip64))
+                        padding = -offset % align
+                        out.extra = pack('<HH', 0xD935, padding) + bytes(padding)
+                        report['aligned'].append(path)
+                    else:
+                        report['stored'].append(path)
+                    name = _member_module_name(path)
+                    if (name is not None and
+                            not path.lower().endswith('.pyd') and
+                            _pe_read_headers(_make_reader(data)) is not None):
+                        is_ext = _pe_has_export(_make_reader(data),
+                                                export_hook_name(name))
+                        report['probes'].append(
+                                (path, is_ext and 'extension' or
+                                       'not an extension'))
+                elif len(zlib.compress(data)) <= len(data) * (1 - min_saving):
+                    out.compress_type = zipfile.ZIP_DEFLATED
+                    report['deflated'].append(path)
+                else:
+                    out.compress_type = zipfile.ZIP_STORED
+                    report['stored'].append(path)
+                zout.writestr(out, data)
+                # the padding is only in the local header, not in the central
+                # directory which is read at startup
+                out.extra = b''
+                report['members'] += 1
+    report['bytes_out'] = _path_stat(target).st_size
+    return report
+
+def _main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+            prog='python -m zipextimporter',
+            description='Tools for the zip files which are imported from.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True  # the keyword argument is py >= 37
+    parser_optimize = commands.add_parser(
+            'optimize', help='rewrite a zip file for import speed')
+    parser_optimize.add_argument('source')
+    parser_optimize.add_argument('target')
+    parser_optimize.add_argument(
+            '--order', metavar='FILE',
+            help='the import order, module names one per line, or the '
+                 'output of `python -X importtime`')
+    parser_optimize.add_argument('--align', type=int, default=4096,
+                                 help='alignment of the extensions and DLLs')
+    parser_optimize.add_argument('--keep-py', action='store_true',
+                                 help='keep the sources which have a .pyc')
+    args = parser.parse_args(argv)
+    if args.command == 'optimize':
+        order = args.order and _read_import_order(args.order) or ()
+        report = optimize(args.source, args.target, order, args.align,
+                          args.keep_py)
+        print(f'{report["members"]} members, {report["bytes_in"]} -> '
+              f'{report["bytes_out"]} bytes')
+        print(f'  aligned: {len(report["aligned"])}, '
+              f'deflated: {len(report["deflated"])}, '
+              f'stored: {len(report["stored"])}, '
+              f'dropped .py: {len(report["dropped_py"])}')
+        for path, kind in report['probes']:
+            print(f'  probed by the export scan: {path} ({kind})')
 
 
 verbose = sys.flags.verbose
 
-def _verbose_msg(msg, verbosity=1):
+# The message is formatted with the arguments only if it will be printed.
+def _verbose_msg(msg, *args, verbosity=1):
     if max(verbose, sys.flags.verbose) >= verbosity:
-        print(msg, file=sys.stderr)
+        print(msg.format(*args), file=sys.stderr)
 
 def set_verbose(i=1):
     '''Set verbose, the argument as same as built-in function int's.'''
     global verbose
     verbose = int(i)
+
+
+if __name__ == '__main__':
+    _main()